@@ -19,6 +19,8 @@ For login user (create token) can be used by the third or fourth
 backends or both.
 """
 
+import hashlib
+import time
 from types import SimpleNamespace
 
 from django.contrib.auth.models import AnonymousUser
@@ -28,6 +30,8 @@ from rest_framework.authentication import BaseAuthentication, get_authorization_
 from oauth2_provider.backends import get_oauthlib_core
 import jwt
 
+from apps.base.lru import LRUCache
+from . import signed_tokens
 from .exceptions import TokenExpire
 
 
@@ -38,11 +42,19 @@ class JWTAuthentication(BaseAuthentication):
     anonymous user and None if Authentication header not exist.
     Raise exception AuthenticationFailed if header exist and
     there was error its verification.
+
+    Payloads of verified tokens are kept in a process wide LRU keyed by
+    sha256 of the token until their exp, or for GUEST_TOKEN_CACHE['TTL']
+    seconds at most, so the signature of a guest token is checked once per session.
     """
 
     jwt_secret = settings.SECRET_KEY
     jwt_prefix = "JWT"
     jwt_algorithm = "HS256"
+    verified_tokens = LRUCache(
+        max_size=settings.GUEST_TOKEN_CACHE['MAX_SIZE'],
+        ttl=settings.GUEST_TOKEN_CACHE['TTL'],
+    )
 
     def authenticate(self, request, **credentials):
         if request.method == "OPTIONS":
@@ -51,21 +63,39 @@ class JWTAuthentication(BaseAuthentication):
         auth_header = get_authorization_header(request).split()
         if not auth_header or len(auth_header) != 2:
             return None
-        token = auth_header[1]
+        payload = self.decode(auth_header[1])
+        if payload is None:
+            return None
+
+        user = AnonymousUser()
+        auth = SimpleNamespace()
+        auth.cached_auth = payload
+        return user, auth
+
+    def decode(self, token):
+        """Payload of a valid token, None if the token is invalid"""
+        digest = hashlib.sha256(token).hexdigest()
+        payload = self.verified_tokens.get(digest)
+        if payload is not None:
+            return payload
+
         try:
             payload = jwt.decode(
                 jwt=token,
                 key=self.jwt_secret,
-                algoritms=[self.jwt_algorithm],
+                algorithms=[self.jwt_algorithm],
                 verify=True,
             )
         except jwt.InvalidTokenError:
             return None
 
-        user = AnonymousUser()
-        auth = SimpleNamespace()
-        auth.cached_auth = payload
-        return user, auth
+        ttl = None
+        if 'exp' in payload:
+            ttl = payload['exp'] - time.time()
+            if ttl <= 0:
+                return payload
+        self.verified_tokens.set(digest, payload, ttl)
+        return payload
 
     def authenticate_header(self, request):
         return 'JWT realm="api"'
@@ -86,6 +116,11 @@ class OAuth2Authentication(BaseAuthentication):
         if request.method == "OPTIONS":
             return None
 
+        if signed_tokens.enabled():
+            user_auth = self.authenticate_signed_token(request)
+            if user_auth is not None:
+                return user_auth
+
         oauthlib_core = get_oauthlib_core()
         valid, r = oauthlib_core.verify_request(request, scopes=[])
 
@@ -103,6 +138,26 @@ class OAuth2Authentication(BaseAuthentication):
 
         return r.user, r.access_token
 
+    def authenticate_signed_token(self, request):
+        """
+        Verify a signed access token in process, see apps.authentication.signed_tokens.
+        Return None for other tokens, they are checked by oauthlib.
+        """
+        auth_header = get_authorization_header(request).split()
+        if len(auth_header) != 2 or auth_header[0].lower() != b"bearer":
+            return None
+        token = auth_header[1].decode("utf-8")
+        try:
+            cached_auth = signed_tokens.verify(token)
+        except jwt.ExpiredSignatureError:
+            raise TokenExpire
+        if cached_auth is None:
+            return None
+
+        auth = SimpleNamespace()
+        auth.cached_auth = cached_auth
+        return SimpleNamespace(), auth
+
     def authenticate_header(self, request):
         """
         Bearer is the only finalized type currently
@@ -0,0 +1,64 @@
+import time
+import uuid
+
+import jwt
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from rest_framework.test import APIRequestFactory
+
+from apps.authentication.backends import JWTAuthentication
+from apps.users.views import CartSessionAPIView, WatchedSessionAPIView
+
+
+class Command(BaseCommand):
+    help = 'Compare guest requests with and without the verified token cache of JWTAuthentication'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        payload = {
+            'uid': 'guest_{id}'.format(id=str(uuid.uuid4())[:8]),
+            'scopes': ['guest'],
+        }
+        token = jwt.encode(payload, settings.SECRET_KEY).decode('utf-8')
+        factory = APIRequestFactory()
+        authentication = JWTAuthentication()
+
+        def authenticate():
+            authentication.authenticate(factory.get('/', HTTP_AUTHORIZATION=f'JWT {token}'))
+
+        targets = [
+            ('authenticate', authenticate),
+            ('carts', self.get_endpoint(factory, CartSessionAPIView, '/v1/session/carts/', token)),
+            ('watched', self.get_endpoint(factory, WatchedSessionAPIView, '/v1/session/watched/', token)),
+        ]
+        for name, target in targets:
+            uncached = self.measure(target, options['requests'], clear_cache=True)
+            cached = self.measure(target, options['requests'], clear_cache=False)
+            self.stdout.write(
+                f'{name}: without cache {uncached * 1000:.3f}ms ({1 / uncached:.0f}/s) | '
+                f'with cache {cached * 1000:.3f}ms ({1 / cached:.0f}/s) | '
+                f'{(uncached - cached) / uncached * 100:.1f}% faster'
+            )
+
+    def get_endpoint(self, factory, view_class, path, token):
+        view = view_class.as_view()
+
+        def request():
+            response = view(factory.get(path, HTTP_AUTHORIZATION=f'JWT {token}'))
+            assert response.status_code == 200, response.status_code
+
+        return request
+
+    def measure(self, target, requests, clear_cache):
+        """Mean seconds per call"""
+        target()
+        elapsed = 0
+        for _ in range(requests):
+            if clear_cache:
+                JWTAuthentication.verified_tokens.clear()
+            started = time.perf_counter()
+            target()
+            elapsed += time.perf_counter() - started
+        return elapsed / requests
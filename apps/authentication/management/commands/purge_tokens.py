@@ -0,0 +1,77 @@
+import time
+from datetime import timedelta
+
+from django.core.cache import caches
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from oauth2_provider.models import AccessToken, RefreshToken
+from oauth2_provider.settings import oauth2_settings
+
+from apps.authentication import token_cache
+
+
+class Command(BaseCommand):
+    help = 'Delete expired access and refresh tokens in small batches ordered by primary key'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--sleep', type=float, default=0, help='Seconds to pause between batches')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        now = timezone.now()
+        refresh_expire_at = now - timedelta(seconds=oauth2_settings.REFRESH_TOKEN_EXPIRE_SECONDS)
+
+        # refresh tokens revoked or issued for access tokens expired longer than refresh token lifetime ago
+        refresh_tokens = RefreshToken.objects.filter(revoked__lt=refresh_expire_at) | \
+            RefreshToken.objects.filter(access_token__expires__lt=refresh_expire_at)
+        refresh_deleted, refresh_keys = self.purge(
+            refresh_tokens, 'access_token__token', self.get_refresh_keys, options,
+        )
+
+        # expired access tokens, those still holding a refresh token are needed to refresh
+        access_tokens = AccessToken.objects.filter(expires__lt=now, refresh_token__isnull=True)
+        access_deleted, access_keys = self.purge(access_tokens, 'token', self.get_access_keys, options)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Deleted {access_deleted} access tokens, {refresh_deleted} refresh tokens and '
+            f'{access_keys + refresh_keys} cache keys in {time.monotonic() - started:.1f}s'
+        ))
+
+    def purge(self, queryset, token_field, get_keys, options):
+        """Delete rows of the queryset batch by batch, return numbers of deleted rows and cache keys"""
+        auth_cache = caches['auth']
+        deleted = 0
+        keys = 0
+        last_pk = 0
+        while True:
+            batch = list(
+                queryset.filter(pk__gt=last_pk).order_by('pk')
+                .values_list('pk', token_field)[:options['batch_size']]
+            )
+            if not batch:
+                return deleted, keys
+            last_pk = batch[-1][0]
+
+            with transaction.atomic():
+                _, rows = queryset.model.objects.filter(pk__in=[pk for pk, _ in batch]).delete()
+            batch_deleted = rows.get(queryset.model._meta.label, 0)
+            batch_keys = [key for _, token in batch if token for key in get_keys(token)]
+            # one DEL of all keys of the batch
+            auth_cache.delete_many(batch_keys)
+
+            deleted += batch_deleted
+            keys += len(batch_keys)
+            self.stdout.write(f'{queryset.model.__name__}: deleted {deleted}')
+            if options['sleep']:
+                time.sleep(options['sleep'])
+
+    @staticmethod
+    def get_access_keys(token):
+        key = token_cache.get_key(token)
+        return [key, f'{key}:refresh_token']
+
+    @staticmethod
+    def get_refresh_keys(access_token):
+        return [f'{token_cache.get_key(access_token)}:refresh_token']
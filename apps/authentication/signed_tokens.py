@@ -0,0 +1,140 @@
+"""
+Signed access tokens of registered users.
+
+With AUTH_SIGNED_TOKENS['ENABLED'] on, access tokens issued by DubValidator are
+JWTs carrying uid and scopes with a short expiry (AUTH_SIGNED_TOKENS['EXPIRE_SECONDS']),
+and OAuth2Authentication verifies them in process, without redis or database.
+Refresh tokens stay random and are stored and rotated as before.
+
+Tokens are signed with their own key, so guest tokens of JWTAuthentication
+are never accepted as access tokens.
+
+Revoked tokens are put to a deny list, a redis sorted set of token ids (jti)
+scored by token expiry. Every process keeps a copy refreshed every
+AUTH_SIGNED_TOKENS['DENY_LIST_REFRESH'] seconds, so a revoked token is refused
+everywhere after at most that delay. Entries are dropped once their token has
+expired, so the list holds only tokens revoked within one expiry period.
+"""
+import logging
+import threading
+import time
+import uuid
+
+import jwt
+from django.conf import settings
+from django_redis import get_redis_connection
+from oauthlib.oauth2.rfc6749.tokens import random_token_generator
+from oauth2_provider.models import AccessToken
+from oauth2_provider.settings import oauth2_settings
+from redis.exceptions import RedisError
+
+
+logger = logging.getLogger('apps.authentication.signed_tokens')
+
+ALGORITHM = 'HS256'
+DENY_LIST_KEY = 'auth:signed_tokens:deny'
+
+_deny_list_lock = threading.Lock()
+_deny_list = frozenset()
+_deny_list_loaded_at = None
+
+
+def enabled():
+    return settings.AUTH_SIGNED_TOKENS['ENABLED']
+
+
+def expire_seconds():
+    """Lifetime of issued access tokens"""
+    if enabled():
+        return settings.AUTH_SIGNED_TOKENS['EXPIRE_SECONDS']
+    return oauth2_settings.ACCESS_TOKEN_EXPIRE_SECONDS
+
+
+def generate_token(request):
+    """
+    ACCESS_TOKEN_GENERATOR of oauthlib. Tokens of clients without a user
+    and tokens too long for AccessToken.token are random as before.
+    """
+    user = getattr(request, 'user', None)
+    if not enabled() or user is None:
+        return random_token_generator(request)
+
+    payload = {
+        'jti': uuid.uuid4().hex,
+        'uid': user.pk,
+        'scopes': list(user.scopes),
+        'exp': int(time.time()) + expire_seconds(),
+    }
+    token = jwt.encode(payload, settings.AUTH_SIGNED_TOKENS['SIGNING_KEY'], algorithm=ALGORITHM).decode('utf-8')
+    if len(token) > AccessToken._meta.get_field('token').max_length:
+        return random_token_generator(request)
+    return token
+
+
+def verify(token):
+    """
+    Cached auth {'uid', 'scopes', 'token'} of a valid signed token, None if the token
+    is not a signed token or is revoked. Raise jwt.ExpiredSignatureError for expired tokens.
+    """
+    try:
+        payload = jwt.decode(
+            token,
+            settings.AUTH_SIGNED_TOKENS['SIGNING_KEY'],
+            algorithms=[ALGORITHM],
+            options={'require_exp': True},
+        )
+    except jwt.ExpiredSignatureError:
+        raise
+    except jwt.InvalidTokenError:
+        return None
+
+    if 'jti' not in payload or is_denied(payload['jti']):
+        return None
+    return {'uid': payload['uid'], 'scopes': payload['scopes'], 'token': token}
+
+
+def revoke(*tokens):
+    """Put signed tokens among `tokens` to the deny list until they expire"""
+    entries = {}
+    for token in tokens:
+        try:
+            payload = jwt.decode(
+                token,
+                settings.AUTH_SIGNED_TOKENS['SIGNING_KEY'],
+                algorithms=[ALGORITHM],
+                options={'verify_exp': False},
+            )
+        except jwt.InvalidTokenError:
+            continue
+        if 'jti' in payload and 'exp' in payload:
+            entries[payload['jti']] = payload['exp']
+
+    if entries:
+        get_redis_connection('auth').zadd(DENY_LIST_KEY, entries)
+        _load_deny_list()
+
+
+def is_denied(jti):
+    if _deny_list_loaded_at is None or \
+            time.monotonic() - _deny_list_loaded_at >= settings.AUTH_SIGNED_TOKENS['DENY_LIST_REFRESH']:
+        _load_deny_list()
+    return jti in _deny_list
+
+
+def _load_deny_list():
+    global _deny_list, _deny_list_loaded_at
+    if not _deny_list_lock.acquire(blocking=False):
+        # another thread is loading, the current copy is used meanwhile
+        return
+    try:
+        redis = get_redis_connection('auth')
+        pipeline = redis.pipeline(transaction=False)
+        pipeline.zremrangebyscore(DENY_LIST_KEY, '-inf', int(time.time()))
+        pipeline.zrange(DENY_LIST_KEY, 0, -1)
+        _, members = pipeline.execute()
+        _deny_list = frozenset(member.decode('utf-8') for member in members)
+    except RedisError:
+        logger.exception('Unable to refresh deny list of signed tokens')
+    finally:
+        _deny_list_loaded_at = time.monotonic()
+        _deny_list_lock.release()
@@ -1,3 +1,154 @@
-from django.test import TestCase
+import os
+import time
+from datetime import timedelta
+from io import StringIO
+from types import SimpleNamespace
 
-# Create your tests here.
+import jwt
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from oauth2_provider.models import AccessToken, Application, RefreshToken
+
+from apps.users.models import User
+
+from apps.base.lru import LRUCache
+from . import signed_tokens, token_cache
+from .backends import JWTAuthentication
+
+
+class LRUCacheTests(TestCase):
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(max_size=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual((cache.get('a'), cache.get('b'), cache.get('c')), (1, None, 3))
+
+    def test_expires(self):
+        cache = LRUCache(max_size=2, ttl=0.01)
+        cache.set('a', 1)
+        time.sleep(0.02)
+        self.assertIsNone(cache.get('a'))
+
+
+class TokenCacheTests(TestCase):
+    def test_invalidate_drops_both_tiers(self):
+        cached_auth = {'uid': 1, 'scopes': ['admin'], 'token': 'token'}
+        token_cache.set_auth('token', cached_auth, 60)
+        self.assertEqual(token_cache.get_auth('token'), cached_auth)
+
+        token_cache.invalidate('token')
+        self.assertIsNone(token_cache.get_auth('token'))
+
+    def test_forked_process_starts_own_listener(self):
+        # state as inherited by a forked worker: subscribed flag and LRU entries without the thread
+        token_cache._listener_pid = -1
+        token_cache._subscribed.set()
+        token_cache._local.set(token_cache._digest('revoked'), {'uid': 1})
+
+        self.assertIsNone(token_cache.get_auth('revoked'))
+        self.assertEqual(token_cache._listener_pid, os.getpid())
+
+
+@override_settings(AUTH_SIGNED_TOKENS={**settings.AUTH_SIGNED_TOKENS, 'ENABLED': True})
+class SignedTokenTests(TestCase):
+    def setUp(self):
+        self.request = SimpleNamespace(user=SimpleNamespace(pk=1, scopes=['customer']))
+
+    def test_verify(self):
+        token = signed_tokens.generate_token(self.request)
+        cached_auth = signed_tokens.verify(token)
+        self.assertEqual((cached_auth['uid'], cached_auth['scopes']), (1, ['customer']))
+
+    def test_revoked(self):
+        token = signed_tokens.generate_token(self.request)
+        signed_tokens.revoke(token)
+        self.assertIsNone(signed_tokens.verify(token))
+
+    def test_guest_token_is_not_access_token(self):
+        guest_token = jwt.encode({'uid': 'guest_1', 'scopes': ['guest']}, settings.SECRET_KEY).decode('utf-8')
+        self.assertIsNone(signed_tokens.verify(guest_token))
+
+
+class GuestTokenCacheTests(TestCase):
+    def setUp(self):
+        JWTAuthentication.verified_tokens.clear()
+
+    def test_payload_cached_until_exp(self):
+        token = jwt.encode({'uid': 'guest_1', 'scopes': ['guest']}, settings.SECRET_KEY)
+        payload = JWTAuthentication().decode(token)
+        self.assertEqual(payload['uid'], 'guest_1')
+        self.assertEqual(len(JWTAuthentication.verified_tokens), 1)
+
+        expired = jwt.encode({'uid': 'guest_2', 'exp': int(time.time()) - 1}, settings.SECRET_KEY)
+        self.assertIsNone(JWTAuthentication().decode(expired))
+        self.assertEqual(len(JWTAuthentication.verified_tokens), 1)
+
+    def test_invalid_signature(self):
+        token = jwt.encode({'uid': 'guest_1', 'scopes': ['guest']}, 'other secret')
+        self.assertIsNone(JWTAuthentication().decode(token))
+
+
+class PurgeTokensTests(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        self.user = User.objects.create(email='customer@example.com', name='customer', scopes=['customer'])
+        self.application = Application.objects.create(
+            name='dub', user=self.user,
+            client_type=Application.CLIENT_CONFIDENTIAL,
+            authorization_grant_type=Application.GRANT_PASSWORD,
+        )
+        # expired longer than refresh token lifetime ago, with its refresh token
+        self.stale = self.create_access_token('stale', now - timedelta(days=10), refresh_token='stale-refresh')
+        # expired, still refreshable
+        self.refreshable = self.create_access_token('refreshable', now - timedelta(hours=1), refresh_token='refresh')
+        self.expired = self.create_access_token('expired', now - timedelta(hours=1))
+        self.live = self.create_access_token('live', now + timedelta(hours=1))
+        RefreshToken.objects.create(
+            user=self.user, application=self.application, token='revoked', revoked=now - timedelta(days=10),
+        )
+
+        self.keys = {}
+        for token in ('stale', 'refreshable', 'expired', 'live'):
+            key = token_cache.get_key(token)
+            self.keys[token] = [key, f'{key}:refresh_token']
+            caches['auth'].set_many({key: {'token': token}, f'{key}:refresh_token': 'refresh'}, 60)
+
+    def tearDown(self):
+        caches['auth'].delete_many([key for keys in self.keys.values() for key in keys])
+
+    def create_access_token(self, token, expires, refresh_token=None):
+        access_token = AccessToken.objects.create(
+            user=self.user, application=self.application, token=token, expires=expires, scope='customer',
+        )
+        if refresh_token is not None:
+            RefreshToken.objects.create(
+                user=self.user, application=self.application, token=refresh_token, access_token=access_token,
+            )
+        return access_token
+
+    def test_purge(self):
+        out = StringIO()
+        call_command('purge_tokens', batch_size=1, stdout=out)
+
+        self.assertEqual(
+            set(AccessToken.objects.values_list('token', flat=True)), {'refreshable', 'live'},
+        )
+        self.assertEqual(set(RefreshToken.objects.values_list('token', flat=True)), {'refresh'})
+        self.assertIn('Deleted 2 access tokens, 2 refresh tokens', out.getvalue())
+
+        for token in ('stale', 'expired'):
+            self.assertEqual(caches['auth'].get_many(self.keys[token]), {})
+        self.assertEqual(len(caches['auth'].get_many(self.keys['refreshable'])), 2)
+        self.assertEqual(len(caches['auth'].get_many(self.keys['live'])), 2)
+
+    def test_nothing_to_purge(self):
+        call_command('purge_tokens', stdout=StringIO())
+        out = StringIO()
+        call_command('purge_tokens', batch_size=1, stdout=out)
+        self.assertIn('Deleted 0 access tokens, 0 refresh tokens and 0 cache keys', out.getvalue())
+        self.assertEqual(AccessToken.objects.count(), 2)
@@ -0,0 +1,128 @@
+"""
+Two tier cache of validated bearer tokens.
+
+Every process keeps a small LRU of recently validated tokens with a short time
+to live in front of the `auth` redis cache, so repeated requests of the same
+client skip the redis round trip. Rotated and revoked tokens are published on
+a redis channel and dropped from the LRU of every process by a listener thread.
+The listener is started on the first cache access of every process, so a
+forked worker starts its own instead of trusting the state inherited from
+its parent. The LRU is used only while the listener is subscribed,
+invalidations sent while it was not are covered by clearing the LRU on
+every (re)subscription.
+
+Tokens are kept in the LRU and published by their sha256 digest.
+Hits of both tiers and misses are counted in the `auth_token_cache` metrics.
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+from apps.base import metrics
+from apps.base.lru import LRUCache
+
+
+logger = logging.getLogger('apps.authentication.token_cache')
+
+KEY_PREFIX = 'auth:access_token'
+CHANNEL = 'auth:access_token:invalidate'
+
+_local = LRUCache(
+    max_size=settings.AUTH_TOKEN_CACHE['MAX_SIZE'],
+    ttl=settings.AUTH_TOKEN_CACHE['TTL'],
+)
+_listener_lock = threading.Lock()
+_listener = None
+_listener_pid = None
+_subscribed = threading.Event()
+
+
+def get_key(token):
+    return f'{KEY_PREFIX}:{token}'
+
+
+def get_auth(token):
+    """Cached auth of the token from the local LRU or redis, None if the token is not cached"""
+    _start_listener()
+    digest = _digest(token)
+    if _subscribed.is_set():
+        cached_auth = _local.get(digest)
+        if cached_auth is not None:
+            metrics.increment('auth_token_cache', 'local_hit')
+            return cached_auth
+
+    cached_auth = caches['auth'].get(get_key(token))
+    if cached_auth is None:
+        metrics.increment('auth_token_cache', 'miss')
+        return None
+
+    metrics.increment('auth_token_cache', 'redis_hit')
+    if _subscribed.is_set():
+        _local.set(digest, cached_auth)
+    return cached_auth
+
+
+def set_auth(token, cached_auth, timeout):
+    _start_listener()
+    caches['auth'].set(get_key(token), cached_auth, timeout)
+    if _subscribed.is_set():
+        _local.set(_digest(token), cached_auth, timeout)
+
+
+def invalidate(*tokens):
+    """Drop the tokens from redis and from the LRU of every process"""
+    tokens = [token for token in tokens if token]
+    if not tokens:
+        return
+    caches['auth'].delete_many([get_key(token) for token in tokens])
+    redis = get_redis_connection('auth')
+    for token in tokens:
+        digest = _digest(token)
+        _local.delete(digest)
+        redis.publish(CHANNEL, digest)
+
+
+def _digest(token):
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+def _start_listener():
+    """Start the invalidation listener thread of the current process unless it is running"""
+    global _listener, _listener_pid
+    pid = os.getpid()
+    if _listener_pid == pid:
+        return
+    with _listener_lock:
+        if _listener_pid != pid:
+            # a forked process inherits the subscribed flag and the LRU, but not the thread
+            _subscribed.clear()
+            _local.clear()
+            _listener = threading.Thread(target=_listen, name='auth-token-cache', daemon=True)
+            _listener.start()
+            _listener_pid = pid
+
+
+def _listen():
+    while True:
+        try:
+            pubsub = get_redis_connection('auth').pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(CHANNEL)
+            # invalidations may have been missed while not subscribed
+            _local.clear()
+            _subscribed.set()
+            for message in pubsub.listen():
+                if message['type'] == 'message':
+                    _local.delete(message['data'].decode('utf-8'))
+        except RedisError:
+            logger.exception('Token invalidation listener lost its subscription')
+        finally:
+            _subscribed.clear()
+            _local.clear()
+        time.sleep(1)
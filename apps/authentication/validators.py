@@ -10,6 +10,8 @@ from oauth2_provider.models import AccessToken, RefreshToken
 from oauth2_provider.exceptions import FatalClientError
 from oauth2_provider.settings import oauth2_settings
 
+from . import signed_tokens, token_cache
+
 
 class DubValidator(OAuth2Validator):
     def validate_bearer_token(self, token, scopes, request):
@@ -19,9 +21,7 @@ class DubValidator(OAuth2Validator):
         if not token:
             return False
 
-        auth_cache = caches["auth"]
-        key = f"auth:access_token:{token}"
-        cached_auth = auth_cache.get(key)
+        cached_auth = token_cache.get_auth(token)
 
         if cached_auth:
             request.user = SimpleNamespace()
@@ -52,7 +52,7 @@ class DubValidator(OAuth2Validator):
             "scopes": access_token.user.scopes,
             "token": access_token.token,
         }
-        auth_cache.set(key, cached_auth, oauth2_settings.ACCESS_TOKEN_EXPIRE_SECONDS)
+        token_cache.set_auth(token, cached_auth, signed_tokens.expire_seconds())
         access_token.cached_auth = cached_auth
 
         request.access_token = access_token
@@ -69,7 +69,7 @@ class DubValidator(OAuth2Validator):
         if "scope" not in token:
             raise FatalClientError("Failed to renew access token: missing scope")
 
-        expires = timezone.now() + timedelta(seconds=oauth2_settings.ACCESS_TOKEN_EXPIRE_SECONDS)
+        expires = timezone.now() + timedelta(seconds=signed_tokens.expire_seconds())
 
         if request.grant_type == "client_credentials":
             request.user = None
@@ -94,8 +94,8 @@ class DubValidator(OAuth2Validator):
                 access_token = AccessToken.objects.select_for_update().get(
                     pk=refresh_token_instance.access_token.pk
                 )
-                auth_cache = caches['auth']
-                auth_cache.delete(access_token.token)
+                token_cache.invalidate(access_token.token)
+                signed_tokens.revoke(access_token.token)
 
                 access_token.user = request.user
                 access_token.scope = ' '.join(request.user.scopes)
@@ -110,17 +110,17 @@ class DubValidator(OAuth2Validator):
                     'token': access_token.token,
                     'reused': 'true',
                 }
-                auth_cache.set(access_token.token, cached_auth, oauth2_settings.ACCESS_TOKEN_EXPIRE_SECONDS)
+                token_cache.set_auth(access_token.token, cached_auth, signed_tokens.expire_seconds())
 
             # else create fresh with access & refresh tokens
             else:
                 # revoke existing tokens if possible to allow reuse of grant
                 if isinstance(refresh_token_instance, RefreshToken):
                     try:
-                        auth_cache = caches['auth']
-                        access_token_key = f'auth:access_token:{refresh_token_instance.access_token.token}'
-                        refresh_token_key = access_token_key + ":refresh_token"
-                        auth_cache.delete_many([access_token_key, refresh_token_key])
+                        access_token_code = refresh_token_instance.access_token.token
+                        caches['auth'].delete(token_cache.get_key(access_token_code) + ':refresh_token')
+                        token_cache.invalidate(access_token_code)
+                        signed_tokens.revoke(access_token_code)
                         refresh_token_instance.revoke()
                     except (AccessToken.DoesNotExist, RefreshToken.DoesNotExist):
                         pass
@@ -145,27 +145,24 @@ class DubValidator(OAuth2Validator):
                 )
                 refresh_token.save()
 
-                auth_cache = caches['auth']
-                key = f'auth:access_token:{access_token.token}:refresh_token'
-                auth_cache.set(key, access_token.token, oauth2_settings.REFRESH_TOKEN_EXPIRE_SECONDS)
+                key = token_cache.get_key(access_token.token) + ':refresh_token'
+                caches['auth'].set(key, access_token.token, oauth2_settings.REFRESH_TOKEN_EXPIRE_SECONDS)
 
         # No refresh token should be created, just access token
         else:
             self._create_access_token(expires, request, token)
 
         # TODO: check out a more reliable way to communicate expire time to oauthlib
-        token["expires_in"] = oauth2_settings.ACCESS_TOKEN_EXPIRE_SECONDS
+        token["expires_in"] = signed_tokens.expire_seconds()
 
     def _create_access_token(self, expires, request, token, source_refresh_token=None):
         access_token = super()._create_access_token(expires, request, token, source_refresh_token)
-        auth_cache = caches['auth']
         cached_auth = {
             'uid': access_token.user.id,
             'scopes': access_token.user.scopes,
             'token': access_token.token,
         }
-        key = f'auth:access_token:{access_token.token}'
-        auth_cache.set(key, cached_auth, oauth2_settings.ACCESS_TOKEN_EXPIRE_SECONDS)
+        token_cache.set_auth(access_token.token, cached_auth, signed_tokens.expire_seconds())
 
         return access_token
 
@@ -176,6 +173,12 @@ class DubValidator(OAuth2Validator):
         :param token_type_hint: access_token or refresh_token.
         :param request: The HTTP Request (oauthlib.common.Request)
         """
+        # revoking a refresh token revokes its access token as well
+        tokens = [token]
+        refresh_token = RefreshToken.objects.select_related('access_token').filter(token=token).first()
+        if refresh_token is not None and refresh_token.access_token is not None:
+            tokens.append(refresh_token.access_token.token)
+
         super().revoke_token(token, token_type_hint, request, *args, **kwargs)
-        auth_cache = caches['auth']
-        auth_cache.delete(token)
+        token_cache.invalidate(*tokens)
+        signed_tokens.revoke(*tokens)
@@ -1,5 +1,7 @@
 from elasticsearch import Elasticsearch
 
+from .instrumentation import InstrumentedTransport
+
 INDEX = 'products_dev'
 CONFIG = {
     'host': 'elastic',
@@ -12,4 +14,4 @@ CONFIG = {
 
 PAGE_SIZE = 24
 
-es = Elasticsearch([CONFIG])
\ No newline at end of file
+es = Elasticsearch([CONFIG], transport_class=InstrumentedTransport)
\ No newline at end of file
@@ -0,0 +1,141 @@
+"""
+Per-request performance counters.
+
+Counters are kept in a thread local and are collected only while a sampled
+request is processed by InstrumentationMiddleware. Outside of a sampled
+request (management commands, shell, not sampled requests) every hook
+falls through to the original call.
+
+The same thread local holds elastic profiles of a request
+profiled by apps.base.profiling.ProfilingMixin.
+Slow elastic calls are reported to apps.base.slowlog for every call.
+"""
+import threading
+import time
+
+from django_redis.client import DefaultClient
+from elasticsearch import Transport
+
+from . import slowlog
+
+
+_local = threading.local()
+
+
+class RequestStats:
+    __slots__ = (
+        'started',
+        'db_count',
+        'db_time',
+        'es_count',
+        'es_time',
+        'es_took',
+        'cache_hits',
+        'cache_misses',
+        'render_time',
+    )
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.db_count = 0
+        self.db_time = 0.0
+        self.es_count = 0
+        # client round trip in seconds and server side `took` in milliseconds
+        self.es_time = 0.0
+        self.es_took = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.render_time = 0.0
+
+
+def start():
+    _local.stats = RequestStats()
+    return _local.stats
+
+
+def stop():
+    stats = current()
+    _local.stats = None
+    return stats
+
+
+def current():
+    return getattr(_local, 'stats', None)
+
+
+def start_es_profiling():
+    _local.es_profiles = []
+
+
+def stop_es_profiling():
+    es_profiles = getattr(_local, 'es_profiles', None)
+    _local.es_profiles = None
+    return es_profiles
+
+
+def record_query(execute, sql, params, many, context):
+    """Database execute wrapper, see django.db.connection.execute_wrapper"""
+    stats = current()
+    if stats is None:
+        return execute(sql, params, many, context)
+
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.db_count += 1
+        stats.db_time += time.perf_counter() - started
+
+
+class InstrumentedTransport(Transport):
+    """
+    Elasticsearch transport that counts calls, round trip and `took`.
+    While elastic profiling is on, search requests are sent with `profile: true`
+    and the profile sections of responses are collected.
+    Calls slower than the slow log threshold are passed to the slow log.
+    """
+
+    def perform_request(self, method, url, headers=None, params=None, body=None):
+        es_profiles = getattr(_local, 'es_profiles', None)
+        profiled = es_profiles is not None and url.endswith('/_search') and isinstance(body, dict)
+        stats = current()
+        if profiled:
+            body = {**body, 'profile': True}
+        started = time.perf_counter()
+        try:
+            response = super().perform_request(method, url, headers=headers, params=params, body=body)
+        finally:
+            round_trip = time.perf_counter() - started
+            if stats is not None:
+                stats.es_count += 1
+                stats.es_time += round_trip
+
+        if round_trip * 1000 >= slowlog.threshold_ms():
+            slowlog.record(method, url, body, response, round_trip * 1000)
+
+        if not isinstance(response, dict):
+            return response
+        if stats is not None:
+            stats.es_took += response.get('took', 0)
+        if profiled:
+            es_profiles.append({
+                'url': url,
+                'took': response.get('took'),
+                'round_trip_ms': round(round_trip * 1000, 1),
+                'profile': response.pop('profile', None),
+            })
+        return response
+
+
+class InstrumentedRedisClient(DefaultClient):
+    """django-redis client that counts cache hits and misses"""
+
+    def get(self, key, default=None, version=None, client=None):
+        value = super().get(key, default=default, version=version, client=client)
+        stats = current()
+        if stats is not None:
+            if value is default:
+                stats.cache_misses += 1
+            else:
+                stats.cache_hits += 1
+        return value
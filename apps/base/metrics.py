@@ -0,0 +1,218 @@
+"""
+Aggregated latency histograms.
+
+Every process records latencies into local log-linear (HDR-style) histograms
+and periodically flushes the deltas into redis hashes, so histograms of all
+workers are merged by the aggregator and can be read by any of them.
+
+Histograms are grouped by family (route, elastic, bulk) and label,
+e.g. family 'elastic' with label 'get_products'.
+Counters (e.g. cache hits) are kept the same way in one redis hash.
+"""
+import bisect
+import functools
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+
+# Upper bounds of buckets in milliseconds, two significant digits per decade
+BUCKETS = tuple(
+    round(mantissa * decade, 4)
+    for decade in (0.1, 1, 10, 100, 1000, 10000)
+    for mantissa in (1, 1.25, 1.5, 2, 2.5, 3, 4, 5, 6, 8)
+)
+QUANTILES = (0.5, 0.9, 0.99)
+KEY_PREFIX = 'metrics'
+# outside of the histogram keys matched by `metrics:*`
+COUNTERS_KEY = 'metrics_counters'
+
+logger = logging.getLogger('apps.metrics')
+
+
+class Histogram:
+    def __init__(self):
+        # last bucket is +Inf
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def record(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def merge(self, other):
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+        self.count += other.count
+        self.sum += other.sum
+
+    def quantile(self, q):
+        if not self.count:
+            return 0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if not count:
+                continue
+            if seen + count >= rank:
+                upper = BUCKETS[index] if index < len(BUCKETS) else BUCKETS[-1]
+                lower = BUCKETS[index - 1] if index else 0
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return BUCKETS[-1]
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+        self._last_flush = time.monotonic()
+
+    def record(self, family, label, value):
+        with self._lock:
+            histogram = self._histograms.get((family, label))
+            if histogram is None:
+                histogram = self._histograms[(family, label)] = Histogram()
+            histogram.record(value)
+            flush_due = time.monotonic() - self._last_flush >= settings.METRICS['FLUSH_INTERVAL']
+
+        if flush_due:
+            self.flush()
+
+    def increment(self, family, label, value=1):
+        with self._lock:
+            self._counters[(family, label)] = self._counters.get((family, label), 0) + value
+            flush_due = time.monotonic() - self._last_flush >= settings.METRICS['FLUSH_INTERVAL']
+
+        if flush_due:
+            self.flush()
+
+    def flush(self):
+        """Move local deltas to redis"""
+        with self._lock:
+            histograms, self._histograms = self._histograms, {}
+            counters, self._counters = self._counters, {}
+            self._last_flush = time.monotonic()
+
+        if not histograms and not counters:
+            return
+
+        redis = get_redis_connection('metrics')
+        pipeline = redis.pipeline(transaction=False)
+        for (family, label), histogram in histograms.items():
+            key = f'{KEY_PREFIX}:{family}:{label}'
+            for index, count in enumerate(histogram.counts):
+                if count:
+                    pipeline.hincrby(key, index, count)
+            pipeline.hincrby(key, 'count', histogram.count)
+            pipeline.hincrbyfloat(key, 'sum', histogram.sum)
+        for (family, label), value in counters.items():
+            pipeline.hincrby(COUNTERS_KEY, f'{family}:{label}', value)
+        try:
+            pipeline.execute()
+        except RedisError:
+            logger.exception('Unable to flush metrics')
+
+    def collect(self):
+        """Return merged histograms of all workers as {(family, label): Histogram}"""
+        self.flush()
+        redis = get_redis_connection('metrics')
+        keys = list(redis.scan_iter(match=f'{KEY_PREFIX}:*', count=500))
+        pipeline = redis.pipeline(transaction=False)
+        for key in keys:
+            pipeline.hgetall(key)
+
+        histograms = {}
+        for key, fields in zip(keys, pipeline.execute()):
+            _, family, label = key.decode('utf-8').split(':', 2)
+            histogram = Histogram()
+            for field, value in fields.items():
+                field = field.decode('utf-8')
+                if field == 'count':
+                    histogram.count = int(value)
+                elif field == 'sum':
+                    histogram.sum = float(value)
+                else:
+                    histogram.counts[int(field)] = int(value)
+            histograms[(family, label)] = histogram
+        return histograms
+
+    def collect_counters(self):
+        """Return merged counters of all workers as {(family, label): value}"""
+        self.flush()
+        fields = get_redis_connection('metrics').hgetall(COUNTERS_KEY)
+        return {
+            tuple(field.decode('utf-8').split(':', 1)): int(value)
+            for field, value in fields.items()
+        }
+
+
+registry = Registry()
+
+
+def observe(family, label, value):
+    registry.record(family, label, value)
+
+
+def increment(family, label, value=1):
+    registry.increment(family, label, value)
+
+
+def timed(family, label=None):
+    """Decorator recording duration of the function call in milliseconds"""
+
+    def decorator(func):
+        name = label or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observe(family, name, (time.perf_counter() - started) * 1000)
+
+        return wrapper
+
+    return decorator
+
+
+def render_prometheus(histograms, counters=None):
+    lines = []
+    families = sorted({family for family, _ in histograms})
+    for family in families:
+        name = f'dub_{family}_duration_ms'
+        lines.append(f'# TYPE {name} histogram')
+        family_histograms = sorted(
+            (label, histogram) for (key, label), histogram in histograms.items() if key == family
+        )
+        for label, histogram in family_histograms:
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ('+Inf',), histogram.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{family}="{label}",le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_sum{{{family}="{label}"}} {histogram.sum:.3f}')
+            lines.append(f'{name}_count{{{family}="{label}"}} {histogram.count}')
+
+        lines.append(f'# TYPE {name}_quantile gauge')
+        for label, histogram in family_histograms:
+            for q in QUANTILES:
+                value = histogram.quantile(q)
+                lines.append(f'{name}_quantile{{{family}="{label}",quantile="{q}"}} {value:.3f}')
+
+    counters = counters or {}
+    for family in sorted({family for family, _ in counters}):
+        name = f'dub_{family}_total'
+        lines.append(f'# TYPE {name} counter')
+        for (key, label), value in sorted(counters.items()):
+            if key == family:
+                lines.append(f'{name}{{{family}="{label}"}} {value}')
+
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,98 @@
+import json
+import logging
+import random
+import time
+
+from django.conf import settings
+from django.db import connection
+
+from . import instrumentation, metrics
+
+
+logger = logging.getLogger('apps.instrumentation')
+
+
+class InstrumentationMiddleware:
+    """
+    Collect wall time, ORM, elastic, redis and render timings of a request.
+    Results are sent in the Server-Timing header and as one json log line.
+    Only a share of requests equal to INSTRUMENTATION['SAMPLE_RATE'] is measured,
+    duration of every request is recorded to the route latency histogram.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        config = settings.INSTRUMENTATION
+        self.sample_rate = config.get('SAMPLE_RATE', 0)
+        self.server_timing = config.get('SERVER_TIMING', True)
+        self.log = config.get('LOG', True)
+
+    def __call__(self, request):
+        if not self.sample_rate or random.random() >= self.sample_rate:
+            started = time.perf_counter()
+            response = self.get_response(request)
+            self._observe_route(request, time.perf_counter() - started)
+            return response
+
+        stats = instrumentation.start()
+        try:
+            with connection.execute_wrapper(instrumentation.record_query):
+                response = self.get_response(request)
+        finally:
+            instrumentation.stop()
+        total_time = time.perf_counter() - stats.started
+        self._observe_route(request, total_time)
+
+        if self.server_timing:
+            response['Server-Timing'] = self._format_server_timing(stats, total_time)
+        if self.log:
+            logger.info(json.dumps(self._format_log(request, response, stats, total_time)))
+
+        return response
+
+    def process_template_response(self, request, response):
+        stats = instrumentation.current()
+        if stats is None:
+            return response
+
+        started = time.perf_counter()
+
+        def finish_render(rendered_response):
+            stats.render_time += time.perf_counter() - started
+
+        response.add_post_render_callback(finish_render)
+        return response
+
+    def _observe_route(self, request, total_time):
+        resolver_match = getattr(request, 'resolver_match', None)
+        route = resolver_match.view_name if resolver_match else 'unmatched'
+        metrics.observe('route', route, total_time * 1000)
+
+    def _format_server_timing(self, stats, total_time):
+        timings = [
+            f'total;dur={total_time * 1000:.1f}',
+            f'db;dur={stats.db_time * 1000:.1f};desc="{stats.db_count} queries"',
+            f'es;dur={stats.es_time * 1000:.1f};desc="{stats.es_count} calls"',
+            f'es-took;dur={stats.es_took}',
+            f'cache;desc="hits={stats.cache_hits} misses={stats.cache_misses}"',
+            f'render;dur={stats.render_time * 1000:.1f}',
+        ]
+        return ', '.join(timings)
+
+    def _format_log(self, request, response, stats, total_time):
+        resolver_match = getattr(request, 'resolver_match', None)
+        return {
+            'method': request.method,
+            'path': request.path,
+            'view': resolver_match.view_name if resolver_match else None,
+            'status': response.status_code,
+            'total_ms': round(total_time * 1000, 1),
+            'db_queries': stats.db_count,
+            'db_ms': round(stats.db_time * 1000, 1),
+            'es_calls': stats.es_count,
+            'es_ms': round(stats.es_time * 1000, 1),
+            'es_took_ms': stats.es_took,
+            'cache_hits': stats.cache_hits,
+            'cache_misses': stats.cache_misses,
+            'render_ms': round(stats.render_time * 1000, 1),
+        }
@@ -1,5 +1,101 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+from collections import OrderedDict
+
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+from rest_framework.pagination import PageNumberPagination, CursorPagination
+from rest_framework.response import Response
 
 
 class BasePagination(PageNumberPagination):
     page_size = 10
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator counting rows by `estimate_count`. Above `count_threshold` rows the
+    number of pages follows the planner estimate, so the last pages may be
+    empty or out of range.
+    """
+    count_threshold = 10000
+
+    @cached_property
+    def count(self):
+        if not hasattr(self.object_list, 'query'):
+            return len(self.object_list)
+        return estimate_count(self.object_list, self.count_threshold)
+
+
+class PkCursorPagination(CursorPagination):
+    """
+    Cursor pagination by primary key, pages are read with `WHERE pk < cursor`
+    instead of OFFSET. `count` is exact up to `count_threshold` rows,
+    above it the planner estimate is returned.
+    """
+    page_size = 10
+    ordering = '-pk'
+    count_threshold = 10000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count = estimate_count(queryset, self.count_threshold)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('count', self.count),
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+
+class KeysetPagination(BasePagination):
+    """
+    Page number pagination as BasePagination with the estimated count of
+    EstimatedCountPaginator, requests with a `cursor` parameter (an empty one
+    for the first page) are paginated by PkCursorPagination without OFFSET.
+    Next and previous links of cursor pages keep the cursor.
+    """
+    django_paginator_class = EstimatedCountPaginator
+    cursor_pagination_class = PkCursorPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_pagination = None
+        if self.cursor_pagination_class.cursor_query_param in request.query_params:
+            self.cursor_pagination = self.cursor_pagination_class()
+            self.cursor_pagination.page_size = self.page_size
+            return self.cursor_pagination.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_pagination is not None:
+            return self.cursor_pagination.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+
+def estimate_count(queryset, threshold):
+    """
+    Number of rows of the queryset. Whole tables are estimated from pg_class.reltuples,
+    filtered querysets from the row estimate of the query plan. Exact count is
+    used when the estimate is below the threshold.
+    """
+    with connections[queryset.db].cursor() as cursor:
+        if queryset.query.where:
+            sql, params = queryset.order_by().query.sql_with_params()
+            cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+            plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            estimate = plan[0]['Plan']['Plan Rows']
+        else:
+            cursor.execute(
+                'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                [queryset.model._meta.db_table],
+            )
+            row = cursor.fetchone()
+            estimate = row[0] if row else 0
+
+    if estimate < threshold:
+        return queryset.count()
+    return estimate
@@ -0,0 +1,74 @@
+"""
+Staff only profiling of catalog requests.
+
+A request with `?profile=1` and a staff bearer token gets a `_profile`
+section in the response: elastic `profile: true` breakdown of every search
+issued and a cProfile summary of the python side of the request.
+Without the query param, or with any other value (`?profile=0`), the view
+is not affected.
+"""
+import cProfile
+import pstats
+
+from rest_framework.exceptions import NotAuthenticated, PermissionDenied
+
+from apps.authentication.backends import OAuth2Authentication
+from apps.authentication.permissions import IsStaff
+from . import instrumentation
+
+
+PROFILE_PARAM = 'profile'
+PROFILE_STATS_LIMIT = 30
+
+
+class ProfilingMixin:
+    _profiler = None
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.query_params.get(PROFILE_PARAM) not in ['1', 'true', 'True']:
+            return
+
+        self._check_staff(request)
+        self._profiler = cProfile.Profile()
+        instrumentation.start_es_profiling()
+        self._profiler.enable()
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        if self._profiler is not None:
+            self._profiler.disable()
+            es_profiles = instrumentation.stop_es_profiling()
+            self._attach_profile(response, es_profiles)
+            self._profiler = None
+        return super().finalize_response(request, response, *args, **kwargs)
+
+    def _check_staff(self, request):
+        user_auth = OAuth2Authentication().authenticate(request)
+        if user_auth is None:
+            raise NotAuthenticated
+        request.user, request.auth = user_auth
+        if not IsStaff().has_permission(request, self):
+            raise PermissionDenied
+
+    def _attach_profile(self, response, es_profiles):
+        profile = {
+            'elastic': es_profiles,
+            'python': self._summarize_python(),
+        }
+        if isinstance(response.data, dict):
+            response.data['_profile'] = profile
+        else:
+            response.data = {'data': response.data, '_profile': profile}
+
+    def _summarize_python(self):
+        stats = pstats.Stats(self._profiler).stats
+        rows = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)
+        summary = []
+        for (filename, line, function), (_, calls, tottime, cumtime, _) in rows[:PROFILE_STATS_LIMIT]:
+            summary.append({
+                'function': f'{filename}:{line}({function})',
+                'calls': calls,
+                'tottime_ms': round(tottime * 1000, 3),
+                'cumtime_ms': round(cumtime * 1000, 3),
+            })
+        return summary
@@ -1,6 +1,7 @@
+import json
 from itertools import groupby
 
-from rest_framework.renderers import JSONRenderer
+from rest_framework.renderers import BaseRenderer, JSONRenderer
 
 
 class ProductRenderer(JSONRenderer):
@@ -25,4 +26,15 @@ class ProductRenderer(JSONRenderer):
     def combine_menu(self, pair):
         category, menu = pair
         menu['category'] = category
-        return menu
\ No newline at end of file
+        return menu
+
+class PrometheusRenderer(BaseRenderer):
+    media_type = 'text/plain'
+    format = 'prometheus'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # error responses (401, 403) carry a dict
+        if not isinstance(data, str):
+            data = json.dumps(data, ensure_ascii=False)
+        return data.encode(self.charset)
@@ -0,0 +1,129 @@
+"""
+Slow query log for elastic calls.
+
+Calls slower than ELASTIC_SLOW_QUERY['THRESHOLD_MS'] are logged with a
+fingerprint of the query shape: field names and filter types with their
+counts are kept, values are replaced by '?'. Entries are aggregated in redis
+by fingerprint, see `es_slow_queries` management command for the report.
+"""
+import hashlib
+import json
+import logging
+
+from django.conf import settings
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+
+logger = logging.getLogger('apps.elastic.slow')
+
+KEY_PREFIX = 'es_slow'
+INDEX_KEY = f'{KEY_PREFIX}:index'
+
+
+def query_shape(body):
+    if isinstance(body, dict):
+        return {key: query_shape(value) for key, value in sorted(body.items())}
+    if isinstance(body, (list, tuple)):
+        if all(not isinstance(item, (dict, list, tuple)) for item in body):
+            return '?'
+        shapes = []
+        for item in body:
+            shape = query_shape(item)
+            for entry in shapes:
+                if entry['shape'] == shape:
+                    entry['count'] += 1
+                    break
+            else:
+                shapes.append({'shape': shape, 'count': 1})
+        return [entry['shape'] if entry['count'] == 1 else {'*': entry['count'], 'shape': entry['shape']}
+                for entry in shapes]
+    return '?'
+
+
+def fingerprint(shape):
+    canonical = json.dumps(shape, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(canonical.encode('utf-8')).hexdigest()[:12]
+
+
+def threshold_ms():
+    return settings.ELASTIC_SLOW_QUERY['THRESHOLD_MS']
+
+
+def record(method, url, body, response, duration_ms):
+    shape = query_shape(body)
+    query_fingerprint = fingerprint(shape)
+    endpoint = f'{method} {url}'
+    took = response.get('took') if isinstance(response, dict) else None
+    hits = _get_hits(response)
+    size = len(json.dumps(response)) if isinstance(response, dict) else 0
+
+    logger.warning(json.dumps({
+        'fingerprint': query_fingerprint,
+        'endpoint': endpoint,
+        'duration_ms': round(duration_ms, 1),
+        'took': took,
+        'hits': hits,
+        'response_size': size,
+        'shape': shape,
+    }))
+
+    key = f'{KEY_PREFIX}:{query_fingerprint}'
+    try:
+        redis = get_redis_connection('metrics')
+        pipeline = redis.pipeline(transaction=False)
+        pipeline.hsetnx(key, 'shape', json.dumps(shape))
+        pipeline.hsetnx(key, 'endpoint', endpoint)
+        pipeline.hincrby(key, 'count', 1)
+        pipeline.hincrbyfloat(key, 'duration_ms', duration_ms)
+        pipeline.hincrby(key, 'took', took or 0)
+        pipeline.zincrby(INDEX_KEY, duration_ms, query_fingerprint)
+        pipeline.execute()
+        _update_max(redis, key, duration_ms)
+    except RedisError:
+        logger.exception('Unable to aggregate slow query %s', query_fingerprint)
+
+
+def top_queries(limit):
+    """Query shapes with the biggest total duration"""
+    redis = get_redis_connection('metrics')
+    fingerprints = redis.zrevrange(INDEX_KEY, 0, limit - 1, withscores=True)
+    pipeline = redis.pipeline(transaction=False)
+    for query_fingerprint, _ in fingerprints:
+        pipeline.hgetall(f'{KEY_PREFIX}:{query_fingerprint.decode("utf-8")}')
+
+    report = []
+    for (query_fingerprint, total), fields in zip(fingerprints, pipeline.execute()):
+        fields = {field.decode('utf-8'): value.decode('utf-8') for field, value in fields.items()}
+        count = int(fields.get('count', 0)) or 1
+        report.append({
+            'fingerprint': query_fingerprint.decode('utf-8'),
+            'endpoint': fields.get('endpoint'),
+            'count': count,
+            'total_ms': total,
+            'avg_ms': total / count,
+            'max_ms': float(fields.get('max_ms', 0)),
+            'avg_took': int(fields.get('took', 0)) / count,
+            'shape': json.loads(fields.get('shape', 'null')),
+        })
+    return report
+
+
+def reset():
+    redis = get_redis_connection('metrics')
+    keys = list(redis.scan_iter(match=f'{KEY_PREFIX}:*', count=500))
+    if keys:
+        redis.delete(*keys)
+
+
+def _update_max(redis, key, duration_ms):
+    current_max = redis.hget(key, 'max_ms')
+    if current_max is None or float(current_max) < duration_ms:
+        redis.hset(key, 'max_ms', duration_ms)
+
+
+def _get_hits(response):
+    try:
+        return response['hits']['total']['value']
+    except (KeyError, TypeError):
+        return None
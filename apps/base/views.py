@@ -0,0 +1,20 @@
+from rest_framework import status
+from rest_framework.views import APIView
+from rest_framework.response import Response
+
+from apps.authentication.backends import OAuth2Authentication
+from apps.authentication.permissions import IsTokenAuthenticated, IsStaff
+from . import metrics
+from .renderers import PrometheusRenderer
+
+
+class MetricsAPIView(APIView):
+    """Latency histograms and counters of all workers in prometheus text format"""
+    authentication_classes = [OAuth2Authentication]
+    permission_classes = (IsTokenAuthenticated, IsStaff)
+    renderer_classes = [PrometheusRenderer]
+
+    def get(self, request, format=None):
+        histograms = metrics.registry.collect()
+        counters = metrics.registry.collect_counters()
+        return Response(metrics.render_prometheus(histograms, counters), status=status.HTTP_200_OK)
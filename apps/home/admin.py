@@ -6,6 +6,7 @@ from django.shortcuts import get_object_or_404
 
 from apps.products.models import Collection
 from apps.products.serializers import CollectionApiSerializer
+from apps.sales import cache as sales_cache
 from apps.sales.models import Sale
 from apps.sales.serializers import SaleApiSerializer
 from apps.authentication.permissions import IsStaff, IsTokenAuthenticated, IsAdminForDelete
@@ -44,6 +45,7 @@ class AdminHomeSaleViewSet(viewsets.ModelViewSet):
         instance = get_object_or_404(Sale, pk=pk)
         instance.on_home = False
         instance.save()
+        sales_cache.invalidate()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(methods=['PATCH'], detail=True)
@@ -51,6 +53,7 @@ class AdminHomeSaleViewSet(viewsets.ModelViewSet):
         instance = get_object_or_404(Sale, pk=pk)
         instance.on_home = True
         instance.save()
+        sales_cache.invalidate()
         return Response(status=status.HTTP_200_OK)
 
 
@@ -2,8 +2,7 @@ from rest_framework import viewsets, generics, status
 from rest_framework.views import APIView
 from rest_framework.response import Response
 
-from apps.sales.models import Sale
-from apps.sales.serializers import SaleApiSerializer
+from apps.sales import cache as sales_cache
 from apps.news.models import News
 from apps.news.serializers import NewsSerializer
 from apps.products.models import ProductInfo, Collection
@@ -13,9 +12,7 @@ from apps.products import elastic
 
 class HomeSalesAPI(APIView):
     def get(self, request, format=None):
-        queryset = Sale.objects.filter(on_home=True)
-        serializer = SaleApiSerializer(queryset, many=True)
-        return Response(data=serializer.data, status=status.HTTP_200_OK)
+        return Response(data=sales_cache.get_home_sales(), status=status.HTTP_200_OK)
 
 
 class HomeCollectionAPI(APIView):
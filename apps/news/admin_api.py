@@ -9,13 +9,13 @@ from .serializers import NewsSerializer, NewsCreateSerializer, CategorySerialize
 from .models import News, Category, NewsImage
 from apps.authentication.permissions import IsStaff, IsTokenAuthenticated, IsAdminForDelete
 from apps.authentication.backends import OAuth2Authentication
-from apps.base.pagination import BasePagination
+from apps.base.pagination import KeysetPagination
 
 
 class AdminNewsViewSet(viewsets.ModelViewSet):
     authentication_classes = [OAuth2Authentication]
     permission_classes = (IsTokenAuthenticated, IsStaff)
-    pagination_class = BasePagination
+    pagination_class = KeysetPagination
 
     def list(self, request, *args, **kwargs):
         is_active = request.query_params.get('is_active', True) in ['1', 'true', 'True', True]
@@ -99,10 +99,7 @@ class AdminNewsCategoryViewSet(viewsets.ModelViewSet):
         instance.is_active = False
         instance.save()
 
-        news = News.objects.filter(category=instance)
-        for article in news:
-            article.is_active = False
-            article.save()
+        News.objects.filter(category=instance).update(is_active=False)
 
         return Response(status=status.HTTP_204_NO_CONTENT)
 
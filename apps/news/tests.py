@@ -0,0 +1,29 @@
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from .models import News, Category
+
+
+class NewsListTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name="События", slug="events")
+        for index in range(12):
+            News.objects.create(title=f"news {index}", description="", category=category)
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def test_whole_list(self):
+        response = self.client.get('/v1/news/')
+        self.assertEqual(len(response.data), 12)
+
+    def test_page(self):
+        response = self.client.get('/v1/news/', {'page': 2})
+        self.assertEqual(response.data['count'], 12)
+        self.assertEqual(len(response.data['results']), 2)
+
+    def test_cursor(self):
+        response = self.client.get('/v1/news/', {'cursor': ''})
+        self.assertEqual(len(response.data['results']), 10)
+        self.assertIn('cursor=', response.data['next'])
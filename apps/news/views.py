@@ -3,6 +3,7 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework_extensions.cache.mixins import CacheResponseMixin
 
+from apps.base.pagination import KeysetPagination
 from .serializers import NewsSerializer, CategorySerializer
 from .models import News, Category
 
@@ -10,6 +11,14 @@ from .models import News, Category
 class NewsViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = News.objects.filter(is_active=True)
     serializer_class = NewsSerializer
+    pagination_class = KeysetPagination
+
+    def paginate_queryset(self, queryset):
+        # paginated on request only, clients reading the whole list keep working
+        params = self.request.query_params
+        if 'page' not in params and self.paginator.cursor_pagination_class.cursor_query_param not in params:
+            return None
+        return super().paginate_queryset(queryset)
 
     @action(detail=False)
     def categories(self, request):
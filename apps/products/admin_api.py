@@ -4,14 +4,17 @@ import json
 from rest_framework import viewsets, generics, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from rest_framework.exceptions import MethodNotAllowed, ValidationError
+from rest_framework.exceptions import MethodNotAllowed, ValidationError, NotFound
+from rest_framework.views import APIView
 from django.shortcuts import get_object_or_404
 from django.db.models import Q
 
-from . import elastic
+from . import elastic, feed, importer
 from apps.authentication.backends import OAuth2Authentication
 from apps.authentication.permissions import IsTokenAuthenticated, IsStaff, IsAdminForDelete
-from apps.base.pagination import BasePagination
+from apps.base.pagination import BasePagination, KeysetPagination
+from apps.base.parsers import NDJSONParser
+from apps.sales import overlay, pricing
 from .models import (
     ProductInfo,
     ProductInstance,
@@ -45,16 +48,22 @@ from .serializers import (
     CollectionCreateSerializer,
     CollectionSerializer,
     AdminProductInfoSerializer,
+    StockFeedSerializer,
 )
 
 
 class AdminProductViewSet(viewsets.ModelViewSet):
     authentication_classes = [OAuth2Authentication]
     permission_classes = (IsTokenAuthenticated, IsStaff)
-    pagination_class = BasePagination
+    pagination_class = KeysetPagination
     queryset = ProductInfo.objects.all()
     serializer_class = AdminProductInfoSerializer
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'list':
+            queryset = AdminProductInfoSerializer.setup_eager_loading(queryset)
+        return queryset
 
     def retrieve(self, request, pk=None, *args, **kwargs):
         model = get_object_or_404(ProductInfo, pk=pk)
@@ -82,6 +91,12 @@ class AdminProductViewSet(viewsets.ModelViewSet):
             elastic.index_products(product_info)
         return Response(data=serializer.data, status=status.HTTP_201_CREATED)
 
+    @action(methods=['POST'], detail=False, url_path='import', parser_classes=[NDJSONParser])
+    def bulk_import(self, request):
+        """Upsert products from NDJSON body, see apps.products.importer"""
+        result = importer.import_products(request.data)
+        return Response(data=result, status=status.HTTP_200_OK)
+
 
 class AdminProductInfoViewSet(viewsets.ModelViewSet):
     authentication_classes = [OAuth2Authentication]
@@ -104,24 +119,41 @@ class AdminProductInfoViewSet(viewsets.ModelViewSet):
         return Response(serializer.data)
 
 
+def search_instances_query(search):
+    """
+    Instance search by product name, manufacturer, category and sku.
+    Matching manufacturers, categories and products are resolved first by their
+    trigram indexes, so the instance filter is an OR of indexed conditions
+    instead of OR over joins, which is planned as a sequential scan.
+    Subqueries under the OR are not pulled up by postgres and scan the tables as well.
+    """
+    manufacturer_pks = list(Manufacturer.objects.filter(name__icontains=search).values_list('pk', flat=True))
+    category_pks = list(Category.objects.filter(name__icontains=search).values_list('pk', flat=True))
+    product_info_pks = list(
+        ProductInfo.objects.filter(
+            Q(name__icontains=search) |
+            Q(manufacturer_id__in=manufacturer_pks) |
+            Q(category_id__in=category_pks)
+        ).values_list('pk', flat=True)
+    )
+    return Q(product_info_id__in=product_info_pks) | Q(sku__icontains=search)
+
+
 class AdminProductInstanceViewSet(viewsets.ModelViewSet):
     authentication_classes = [OAuth2Authentication]
     permission_classes = (IsTokenAuthenticated, IsStaff)
-    pagination_class = BasePagination
+    pagination_class = KeysetPagination
     queryset = ProductInstance.objects.all()
     serializer_class = ProductInstanceCreateSerializer
 
     def list(self, request, *args, **kwargs):
         product_status = request.query_params.get('status', ProductInstance.STATUS_ACTIVE)
-        queryset = ProductInstance.objects.filter(status=product_status)
+        queryset = ProductInstanceTableSerializer.setup_eager_loading(
+            ProductInstance.objects.filter(status=product_status)
+        )
         search = request.query_params.get('search', None)
         if search is not None:
-            queryset = queryset.filter(
-                Q(product_info__name__icontains=search) |
-                Q(product_info__manufacturer__name__icontains=search) |
-                Q(product_info__category__name__icontains=search) |
-                Q(sku__icontains=search)
-            )
+            queryset = queryset.filter(search_instances_query(search))
         page = self.paginate_queryset(queryset)
         if page is not None:
             serializer = ProductInstanceTableSerializer(page, many=True)
@@ -158,6 +190,14 @@ class AdminProductInstanceViewSet(viewsets.ModelViewSet):
 
         return Response(serializer.data)
 
+    @action(methods=['POST'], detail=False, url_path='feed')
+    def stock_feed(self, request):
+        """Apply a batch of stock and base price changes from the ERP, see apps.products.feed"""
+        serializer = StockFeedSerializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        report = feed.apply_feed(serializer.validated_data)
+        return Response(data=report, status=status.HTTP_200_OK)
+
     @action(methods=['POST'], detail=False)
     def images(self, request):
         serializer = ProductImagesSerializer(data=request.data)
@@ -218,15 +258,10 @@ class AdminProductCategoryViewSet(viewsets.ModelViewSet):
         instance.is_active = False
         instance.save()
 
-        products = ProductInfo.objects.filter(category=instance)
-        for product in products:
-            product.status = 'archive'
-            product.save()
-
         elastic_category = {'pk': instance.pk, 'slug': instance.slug, 'name': instance.name}
-        elastic.delete_category(elastic_category)
+        task = elastic.delete_category(elastic_category)
 
-        return Response(status=status.HTTP_204_NO_CONTENT)
+        return Response(data={'task': task}, status=status.HTTP_202_ACCEPTED)
 
 
 
@@ -292,15 +327,10 @@ class AdminProductManufacturerViewSet(viewsets.ModelViewSet):
         instance.is_active = False
         instance.save()
 
-        products = ProductInfo.objects.filter(manufacturer=instance)
-        for product in products:
-            product.status = 'archive'
-            product.save()
-
         elastic_data = {'pk': instance.pk, 'slug': instance.slug, 'name': instance.name}
-        elastic.delete_manufacturer(elastic_data)
+        task = elastic.delete_manufacturer(elastic_data)
 
-        return Response(status=status.HTTP_204_NO_CONTENT)
+        return Response(data={'task': task}, status=status.HTTP_202_ACCEPTED)
 
 
 
@@ -366,14 +396,12 @@ class AdminProductTagsViewSet(viewsets.ModelViewSet):
         instance.is_active = False
         instance.save()
 
-        products = ProductInfo.objects.filter(tags=instance)
-        for product in products:
-            product.tags.remove(instance)
+        ProductInfo.tags.through.objects.filter(tags=instance).delete()
 
         elastic_tag = {'pk': instance.pk, 'name': instance.name}
-        elastic.delete_tag(elastic_tag)
+        task = elastic.delete_tag(elastic_tag)
 
-        return Response(status=status.HTTP_204_NO_CONTENT)
+        return Response(data={'task': task}, status=status.HTTP_202_ACCEPTED)
 
 
 
@@ -443,13 +471,11 @@ class AdminProductSFacetViewSet(viewsets.ModelViewSet):
         instance.is_active = False
         instance.save()
 
-        products = ProductInfo.objects.filter(sfacets__facet=instance)
-        for product in products:
-            product.sfacets.remove(*product.sfacets.filter(facet=instance))
+        ProductInfo.sfacets.through.objects.filter(sfacetvalue__facet=instance).delete()
 
-        elastic.delete_sfacet(instance.pk)
+        task = elastic.delete_sfacet(instance.pk)
 
-        return Response(status=status.HTTP_204_NO_CONTENT)
+        return Response(data={'task': task}, status=status.HTTP_202_ACCEPTED)
 
 
     @action(methods=['PATCH'], detail=True)
@@ -514,17 +540,15 @@ class AdminProductSFacetValueViewSet(viewsets.ModelViewSet):
         instance.is_active = False
         instance.save()
 
-        products = ProductInfo.objects.filter(sfacets=instance)
-        for product in products:
-            product.sfacets.remove(instance)
+        ProductInfo.sfacets.through.objects.filter(sfacetvalue=instance).delete()
 
         elastic_data = {
             'pk': instance.pk,
             'facet': {'pk': instance.facet.pk},
         }
-        elastic.delete_sfacet_value(elastic_data)
+        task = elastic.delete_sfacet_value(elastic_data)
 
-        return Response(status=status.HTTP_204_NO_CONTENT)
+        return Response(data={'task': task}, status=status.HTTP_202_ACCEPTED)
 
 
 
@@ -625,7 +649,7 @@ class AdminCollectionViewSet(viewsets.ModelViewSet):
 
     def list(self, request, *args, **kwargs):
         is_active = request.query_params.get('is_active', True) in ['1', 'true', 'True', True]
-        queryset = Collection.objects.filter(is_active=is_active)
+        queryset = CollectionSerializer.setup_eager_loading(Collection.objects.filter(is_active=is_active))
         is_public = request.query_params.get('is_active', None)
         if is_public is not None:
             is_public_filter = is_public in ['1', 'true', 'True', True]
@@ -641,8 +665,10 @@ class AdminCollectionViewSet(viewsets.ModelViewSet):
         serializer = CollectionCreateSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         instance = serializer.save()
-        elastic.add_collection(instance)
-        instance.add_collection_to_instances()
+        members = set(instance.products.values_list('pk', flat=True))
+        instance.update_instance_collections(added=members, removed=set())
+        if instance.is_active:
+            elastic.index_collection(instance)
         return Response(data=serializer.data, status=status.HTTP_201_CREATED)
 
     def retrieve(self, request, pk=None, *args, **kwargs):
@@ -654,9 +680,17 @@ class AdminCollectionViewSet(viewsets.ModelViewSet):
         instance = get_object_or_404(Collection, pk=pk)
         serializer = CollectionCreateSerializer(instance, data=request.data)
         serializer.is_valid(raise_exception=True)
+        previous_members = set(instance.products.values_list('pk', flat=True))
         instance = serializer.save()
-        elastic.update_collection(instance)
-        #instance.add_collection_to_instances()
+        members = set(instance.products.values_list('pk', flat=True))
+        instance.update_instance_collections(
+            added=members - previous_members,
+            removed=previous_members - members,
+        )
+        if instance.is_active:
+            elastic.index_collection(instance)
+        pricing.reprice_collection_members(instance, previous_members ^ members)
+        overlay.invalidate()
 
         return Response(serializer.data)
 
@@ -671,7 +705,7 @@ class AdminCollectionViewSet(viewsets.ModelViewSet):
         instance = self.get_object()
         instance.is_active = False
         instance.save()
-        elastic.remove_collection(instance)
+        elastic.delete_collection(instance)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(methods=['PATCH'], detail=True)
@@ -679,7 +713,7 @@ class AdminCollectionViewSet(viewsets.ModelViewSet):
         instance = self.get_object()
         instance.is_active = True
         instance.save()
-        elastic.add_collection(instance)
+        elastic.index_collection(instance)
         return Response(status=status.HTTP_200_OK)
 
 
@@ -688,3 +722,15 @@ class AdminCollectionImageViewSet(viewsets.ModelViewSet):
     permission_classes = (IsTokenAuthenticated, IsStaff, IsAdminForDelete)
     serializer_class = CollectionImageSerializer
     queryset = CollectionImage.objects.all()
+
+
+class AdminElasticTaskAPIView(APIView):
+    """Progress of background elastic updates started by deactivate actions"""
+    authentication_classes = [OAuth2Authentication]
+    permission_classes = (IsTokenAuthenticated, IsStaff)
+
+    def get(self, request, task_id, *args, **kwargs):
+        task = elastic.get_task(task_id)
+        if task is None:
+            raise NotFound()
+        return Response(data=task, status=status.HTTP_200_OK)
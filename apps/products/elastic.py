@@ -6,29 +6,25 @@ from decimal import Decimal
 from elasticsearch import Elasticsearch, helpers, exceptions
 from django.conf import settings
 
+from apps.base.instrumentation import InstrumentedTransport
+from apps.base.metrics import timed
+from apps.sales import overlay
+
 from .serializers import ProductListSerializer, ProductInstanceSerializer
 from .models import NFacet, ProductInstance
 
 
-es = Elasticsearch([settings.ELASTIC_SEARCH["CONFIG"]])
+es = Elasticsearch([settings.ELASTIC_SEARCH["CONFIG"]], transport_class=InstrumentedTransport)
 EXCLUDED_FIELDS = ["suggest", "completion", "fulltext_russian", "fulltext_phonetic"]
 
 
+@timed('bulk')
 def index_products(product_model):
-    serializer = ProductListSerializer(product_model)
-    data = json.loads(json.dumps(serializer.data))
-    product_info_source = _create_product_info_source(data)
     actions = []
-    count_instances = len(data["instances"])
-    for product_instance in data["instances"]:
+    for product_instance, source in _create_product_sources(product_model):
         # TODO: if в цикле - плохо. сделать цикл по уже фильтрованным инстансам
         if product_instance["status"] != ProductInstance.STATUS_ACTIVE:
             continue
-        source = {
-            **product_info_source,
-            "count_instances": count_instances,
-            "instance": product_instance,
-        }
         actions.append(
             {
                 "_index": settings.ELASTIC_SEARCH["INDEX"],
@@ -43,6 +39,73 @@ def index_products(product_model):
         helpers.bulk(es, actions)
 
 
+@timed('bulk')
+def index_products_bulk(product_models):
+    """
+    Index documents of active instances of the products and delete documents
+    of the other instances with one bulk request.
+    Products should be loaded with ProductListSerializer.setup_eager_loading.
+    Return errors of the request, missing documents of inactive instances are not errors.
+    """
+    actions = []
+    nfacet_models = NFacet.objects.in_bulk()
+    for product_model in product_models:
+        for product_instance, source in _create_product_sources(product_model, nfacet_models):
+            action = {
+                "_index": settings.ELASTIC_SEARCH["INDEX"],
+                "_id": product_instance["pk"],
+                "_type": "_doc",
+            }
+            if product_instance["status"] == ProductInstance.STATUS_ACTIVE:
+                actions.append({**action, "_op_type": "index", "_source": source})
+            else:
+                actions.append({**action, "_op_type": "delete"})
+
+    if not actions:
+        return []
+    _, errors = helpers.bulk(es, actions, raise_on_error=False)
+    return [error for error in errors if error.get("delete", {}).get("status") != 404]
+
+
+@timed('bulk')
+def update_instances(documents, chunk_size=500):
+    """
+    Partial update of instance fields of documents, `documents` are
+    {'instance_pk': pk, 'instance': {field: value}}. Return errors of the request.
+    """
+    actions = (
+        {
+            "_op_type": "update",
+            "_index": settings.ELASTIC_SEARCH["INDEX"],
+            "_type": "_doc",
+            "_id": document["instance_pk"],
+            "doc": {"instance": document["instance"]},
+        }
+        for document in documents
+    )
+    return [
+        item
+        for ok, item in helpers.streaming_bulk(es, actions, chunk_size=chunk_size, raise_on_error=False)
+        if not ok
+    ]
+
+
+def _create_product_sources(product_model, nfacet_models=None):
+    """(instance data, document source) for every instance of the product"""
+    serializer = ProductListSerializer(product_model)
+    data = json.loads(json.dumps(serializer.data))
+    product_info_source = _create_product_info_source(data, nfacet_models)
+    count_instances = len(data["instances"])
+    for product_instance in data["instances"]:
+        product_instance.pop("collections", None)
+        yield product_instance, {
+            **product_info_source,
+            "count_instances": count_instances,
+            "instance": product_instance,
+        }
+
+
+@timed('elastic')
 def index_product_instance(product_info, product_instance):
     if product_instance.status != ProductInstance.STATUS_ACTIVE:
         es.delete(index=settings.ELASTIC_SEARCH['INDEX'], doc_type='_doc', id=product_instance.pk)
@@ -52,6 +115,7 @@ def index_product_instance(product_info, product_instance):
 
     instance_serializer = ProductInstanceSerializer(product_instance)
     instance_data = json.loads(json.dumps(instance_serializer.data))
+    instance_data.pop('collections', None)
 
     product_info_source = _create_product_info_source(info_data)
     source = {
@@ -65,51 +129,26 @@ def delete_product(product_model):
     es.delete(index=settings.ELASTIC_SEARCH['INDEX'], doc_type='_doc', id=product_model.id)
 
 
-def add_collection(collection_model):
-    product_ids = list(collection_model.products.values_list("pk", flat=True))
-    body = {
-        "query": {"bool": {"filter": {"terms": {"instance.pk": product_ids}}}},
-        "script": {
-            "lang": "painless",
-            "source": """
-                ctx._source.instance.collections.add(params.collection);
-            """,
-            "params": {
-                "collection": collection_model.pk,
-            },
-        },
-    }
-    es.update_by_query(
-        index=settings.ELASTIC_SEARCH["INDEX"], body=body, conflicts="proceed"
+@timed('elastic')
+def index_collection(collection_model):
+    """
+    Collection membership lives in its own small document, product documents
+    are filtered by collection with a terms lookup, see _create_filter_query
+    """
+    body = {"products": list(collection_model.products.values_list("pk", flat=True))}
+    es.index(
+        index=settings.ELASTIC_SEARCH["COLLECTIONS_INDEX"], body=body, doc_type="_doc", id=collection_model.pk
     )
 
 
-def remove_collection(collection_model):
-    body = {
-        "query": {
-            "bool": {"filter": {"term": {"instance.collections": collection_model.pk}}}
-        },
-        "script": {
-            "lang": "painless",
-            "source": """
-                int index = ctx._source.instance.collections.indexOf(params.collection);
-                if (index >= 0) {
-                    ctx._source.instance.collections.remove(index);
-                }
-            """,
-            "params": {
-                "collection": collection_model.pk,
-            },
-        },
-    }
-    es.update_by_query(index=settings.ELASTIC_SEARCH["INDEX"], body=body)
-
-
-def update_collection(collection_model):
-    remove_collection(collection_model)
-    add_collection(collection_model)
+def delete_collection(collection_model):
+    try:
+        es.delete(index=settings.ELASTIC_SEARCH["COLLECTIONS_INDEX"], doc_type="_doc", id=collection_model.pk)
+    except exceptions.NotFoundError:
+        pass
 
 
+@timed('elastic')
 def get_products(params):
     filter_query = _create_filter_query(params)
 
@@ -132,6 +171,7 @@ def get_products(params):
     total_products = products["hits"]["total"]["value"]
     formatted_products = []
 
+    overlay.apply([hit["_source"] for hit in products["hits"]["hits"]])
     for hit in products["hits"]["hits"]:
         product = _format_product(hit['_source'])
         product["pk"] = hit["_id"]
@@ -143,6 +183,7 @@ def get_products(params):
     }
 
 
+@timed('elastic')
 def get_product_info(pk):
     query = {
         "_source": {"excludes": EXCLUDED_FIELDS},
@@ -157,6 +198,7 @@ def get_product_info(pk):
     if not hits:
         return None
 
+    overlay.apply([hit["_source"] for hit in hits])
     product_info = hits[0]["_source"]
     product_info['instances'] = []
     for nfacet in product_info['number_facets']:
@@ -172,6 +214,7 @@ def get_product_info(pk):
     return product_info
 
 
+@timed('elastic')
 def get_product_instance(pk):
     try:
         product = es.get(index=settings.ELASTIC_SEARCH["INDEX"], doc_type="_doc", id=pk)
@@ -180,6 +223,7 @@ def get_product_instance(pk):
 
     for exclude_field in EXCLUDED_FIELDS:
         product["_source"].pop(exclude_field, None)
+    overlay.apply([product["_source"]])
     formatted_product = _format_product(product["_source"])
 
     return formatted_product
@@ -193,6 +237,7 @@ def _format_product(product):
     return product
 
 
+@timed('elastic')
 def get_tags(params):
     filter_query = _create_filter_query(params)
     query = {
@@ -237,6 +282,7 @@ def get_tags(params):
     return formatted_tags
 
 
+@timed('elastic')
 def get_categories():
     query = {
         "size": 0,
@@ -274,6 +320,7 @@ def get_categories():
     return categories
 
 
+@timed('elastic')
 def get_facets(params):
     """
     Метод выполняет агрегации фасетных данных
@@ -453,7 +500,7 @@ def get_facets(params):
     return string_facets, number_facets
 
 
-def _create_product_info_source(product):
+def _create_product_info_source(product, nfacet_models=None):
     sfacets = []
     tmp_sfacets = product['sfacets']
     tmp_sfacets.sort(key=lambda elem: elem['facet']['pk'])
@@ -473,7 +520,10 @@ def _create_product_info_source(product):
 
     nfacets = []
     for nfacet in product['nfacets']:
-        nfacet_model = NFacet.objects.get(pk=nfacet['facet'])
+        if nfacet_models is not None:
+            nfacet_model = nfacet_models[nfacet['facet']]
+        else:
+            nfacet_model = NFacet.objects.get(pk=nfacet['facet'])
         nfacets.append({
             'pk': nfacet_model.pk,
             'slug': nfacet_model.slug,
@@ -575,9 +625,19 @@ def _create_filter_query(params, special_sfacet=None):
     if collections is not None:
         collection_query = {
             "bool": {
-                "filter": {
-                    "terms": {"instance.collections": collections}
-                }
+                "should": [
+                    {
+                        "terms": {
+                            "instance.pk": {
+                                "index": settings.ELASTIC_SEARCH["COLLECTIONS_INDEX"],
+                                "id": str(collection),
+                                "path": "products",
+                            }
+                        }
+                    }
+                    for collection in collections
+                ],
+                "minimum_should_match": 1,
             }
         }
         filter_query.append(collection_query)
@@ -707,6 +767,7 @@ def _get_special_agg_values(params, special_sfacet, size=10):
     return sp_string_facet_values
 
 
+@timed('elastic')
 def get_sfacet_all_values(params, sfacet):
     facet_values = _get_special_agg_values(params, sfacet, size=100)
     return facet_values
@@ -728,7 +789,7 @@ def update_category(category):
 
 def delete_category(category):
     body = {"query": {"term": {"category.pk": category['pk']}}}
-    es.delete_by_query(index=settings.ELASTIC_SEARCH['INDEX'], body=body)
+    return _start_task(es.delete_by_query, body)
 
 
 def update_manufacturer(manufacturer):
@@ -747,7 +808,7 @@ def update_manufacturer(manufacturer):
 
 def delete_manufacturer(manufacturer):
     body = {"query": {"term": {"manufacturer.pk": manufacturer['pk']}}}
-    es.delete_by_query(index=settings.ELASTIC_SEARCH['INDEX'], body=body)
+    return _start_task(es.delete_by_query, body)
 
 
 def update_tag(tag):
@@ -797,7 +858,7 @@ def delete_tag(tag):
         }
       }
     }
-    es.update_by_query(index=settings.ELASTIC_SEARCH['INDEX'], body=body)
+    return _start_task(es.update_by_query, body)
 
 
 def update_sfacet(string_facet):
@@ -852,7 +913,7 @@ def delete_sfacet(pk):
             }
         }
     }
-    es.update_by_query(index=settings.ELASTIC_SEARCH['INDEX'], body=body)
+    return _start_task(es.update_by_query, body)
 
 
 def update_sfacet_value(value):
@@ -938,7 +999,7 @@ def delete_sfacet_value(value):
             }
         }
     }
-    es.update_by_query(index=settings.ELASTIC_SEARCH['INDEX'], body=body)
+    return _start_task(es.update_by_query, body)
 
 
 def update_nfacet(facet):
@@ -996,6 +1057,31 @@ def delete_nfacet(pk):
     es.update_by_query(index=settings.ELASTIC_SEARCH['INDEX'], body=body)
 
 
+def _start_task(by_query, body):
+    """Run update/delete by query in background, return id of the elastic task"""
+    response = by_query(
+        index=settings.ELASTIC_SEARCH['INDEX'], body=body, conflicts='proceed', wait_for_completion=False
+    )
+    return response['task']
+
+
+def get_task(task_id):
+    try:
+        task = es.tasks.get(task_id=task_id)
+    except exceptions.NotFoundError:
+        return None
+
+    task_status = task['task']['status']
+    return {
+        'task': task_id,
+        'completed': task['completed'],
+        'total': task_status['total'],
+        'updated': task_status['updated'],
+        'deleted': task_status['deleted'],
+        'failures': task.get('response', {}).get('failures', []),
+    }
+
+
 def create_index():
     body = {
         "settings": {
@@ -1111,7 +1197,6 @@ def create_index():
                         "src": { "type": "keyword", "index": False }
                     }
                     },
-                    "collections": { "type": "integer" },
                     "sales": { 
                     "type": "nested",
                     "properties": {
@@ -1189,6 +1274,30 @@ def delete_index():
         pass
 
 
+def create_collections_index():
+    body = {
+        "settings": {
+            "index": {
+                "number_of_shards": 1,
+                "number_of_replicas": 1
+            }
+        },
+        "mappings": {
+            "properties": {
+                "products": {"type": "integer", "index": False}
+            }
+        }
+    }
+    es.indices.create(index=settings.ELASTIC_SEARCH['COLLECTIONS_INDEX'], body=body)
+
+
+def delete_collections_index():
+    try:
+        es.indices.delete(index=settings.ELASTIC_SEARCH['COLLECTIONS_INDEX'])
+    except exceptions.NotFoundError:
+        pass
+
+
 def _format_number(number):
     number = float(number)
     return int(number) if number.is_integer() else number
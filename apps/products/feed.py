@@ -0,0 +1,102 @@
+"""
+Stock and base price feed from the ERP.
+
+A batch of (sku, stock_balance, base_price) rows is coalesced to the last
+value of every sku and applied with one UPDATE ... FROM (VALUES ...) per chunk.
+Only rows whose values really change are written. Instances with a new base
+price are repriced under sales in process by apps.sales.pricing, and changed
+active instances get compact partial updates of their documents in one
+streaming bulk request.
+"""
+import logging
+import time
+
+from django.db import connection, transaction
+
+from apps.sales import pricing
+from . import elastic
+from .models import ProductInstance
+from .serializers import ProductInstanceSerializer
+
+
+logger = logging.getLogger('apps.products.feed')
+
+UPDATE_SQL = '''
+    UPDATE products_productinstance AS instance
+    SET stock_balance = COALESCE(feed.stock_balance, instance.stock_balance),
+        base_price = COALESCE(feed.base_price, instance.base_price)
+    FROM (VALUES {values}) AS feed (sku, stock_balance, base_price),
+        products_productinstance AS old
+    WHERE old.id = instance.id
+        AND instance.sku = feed.sku
+        AND (instance.stock_balance IS DISTINCT FROM COALESCE(feed.stock_balance, instance.stock_balance)
+            OR instance.base_price IS DISTINCT FROM COALESCE(feed.base_price, instance.base_price))
+    RETURNING instance.id, instance.status, instance.stock_balance, instance.base_price,
+        old.base_price IS DISTINCT FROM instance.base_price
+'''
+
+
+def apply_feed(rows, chunk_size=pricing.CHUNK_SIZE):
+    """
+    Apply rows {'sku': .., 'stock_balance': .., 'base_price': ..}, missing or None
+    values are kept as they are. Return report of the batch with timings in milliseconds.
+    """
+    started = time.monotonic()
+    # the last value of a sku wins
+    latest = {}
+    received = 0
+    for row in rows:
+        received += 1
+        latest.pop(row['sku'], None)
+        latest[row['sku']] = (row['sku'], row.get('stock_balance'), row.get('base_price'))
+
+    updated = []
+    with transaction.atomic():
+        for chunk in pricing.iter_chunks(latest.values(), chunk_size):
+            updated += _update_chunk(chunk)
+        repriced = pricing.apply_sales(
+            [instance_pk for instance_pk, _, _, _, price_changed in updated if price_changed], chunk_size
+        )
+    db_finished = time.monotonic()
+
+    prices = {instance.pk: instance for instance in repriced}
+    # the format written by the indexer, e.g. "100.00"
+    base_price_field = ProductInstanceSerializer().fields['base_price']
+    documents = []
+    for instance_pk, status, stock_balance, base_price, _ in updated:
+        if status != ProductInstance.STATUS_ACTIVE:
+            continue
+        document = {'stock_balance': stock_balance, 'base_price': base_price_field.to_representation(base_price)}
+        if instance_pk in prices:
+            document['sales'] = prices[instance_pk].sales
+            document['price'] = prices[instance_pk].price
+        documents.append({'instance_pk': instance_pk, 'instance': document})
+    errors = elastic.update_instances(documents, chunk_size)
+    finished = time.monotonic()
+
+    report = {
+        'received': received,
+        'skus': len(latest),
+        'updated': len(updated),
+        'repriced': len(repriced),
+        'indexed': len(documents) - len(errors),
+        'errors': errors,
+        'db_ms': round((db_finished - started) * 1000, 1),
+        'elastic_ms': round((finished - db_finished) * 1000, 1),
+        'total_ms': round((finished - started) * 1000, 1),
+        'rows_per_second': round(received / (finished - started)) if finished > started else received,
+    }
+    logger.info(
+        'Feed of %s rows (%s skus): %s updated, %s repriced in %sms (db %sms, elastic %sms)',
+        received, report['skus'], report['updated'], report['repriced'],
+        report['total_ms'], report['db_ms'], report['elastic_ms'],
+    )
+    return report
+
+
+def _update_chunk(chunk):
+    values = ', '.join(['(%s::bigint, %s::integer, %s::numeric)'] * len(chunk))
+    params = [value for row in chunk for value in row]
+    with connection.cursor() as cursor:
+        cursor.execute(UPDATE_SQL.format(values=values), params)
+        return cursor.fetchall()
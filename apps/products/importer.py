@@ -0,0 +1,238 @@
+"""
+Bulk import of products from NDJSON.
+
+Every line is a product in the format of ProductCreateSerializer with primary
+keys of related objects and of uploaded images, see ProductImportSerializer.
+Products are matched by sku of their instances: a line with a known sku updates
+the product holding it, other lines create new products.
+
+Lines are processed in batches. References of a whole batch are checked with one
+query per model, products and instances are written with bulk_create/bulk_update,
+through tables of the batch are rewritten with one insert per relation and
+documents of the batch are sent to elastic in one bulk request.
+Invalid lines are reported by line number and do not abort their batch.
+"""
+import json
+from collections import defaultdict
+
+from django.db import transaction
+
+from apps.sales import pricing
+from . import elastic
+from .models import (
+    ProductInfo,
+    ProductInstance,
+    ProductImage,
+    Category,
+    Manufacturer,
+    Tags,
+    SFacetValue,
+    NFacetValue,
+)
+from .serializers import ProductImportSerializer, ProductListSerializer
+
+
+BATCH_SIZE = 500
+
+PRODUCT_FIELDS = ('name', 'description', 'extra', 'manufacturer_id', 'category_id')
+INSTANCE_FIELDS = ('measure', 'capacity_type', 'base_price', 'stock_balance', 'package_amount', 'status')
+M2M_FIELDS = ('tags', 'sfacets', 'nfacets')
+
+# (field, model, many)
+REFERENCES = (
+    ('manufacturer', Manufacturer, False),
+    ('category', Category, False),
+    ('tags', Tags, True),
+    ('sfacets', SFacetValue, True),
+    ('nfacets', NFacetValue, True),
+)
+
+
+def import_products(lines, batch_size=BATCH_SIZE, progress=None):
+    """
+    Upsert products from NDJSON lines, `lines` may be a file or any iterable of strings.
+    Return {'created': n, 'updated': n, 'errors': [{'line': number, 'errors': {...}}, ...]}
+    """
+    result = {'created': 0, 'updated': 0, 'errors': []}
+    numbered_lines = ((number, line) for number, line in enumerate(lines, 1) if line.strip())
+
+    for batch in pricing.iter_chunks(numbered_lines, batch_size):
+        rows = []
+        for number, line in batch:
+            try:
+                data = json.loads(line)
+            except ValueError as error:
+                result['errors'].append({'line': number, 'errors': {'non_field_errors': [str(error)]}})
+                continue
+            serializer = ProductImportSerializer(data=data)
+            if serializer.is_valid():
+                rows.append((number, serializer.validated_data))
+            else:
+                result['errors'].append({'line': number, 'errors': serializer.errors})
+
+        rows = _check_references(rows, result['errors'])
+        rows = _match_products(rows, result['errors'])
+        with transaction.atomic():
+            product_pks, created, updated = _write_batch(rows, batch_size)
+        index_errors = elastic.index_products_bulk(
+            ProductListSerializer.setup_eager_loading(ProductInfo.objects.filter(pk__in=product_pks))
+        )
+        for error in index_errors:
+            result['errors'].append({'line': None, 'errors': {'elastic': [error]}})
+
+        result['created'] += created
+        result['updated'] += updated
+        if progress is not None:
+            progress(result)
+
+    return result
+
+
+def _check_references(rows, errors):
+    """Drop rows referencing missing objects, one query per model for the batch"""
+    pks = defaultdict(set)
+    for _, data in rows:
+        for field, _, many in REFERENCES:
+            pks[field].update(data[field] if many else [data[field]])
+        for instance in data['instances']:
+            pks['images'].update(instance['images'])
+
+    existing = {
+        field: set(model.objects.filter(pk__in=pks[field]).values_list('pk', flat=True))
+        for field, model, _ in REFERENCES + (('images', ProductImage, True),)
+    }
+
+    valid_rows = []
+    for number, data in rows:
+        row_errors = {}
+        for field, _, many in REFERENCES:
+            values = data[field] if many else [data[field]]
+            missing = [pk for pk in values if pk not in existing[field]]
+            if missing:
+                row_errors[field] = [_does_not_exist(pk) for pk in missing]
+        missing_images = [
+            pk for instance in data['instances'] for pk in instance['images'] if pk not in existing['images']
+        ]
+        if missing_images:
+            row_errors['images'] = [_does_not_exist(pk) for pk in missing_images]
+
+        if row_errors:
+            errors.append({'line': number, 'errors': row_errors})
+        else:
+            valid_rows.append((number, data))
+    return valid_rows
+
+
+def _match_products(rows, errors):
+    """
+    Find products to update by sku of their instances.
+    Return (line number, data, product pk or None, {sku: instance pk}) of valid rows.
+    """
+    skus = [instance['sku'] for _, data in rows for instance in data['instances']]
+    known_skus = {
+        sku: (instance_pk, product_info_pk)
+        for sku, instance_pk, product_info_pk in ProductInstance.objects.filter(sku__in=skus)
+        .values_list('sku', 'pk', 'product_info_id')
+    }
+
+    matched_rows = []
+    seen_skus = set()
+    for number, data in rows:
+        row_skus = [instance['sku'] for instance in data['instances']]
+        repeated = [sku for sku in row_skus if sku in seen_skus]
+        if repeated:
+            errors.append({'line': number, 'errors': {'instances': [
+                f'Артикул {sku} уже встречался в импорте' for sku in repeated
+            ]}})
+            continue
+
+        product_pks = {known_skus[sku][1] for sku in row_skus if sku in known_skus}
+        if len(product_pks) > 1:
+            errors.append({'line': number, 'errors': {'instances': [
+                'Артикулы позиций принадлежат разным товарам'
+            ]}})
+            continue
+
+        seen_skus.update(row_skus)
+        instance_pks = {sku: known_skus[sku][0] for sku in row_skus if sku in known_skus}
+        matched_rows.append((number, data, product_pks.pop() if product_pks else None, instance_pks))
+    return matched_rows
+
+
+def _write_batch(rows, batch_size):
+    """Upsert products, instances, m2m links and images of the batch, return (product pks, created, updated)"""
+    new_products = []
+    products_to_update = ProductInfo.objects.in_bulk([product_pk for _, _, product_pk, _ in rows if product_pk])
+    row_products = []
+    for _, data, product_pk, _ in rows:
+        product = products_to_update[product_pk] if product_pk else ProductInfo()
+        product.name = data['name']
+        product.description = data.get('description')
+        product.extra = data.get('extra') or {}
+        product.manufacturer_id = data['manufacturer']
+        product.category_id = data['category']
+        if not product_pk:
+            new_products.append(product)
+        row_products.append(product)
+
+    ProductInfo.objects.bulk_create(new_products, batch_size=batch_size)
+    ProductInfo.objects.bulk_update(products_to_update.values(), PRODUCT_FIELDS, batch_size=batch_size)
+
+    instances_to_update = ProductInstance.objects.in_bulk(
+        [instance_pk for _, _, _, instance_pks in rows for instance_pk in instance_pks.values()]
+    )
+    new_instances = []
+    row_instances = []
+    for (_, data, _, instance_pks), product in zip(rows, row_products):
+        for instance_data in data['instances']:
+            instance_pk = instance_pks.get(instance_data['sku'])
+            if instance_pk:
+                instance = instances_to_update[instance_pk]
+            else:
+                instance = ProductInstance(product_info=product, sku=instance_data['sku'])
+                instance.price = instance_data['base_price']
+                new_instances.append(instance)
+            for field in INSTANCE_FIELDS:
+                if field in instance_data:
+                    setattr(instance, field, instance_data[field])
+            row_instances.append((instance, instance_data['images']))
+
+    ProductInstance.objects.bulk_create(new_instances, batch_size=batch_size)
+    ProductInstance.objects.bulk_update(instances_to_update.values(), INSTANCE_FIELDS, batch_size=batch_size)
+
+    _write_m2m(rows, row_products, batch_size)
+    images = [
+        ProductImage(pk=image_pk, instance_id=instance.pk)
+        for instance, image_pks in row_instances
+        for image_pk in image_pks
+    ]
+    ProductImage.objects.bulk_update(images, ['instance'], batch_size=batch_size)
+
+    product_pks = [product.pk for product in row_products]
+    ProductInfo.objects.filter(pk__in=product_pks).update_active_instance_count()
+    pricing.apply_sales([instance.pk for instance, _ in row_instances], batch_size)
+    return product_pks, len(new_products), len(products_to_update)
+
+
+def _write_m2m(rows, row_products, batch_size):
+    """Replace links of updated products, one delete and one insert per through table"""
+    updated_pks = [product_pk for _, _, product_pk, _ in rows if product_pk]
+    for field_name in M2M_FIELDS:
+        field = ProductInfo._meta.get_field(field_name)
+        through = field.remote_field.through
+        product_column = f'{field.m2m_field_name()}_id'
+        related_column = f'{field.m2m_reverse_field_name()}_id'
+
+        through.objects.filter(**{f'{product_column}__in': updated_pks}).delete()
+        through.objects.bulk_create(
+            [
+                through(**{product_column: product.pk, related_column: related_pk})
+                for (_, data, _, _), product in zip(rows, row_products)
+                for related_pk in set(data[field_name])
+            ],
+            batch_size=batch_size,
+        )
+
+
+def _does_not_exist(pk):
+    return f'Недопустимый первичный ключ "{pk}" - объект не существует.'
@@ -0,0 +1,36 @@
+import json
+
+from django.core.management.base import BaseCommand
+from apps.base import slowlog
+
+
+class Command(BaseCommand):
+    help = 'Show the most expensive elastic query shapes collected by the slow query log'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=20, help='Number of query shapes to show')
+        parser.add_argument('--reset', action='store_true', help='Clear collected statistics after the report')
+
+    def handle(self, *args, **options):
+        report = slowlog.top_queries(options['top'])
+        if not report:
+            self.stdout.write('No slow queries recorded')
+
+        for position, entry in enumerate(report, start=1):
+            self.stdout.write(
+                '{position}. {fingerprint} {endpoint} | count {count} | total {total:.0f}ms | '
+                'avg {avg:.1f}ms | max {max:.1f}ms | avg took {took:.1f}ms'.format(
+                    position=position,
+                    fingerprint=entry['fingerprint'],
+                    endpoint=entry['endpoint'],
+                    count=entry['count'],
+                    total=entry['total_ms'],
+                    avg=entry['avg_ms'],
+                    max=entry['max_ms'],
+                    took=entry['avg_took'],
+                )
+            )
+            self.stdout.write(json.dumps(entry['shape'], indent=2, ensure_ascii=False))
+
+        if options['reset']:
+            slowlog.reset()
@@ -0,0 +1,32 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+from apps.products import importer
+
+
+class Command(BaseCommand):
+    help = 'Upsert products from NDJSON file, one product per line'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--batch-size', type=int, default=importer.BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+
+        def progress(result):
+            self.stdout.write(
+                f'created {result["created"]} | updated {result["updated"]} | '
+                f'errors {len(result["errors"])} | {time.monotonic() - started:.1f}s'
+            )
+
+        with open(options['path'], encoding='utf-8') as lines:
+            result = importer.import_products(lines, batch_size=options['batch_size'], progress=progress)
+
+        for error in result['errors']:
+            self.stderr.write(f'line {error["line"]}: {json.dumps(error["errors"], ensure_ascii=False)}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {result["created"]}, updated {result["updated"]} products, '
+            f'{len(result["errors"])} errors in {time.monotonic() - started:.1f}s'
+        ))
@@ -1,6 +1,6 @@
 from django.core.management.base import BaseCommand
 from apps.products import elastic
-from apps.products.models import ProductInfo
+from apps.products.models import Collection, ProductInfo
 
 
 class Command(BaseCommand):
@@ -8,6 +8,11 @@ class Command(BaseCommand):
     def handle(self, *args, **kwargs):
         elastic.delete_index()
         elastic.create_index()
-        products = ProductInfo.objects.all()
+        products = ProductInfo.objects.active()
         for product in products:
-            elastic.index_products(product)
\ No newline at end of file
+            elastic.index_products(product)
+
+        elastic.delete_collections_index()
+        elastic.create_collections_index()
+        for collection in Collection.objects.filter(is_active=True):
+            elastic.index_collection(collection)
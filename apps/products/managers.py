@@ -1,4 +1,33 @@
 from django.db import models
+from django.db.models import Count, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+
+class ProductInfoQuerySet(models.QuerySet):
+
+    def active(self):
+        """Products with at least one active instance, a read of the indexed column"""
+        return self.filter(active_instance_count__gt=0)
+
+    def with_active_instances(self):
+        """Annotate `active_instances` counted from the instances, e.g. to check the stored column"""
+        from .models import ProductInstance
+
+        return self.annotate(
+            active_instances=Count('instances', filter=Q(instances__status=ProductInstance.STATUS_ACTIVE)),
+        )
+
+    def update_active_instance_count(self):
+        """Recompute the stored active_instance_count of the products with one UPDATE"""
+        from .models import ProductInstance
+
+        active_instances = ProductInstance.objects\
+            .filter(product_info=OuterRef('pk'), status=ProductInstance.STATUS_ACTIVE)\
+            .order_by()\
+            .values('product_info')\
+            .annotate(count=Count('pk'))\
+            .values('count')
+        return self.update(active_instance_count=Coalesce(Subquery(active_instances), 0))
 
 
 class RelatedProductManager(models.Manager):
@@ -0,0 +1,16 @@
+import django.contrib.postgres.indexes
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='productinstance',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['sales'], name='productinstance_sales_gin', opclasses=['jsonb_path_ops']),
+        ),
+    ]
@@ -0,0 +1,30 @@
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+# icontains lookups are compiled to UPPER("column"::text) LIKE UPPER(%s),
+# the indexes are built on the same expression to be used by the planner
+TRIGRAM_INDEXES = [
+    ('products_productinfo_name_trgm', 'products_productinfo', 'name'),
+    ('products_productinstance_sku_trgm', 'products_productinstance', 'sku'),
+    ('products_category_name_trgm', 'products_category', 'name'),
+    ('products_manufacturer_name_trgm', 'products_manufacturer', 'name'),
+    ('products_tags_name_trgm', 'products_tags', 'name'),
+    ('products_sfacet_name_trgm', 'products_sfacet', 'name'),
+    ('products_nfacet_name_trgm', 'products_nfacet', 'name'),
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0002_productinstance_sales_gin'),
+    ]
+
+    operations = [TrigramExtension()] + [
+        migrations.RunSQL(
+            sql=f'CREATE INDEX IF NOT EXISTS {name} ON {table} USING gin ((UPPER({column}::text)) gin_trgm_ops);',
+            reverse_sql=f'DROP INDEX IF EXISTS {name};',
+        )
+        for name, table, column in TRIGRAM_INDEXES
+    ]
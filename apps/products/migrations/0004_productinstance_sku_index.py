@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0003_trigram_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='productinstance',
+            name='sku',
+            field=models.BigIntegerField(db_index=True, verbose_name='Артикул'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+from django.db import migrations, models
+
+
+BACKFILL_SQL = '''
+    UPDATE products_productinfo AS product
+    SET active_instance_count = (
+        SELECT COUNT(*) FROM products_productinstance AS instance
+        WHERE instance.product_info_id = product.id AND instance.status = 'active'
+    )
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0004_productinstance_sku_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productinfo',
+            name='active_instance_count',
+            field=models.PositiveIntegerField(db_index=True, default=0, editable=False, verbose_name='Активных позиций'),
+        ),
+        migrations.RunSQL(BACKFILL_SQL, migrations.RunSQL.noop),
+    ]
@@ -3,9 +3,10 @@ import datetime
 
 from django.db import models
 from django.contrib.postgres.fields import JSONField
+from django.contrib.postgres.indexes import GinIndex
 from slugify import slugify
 
-from .managers import RelatedProductManager
+from .managers import ProductInfoQuerySet, RelatedProductManager
 
 
 def upload_location(instance, filename):
@@ -35,13 +36,24 @@ class ProductInfo(models.Model):
     tags = models.ManyToManyField('Tags', blank=True, verbose_name='Тэги')
     extra = JSONField(blank=True, null=True, default=dict, verbose_name='Дополнительно')
     created_at = models.DateTimeField(auto_now_add=True, null=False, blank=True, verbose_name='Созданно')
+    # maintained by ProductInstance.save/delete and ProductInfoQuerySet.update_active_instance_count
+    active_instance_count = models.PositiveIntegerField(default=0, db_index=True, editable=False, verbose_name='Активных позиций')
 
-    objects = models.Manager()
+    objects = ProductInfoQuerySet.as_manager()
     related_objects = RelatedProductManager()
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        # a loaded product may hold a stale count, it is never written back by save
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'active_instance_count'
+            ]
+        super(ProductInfo, self).save(*args, **kwargs)
+
     class Meta:
         verbose_name = 'Описание товара'
         verbose_name_plural = 'Описание товаров'
@@ -52,7 +64,11 @@ class ProductInfo(models.Model):
 
     @property
     def is_active(self):
-        return any([instance.status == ProductInstance.STATUS_ACTIVE for instance in self.instances.all()])
+        return self.active_instance_count > 0
+
+    def refresh_active_instance_count(self):
+        ProductInfo.objects.filter(pk=self.pk).update_active_instance_count()
+        self.refresh_from_db(fields=['active_instance_count'])
 
 
 class ProductImage(models.Model):
@@ -74,7 +90,7 @@ class ProductInstance(models.Model):
         (STATUS_ARCHIVE, 'Архив'),
     )
 
-    sku = models.BigIntegerField(null=False, blank=False, verbose_name='Артикул')
+    sku = models.BigIntegerField(null=False, blank=False, db_index=True, verbose_name='Артикул')
     product_info = models.ForeignKey(ProductInfo, on_delete=models.CASCADE, blank=False, null=False, related_name='instances', verbose_name='Инфо')
     measure = models.IntegerField(null=False, blank=False, verbose_name='Количество в миллилитрах')
     price = models.DecimalField(null=True, blank=True, max_digits=10, decimal_places=2, verbose_name='Цена')
@@ -91,6 +107,16 @@ class ProductInstance(models.Model):
     def __str__(self):
         return str(self.sku)
 
+    def save(self, *args, **kwargs):
+        super(ProductInstance, self).save(*args, **kwargs)
+        ProductInfo.objects.filter(pk=self.product_info_id).update_active_instance_count()
+
+    def delete(self, *args, **kwargs):
+        product_info_id = self.product_info_id
+        result = super(ProductInstance, self).delete(*args, **kwargs)
+        ProductInfo.objects.filter(pk=product_info_id).update_active_instance_count()
+        return result
+
     @property
     def is_active(self):
         return self.status == self.STATUS_ACTIVE
@@ -98,6 +124,10 @@ class ProductInstance(models.Model):
     class Meta:
         verbose_name = 'Товар'
         verbose_name_plural = 'Товары'
+        indexes = [
+            # containment lookups of instances holding a sale, e.g. sales__contains=[{'pk': 1}]
+            GinIndex(fields=['sales'], name='productinstance_sales_gin', opclasses=['jsonb_path_ops']),
+        ]
 
 
 class Category(models.Model):
@@ -215,10 +245,23 @@ class Collection(models.Model):
         self.slug = slugify(self.name, only_ascii=True)
         super(Collection, self).save(*args, **kwargs)
 
-    def add_collection_to_instances(self, *args, **kwargs):
-        for product in self.products.all():
-            product.collections.append(self.pk)
-            product.save()
+    def update_instance_collections(self, added, removed):
+        """
+        Sync ProductInstance.collections of added and removed members in one bulk update.
+        Return changed instances.
+        """
+        instances = ProductInstance.objects.filter(pk__in=set(added) | set(removed))\
+            .only('pk', 'collections')
+        changed = []
+        for instance in instances:
+            collections = [pk for pk in instance.collections or [] if pk != self.pk]
+            if instance.pk in added:
+                collections.append(self.pk)
+            if collections != instance.collections:
+                instance.collections = collections
+                changed.append(instance)
+        ProductInstance.objects.bulk_update(changed, ['collections'])
+        return changed
 
 
 class CollectionImage(models.Model):
@@ -1,4 +1,5 @@
 from decimal import Decimal, InvalidOperation
+from django.db.models import Prefetch
 from django.http import QueryDict
 from rest_framework import serializers
 
@@ -347,6 +348,7 @@ class ProductCreateSerializer(serializers.ModelSerializer):
         product_info.sfacets.add(*sfacets)
 
         product_info.nfacets.add(*nfacets)
+        product_info.refresh_active_instance_count()
 
         # for nfacet in nfacets:
         #    NFacetValue.objects.create(product_info=product_info, **nfacet)
@@ -376,6 +378,72 @@ class ProductCreateSerializer(serializers.ModelSerializer):
         return product
 
 
+class ProductInstanceImportSerializer(serializers.ModelSerializer):
+    images = serializers.ListField(child=serializers.IntegerField(), default=list)
+
+    class Meta:
+        model = ProductInstance
+        fields = (
+            "sku",
+            "images",
+            "measure",
+            "capacity_type",
+            "base_price",
+            "stock_balance",
+            "package_amount",
+            "status",
+        )
+
+
+class ProductImportSerializer(serializers.ModelSerializer):
+    """
+    Line of a bulk import. Related objects are plain primary keys,
+    they are checked for a whole batch at once, see apps.products.importer
+    """
+    manufacturer = serializers.IntegerField()
+    category = serializers.IntegerField()
+    tags = serializers.ListField(child=serializers.IntegerField(), default=list)
+    sfacets = serializers.ListField(child=serializers.IntegerField(), default=list)
+    nfacets = serializers.ListField(child=serializers.IntegerField(), default=list)
+    instances = ProductInstanceImportSerializer(many=True)
+
+    class Meta:
+        model = ProductInfo
+        fields = (
+            "name",
+            "manufacturer",
+            "description",
+            "instances",
+            "category",
+            "tags",
+            "sfacets",
+            "nfacets",
+            "extra",
+        )
+
+    def validate_instances(self, value):
+        if len(value) == 0:
+            raise serializers.ValidationError("Требуется минимум одна позиция товара")
+
+        skus = [instance["sku"] for instance in value]
+        if len(skus) != len(set(skus)):
+            raise serializers.ValidationError("Артикулы позиций не должны повторяться")
+
+        return value
+
+
+class StockFeedSerializer(serializers.Serializer):
+    """Row of the ERP feed, see apps.products.feed"""
+    sku = serializers.IntegerField()
+    stock_balance = serializers.IntegerField(required=False, allow_null=True)
+    base_price = serializers.DecimalField(max_digits=10, decimal_places=2, required=False, allow_null=True)
+
+    def validate(self, data):
+        if data.get("stock_balance") is None and data.get("base_price") is None:
+            raise serializers.ValidationError("Требуется остаток или базовая цена")
+        return data
+
+
 class AdminProductInfoSerializer(serializers.ModelSerializer):
     nfacets = ProductNFacetValueSerializer(many=True)
     instances = ProductInstanceCreateSerializer(many=True)
@@ -394,6 +462,10 @@ class AdminProductInfoSerializer(serializers.ModelSerializer):
             "instances",
         )
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        return queryset.prefetch_related("tags", "sfacets", "nfacets", "instances__images")
+
     def update(self, product, validated_data):
         product.name = validated_data.pop("name")
         product.category = validated_data.pop("category")
@@ -444,6 +516,11 @@ class ProductListSerializer(serializers.ModelSerializer):
             "extra",
         )
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        return queryset.select_related("category", "manufacturer")\
+            .prefetch_related("tags", "sfacets__facet", "nfacets", "instances__images")
+
 
 class ProductTableListSerializer(serializers.ModelSerializer):
     category = CategorySerializer(read_only=True)
@@ -476,6 +553,10 @@ class ProductInstanceTableSerializer(serializers.ModelSerializer):
             "name",
         )
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        return queryset.select_related("product_info__category")
+
 
 class ProductRetriveSerializer(serializers.ModelSerializer):
     sfacets = SFacetValueListSerializer(many=True, read_only=True)
@@ -544,6 +625,11 @@ class CollectionSerializer(serializers.ModelSerializer):
             "image",
         )
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        products = ProductInstance.objects.select_related("product_info").prefetch_related("images")
+        return queryset.select_related("image").prefetch_related(Prefetch("products", queryset=products))
+
 
 class CollectionCreateSerializer(serializers.ModelSerializer):
     class Meta:
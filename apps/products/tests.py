@@ -1,12 +1,35 @@
+import json
 import time
+from decimal import Decimal
+from types import SimpleNamespace
 
+from django.db import connection
+from django.db.models import Q
 from django.test import TestCase
-from rest_framework.test import APIClient
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
 from django.conf import settings
 from django.http import QueryDict
 
-from .elastic import es, create_index, index_products
-from .serializers import ProductCreateSerializer, QuerySerializer
+from apps.base import slowlog
+from apps.base.pagination import EstimatedCountPaginator, KeysetPagination, estimate_count
+from .admin_api import (
+    search_instances_query,
+    AdminElasticTaskAPIView,
+    AdminProductCategoryViewSet,
+    AdminProductNFacetViewSet,
+    AdminProductTagsViewSet,
+)
+from .feed import apply_feed
+from .importer import import_products
+from .elastic import es, create_index, index_products, _create_filter_query
+from .serializers import (
+    ProductCreateSerializer,
+    QuerySerializer,
+    AdminProductInfoSerializer,
+    ProductInstanceTableSerializer,
+    CollectionSerializer,
+)
 from .models import (
     ProductInfo,
     Manufacturer,
@@ -17,6 +40,8 @@ from .models import (
     SFacetValue,
     NFacet,
     NFacetValue,
+    Tags,
+    Collection,
 )
 
 
@@ -508,3 +533,382 @@ class QuerySerializerTests(TestCase):
         serializer = QuerySerializer(data=data)
         self.assertFalse(serializer.is_valid())
         self.assertIsNone(serializer.validated_data.get('nfacets', None))
+
+
+class QueryFingerprintTests(TestCase):
+    def test_values_are_ignored(self):
+        first = _create_filter_query({"sfacets": [("country", (15,))], "nfacets": [("density", (1, 2))]})
+        second = _create_filter_query({"sfacets": [("country", (16, 17))], "nfacets": [("density", (5, 10))]})
+        self.assertEqual(
+            slowlog.fingerprint(slowlog.query_shape(first)),
+            slowlog.fingerprint(slowlog.query_shape(second)),
+        )
+
+    def test_filter_counts_are_kept(self):
+        one_facet = _create_filter_query({"sfacets": [("country", (15,))]})
+        two_facets = _create_filter_query({"sfacets": [("country", (15,)), ("style", (1,))]})
+        self.assertNotEqual(
+            slowlog.fingerprint(slowlog.query_shape(one_facet)),
+            slowlog.fingerprint(slowlog.query_shape(two_facets)),
+        )
+
+
+class AdminSearchIndexTests(TestCase):
+    """Planner check of the trigram indexes behind admin search, tables are tiny so seq scans are off"""
+
+    def explain(self, queryset):
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+        return queryset.explain()
+
+    def test_product_instance_search(self):
+        plan = self.explain(ProductInstance.objects.filter(search_instances_query('hop')))
+        self.assertIn('products_productinstance_sku_trgm', plan)
+
+    def test_product_name_search(self):
+        plan = self.explain(ProductInfo.objects.filter(Q(name__icontains='hop') | Q(category_id__in=[1])))
+        self.assertIn('products_productinfo_name_trgm', plan)
+
+    def test_dictionary_search(self):
+        for model, index in (
+            (Category, 'products_category_name_trgm'),
+            (Manufacturer, 'products_manufacturer_name_trgm'),
+            (Tags, 'products_tags_name_trgm'),
+            (SFacet, 'products_sfacet_name_trgm'),
+            (NFacet, 'products_nfacet_name_trgm'),
+        ):
+            with self.subTest(model=model.__name__):
+                self.assertIn(index, self.explain(model.objects.filter(name__icontains='hop')))
+
+
+class AdminListQueryBudgetTests(TestCase):
+    """Admin list serializers with their eager loading plans run a constant number of queries"""
+    ROWS = 100
+
+    @classmethod
+    def setUpTestData(cls):
+        manufacturer = Manufacturer.objects.create(name="ayinger", slug="ayinger")
+        category = Category.objects.create(name="Пиво", slug="beer")
+        tag = Tags.objects.create(name="эль")
+        sfacet = SFacet.objects.create(name="Стиль", slug="style")
+        sfacet_value = SFacetValue.objects.create(facet=sfacet, name="Belgian Strong Ale")
+        nfacet = NFacet.objects.create(name="Крепость", slug="strength")
+        collection = Collection.objects.create(name="Бельгия")
+
+        for index in range(cls.ROWS):
+            product_info = ProductInfo.objects.create(
+                name=f"product {index}", manufacturer=manufacturer, category=category, extra={},
+            )
+            product_info.tags.add(tag)
+            product_info.sfacets.add(sfacet_value)
+            product_info.nfacets.add(NFacetValue.objects.create(facet=nfacet, value=5))
+            instance = ProductInstance.objects.create(
+                sku=index, product_info=product_info, measure=500, base_price=100,
+                stock_balance=1, package_amount=1,
+            )
+            ProductImage.objects.create(instance=instance, is_main=True)
+            collection.products.add(instance)
+
+    def assertQueryBudget(self, serializer_class, queryset, num):
+        queryset = serializer_class.setup_eager_loading(queryset)
+        with self.assertNumQueries(num):
+            data = serializer_class(queryset, many=True).data
+        return data
+
+    def test_products(self):
+        data = self.assertQueryBudget(AdminProductInfoSerializer, ProductInfo.objects.all(), 6)
+        self.assertEqual(len(data), self.ROWS)
+
+    def test_product_instances(self):
+        data = self.assertQueryBudget(ProductInstanceTableSerializer, ProductInstance.objects.all(), 1)
+        self.assertEqual(len(data), self.ROWS)
+
+    def test_collections(self):
+        data = self.assertQueryBudget(CollectionSerializer, Collection.objects.all(), 3)
+        self.assertEqual(len(data[0]['products']), self.ROWS)
+
+
+class EstimateCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for index in range(3):
+            Category.objects.create(name=f"category {index}", slug=f"category-{index}", is_active=index > 0)
+
+    def test_exact_below_threshold(self):
+        self.assertEqual(estimate_count(Category.objects.all(), 10000), 3)
+        self.assertEqual(estimate_count(Category.objects.filter(is_active=True), 10000), 2)
+
+    def test_estimate_above_threshold(self):
+        self.assertIsInstance(estimate_count(Category.objects.filter(is_active=True), 0), int)
+
+
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for index in range(3):
+            Category.objects.create(name=f"category {index}", slug=f"category-{index}")
+
+    def paginate(self, params):
+        pagination = KeysetPagination()
+        pagination.page_size = 2
+        request = Request(APIRequestFactory().get('/v1/admin/categories/', params))
+        page = pagination.paginate_queryset(Category.objects.order_by('pk'), request)
+        return page, pagination.get_paginated_response([category.pk for category in page]).data
+
+    def test_page_number(self):
+        page, data = self.paginate({'page': 2})
+        self.assertEqual(len(page), 1)
+        self.assertEqual(data['count'], 3)
+        self.assertIsNone(data['next'])
+        self.assertNotIn('cursor', data['previous'])
+
+    def test_page_number_count_is_estimated(self):
+        paginator = EstimatedCountPaginator(Category.objects.order_by('pk'), 2)
+        paginator.count_threshold = 0
+        self.assertIsInstance(paginator.count, int)
+        self.assertEqual(EstimatedCountPaginator(Category.objects.order_by('pk'), 2).count, 3)
+
+    def test_cursor(self):
+        page, data = self.paginate({'cursor': ''})
+        pks = list(Category.objects.order_by('-pk').values_list('pk', flat=True))
+        self.assertEqual(data['results'], pks[:2])
+        self.assertEqual(data['count'], 3)
+        self.assertIn('cursor=', data['next'])
+
+
+class ImportProductsTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        create_index()
+
+    @classmethod
+    def tearDownClass(cls):
+        es.indices.delete(index=settings.ELASTIC_SEARCH["INDEX"], ignore=[400, 404])
+        super().tearDownClass()
+
+    def setUp(self):
+        self.manufacturer = Manufacturer.objects.create(name="ayinger", slug="ayinger")
+        self.category = Category.objects.create(name="Пиво", slug="beer")
+        self.tag = Tags.objects.create(name="эль")
+
+    def get_line(self, sku, base_price, **kwargs):
+        product = {
+            "name": f"product {sku}",
+            "manufacturer": self.manufacturer.pk,
+            "category": self.category.pk,
+            "tags": [self.tag.pk],
+            "extra": {"name_locale": "продукт", "style_locale": "эль"},
+            "instances": [{
+                "sku": sku, "measure": 500, "base_price": base_price,
+                "stock_balance": 1, "package_amount": 1, "status": ProductInstance.STATUS_ACTIVE,
+            }],
+            **kwargs,
+        }
+        return json.dumps(product)
+
+    def test_upsert_by_sku(self):
+        result = import_products([self.get_line(1, "100"), self.get_line(2, "200")])
+        self.assertEqual((result["created"], result["updated"], result["errors"]), (2, 0, []))
+
+        result = import_products([self.get_line(1, "150", name="renamed")])
+        self.assertEqual((result["created"], result["updated"]), (0, 1))
+        instance = ProductInstance.objects.get(sku=1)
+        self.assertEqual(instance.base_price, 150)
+        self.assertEqual(instance.product_info.name, "renamed")
+        self.assertEqual(list(instance.product_info.tags.all()), [self.tag])
+        self.assertEqual(ProductInfo.objects.count(), 2)
+
+    def test_errors_do_not_abort_batch(self):
+        lines = [
+            "{not json",
+            self.get_line(1, "100", category=0),
+            self.get_line(2, "100"),
+            self.get_line(2, "100"),
+        ]
+        result = import_products(lines)
+        self.assertEqual(result["created"], 1)
+        self.assertEqual([error["line"] for error in result["errors"]], [1, 2, 4])
+        self.assertIn("category", result["errors"][1]["errors"])
+
+
+class StockFeedTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        manufacturer = Manufacturer.objects.create(name="ayinger", slug="ayinger")
+        category = Category.objects.create(name="Пиво", slug="beer")
+        product_info = ProductInfo.objects.create(name="product", manufacturer=manufacturer, category=category)
+        for sku in (1, 2):
+            ProductInstance.objects.create(
+                sku=sku, product_info=product_info, measure=500, base_price=100, price=100,
+                stock_balance=1, package_amount=1, status=ProductInstance.STATUS_DRAFT,
+            )
+
+    def test_last_value_wins(self):
+        report = apply_feed([
+            {"sku": 1, "stock_balance": 5, "base_price": Decimal("120")},
+            {"sku": 1, "stock_balance": 7, "base_price": None},
+            {"sku": 2, "stock_balance": 1, "base_price": Decimal("100")},
+            {"sku": 3, "stock_balance": 1},
+        ])
+        self.assertEqual((report["received"], report["skus"], report["updated"]), (4, 3, 1))
+
+        instance = ProductInstance.objects.get(sku=1)
+        self.assertEqual((instance.stock_balance, instance.base_price, instance.price), (7, 100, 100))
+
+    def test_reprices_new_base_price(self):
+        report = apply_feed([{"sku": 2, "base_price": Decimal("80.50")}])
+        self.assertEqual(report["repriced"], 1)
+        instance = ProductInstance.objects.get(sku=2)
+        self.assertEqual((instance.base_price, instance.price), (Decimal("80.50"), Decimal("80.50")))
+
+
+class StockFeedDocumentTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        create_index()
+
+    @classmethod
+    def tearDownClass(cls):
+        es.indices.delete(index=settings.ELASTIC_SEARCH["INDEX"], ignore=[400, 404])
+        super().tearDownClass()
+
+    def test_base_price_format_of_indexer(self):
+        manufacturer = Manufacturer.objects.create(name="ayinger", slug="ayinger")
+        category = Category.objects.create(name="Пиво", slug="beer")
+        product_info = ProductInfo.objects.create(name="product", manufacturer=manufacturer, category=category)
+        for sku in (1, 2):
+            ProductInstance.objects.create(
+                sku=sku, product_info=product_info, measure=500, base_price=100, price=100,
+                stock_balance=1, package_amount=1, status=ProductInstance.STATUS_ACTIVE,
+            )
+        index_products(product_info)
+
+        report = apply_feed([{"sku": 1, "base_price": Decimal("120")}])
+        self.assertEqual(report["errors"], [])
+
+        def get_base_price(sku):
+            pk = ProductInstance.objects.get(sku=sku).pk
+            return es.get(index=settings.ELASTIC_SEARCH["INDEX"], id=pk)["_source"]["instance"]["base_price"]
+
+        self.assertEqual((get_base_price(1), get_base_price(2)), ("120.00", "100.00"))
+
+
+class ActiveInstanceCountTests(TestCase):
+    def setUp(self):
+        manufacturer = Manufacturer.objects.create(name="ayinger", slug="ayinger")
+        category = Category.objects.create(name="Пиво", slug="beer")
+        self.product_info = ProductInfo.objects.create(name="product", manufacturer=manufacturer, category=category)
+        self.instance = ProductInstance.objects.create(
+            sku=1, product_info=self.product_info, measure=500, base_price=100,
+            stock_balance=1, package_amount=1, status=ProductInstance.STATUS_ACTIVE,
+        )
+
+    def test_maintained_on_instance_save(self):
+        self.product_info.refresh_from_db()
+        self.assertTrue(self.product_info.is_active)
+        self.assertEqual(list(ProductInfo.objects.active()), [self.product_info])
+
+        self.instance.status = ProductInstance.STATUS_DRAFT
+        self.instance.save()
+        self.product_info.refresh_from_db()
+        self.assertFalse(self.product_info.is_active)
+
+    def test_product_save_keeps_count(self):
+        stale = ProductInfo.objects.get(pk=self.product_info.pk)
+        ProductInstance.objects.filter(pk=self.instance.pk).update(status=ProductInstance.STATUS_ARCHIVE)
+        ProductInfo.objects.filter(pk=stale.pk).update_active_instance_count()
+        stale.name = "renamed"
+        stale.save()
+        self.assertEqual(ProductInfo.objects.get(pk=stale.pk).active_instance_count, 0)
+
+    def test_annotation_matches_column(self):
+        product_info = ProductInfo.objects.with_active_instances().get(pk=self.product_info.pk)
+        self.assertEqual(product_info.active_instances, product_info.active_instance_count)
+
+
+class AdminDeactivateTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        create_index()
+
+    @classmethod
+    def tearDownClass(cls):
+        es.indices.delete(index=settings.ELASTIC_SEARCH["INDEX"], ignore=[400, 404])
+        super().tearDownClass()
+
+    def setUp(self):
+        manufacturer = Manufacturer.objects.create(name="ayinger", slug="ayinger")
+        self.category = Category.objects.create(name="Пиво", slug="beer")
+        self.tag = Tags.objects.create(name="эль")
+        self.nfacet = NFacet.objects.create(name="Крепость", slug="strength")
+        nfacet_value = NFacetValue.objects.create(facet=self.nfacet, value=8)
+        self.product_info = ProductInfo.objects.create(
+            name="Abbaye Des Rocs", manufacturer=manufacturer, category=self.category, extra={},
+        )
+        self.product_info.tags.add(self.tag)
+        self.product_info.nfacets.add(nfacet_value)
+        self.instance = ProductInstance.objects.create(
+            sku=1, product_info=self.product_info, measure=500, base_price=100, stock_balance=1,
+            package_amount=1, status=ProductInstance.STATUS_ACTIVE,
+        )
+
+    def call(self, view, method='delete', **kwargs):
+        request = getattr(APIRequestFactory(), method)('/')
+        force_authenticate(
+            request, user=SimpleNamespace(), token=SimpleNamespace(cached_auth={'scopes': ['staff', 'admin']}),
+        )
+        return view(request, **kwargs)
+
+    def test_category_keeps_instance_status(self):
+        response = self.call(AdminProductCategoryViewSet.as_view({'delete': 'deactivate'}), pk=self.category.pk)
+        self.assertEqual(response.status_code, 202)
+        self.assertFalse(Category.objects.get(pk=self.category.pk).is_active)
+        self.assertEqual(ProductInstance.objects.get(pk=self.instance.pk).status, ProductInstance.STATUS_ACTIVE)
+        self.assertEqual(ProductInfo.objects.get(pk=self.product_info.pk).active_instance_count, 1)
+
+        task_view = AdminElasticTaskAPIView.as_view()
+        task = self.call(task_view, 'get', task_id=response.data['task'])
+        self.assertEqual(task.status_code, 200)
+        self.assertEqual(task.data['task'], response.data['task'])
+
+        node = response.data['task'].split(':')[0]
+        self.assertEqual(self.call(task_view, 'get', task_id=f'{node}:999999999').status_code, 404)
+
+    def test_tag_links_deleted(self):
+        response = self.call(AdminProductTagsViewSet.as_view({'delete': 'deactivate'}), pk=self.tag.pk)
+        self.assertEqual(response.status_code, 202)
+        self.assertIn('task', response.data)
+        self.assertFalse(self.product_info.tags.exists())
+
+    def test_nfacet_values_deleted(self):
+        response = self.call(AdminProductNFacetViewSet.as_view({'delete': 'deactivate'}), pk=self.nfacet.pk)
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(NFacetValue.objects.filter(facet=self.nfacet).exists())
+
+
+class MetricsAPITests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+
+    def test_anonymous(self):
+        response = self.client.get('/v1/metrics/')
+        self.assertEqual(response.status_code, 401)
+
+    def test_not_staff(self):
+        self.client.force_authenticate(
+            user=SimpleNamespace(), token=SimpleNamespace(cached_auth={'scopes': ['customer']}),
+        )
+        response = self.client.get('/v1/metrics/')
+        self.assertEqual(response.status_code, 403)
+        self.assertIn('detail', json.loads(response.content.decode('utf-8')))
+
+    def test_staff(self):
+        self.client.force_authenticate(
+            user=SimpleNamespace(), token=SimpleNamespace(cached_auth={'scopes': ['staff']}),
+        )
+        response = self.client.get('/v1/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
@@ -5,12 +5,13 @@ from rest_framework.response import Response
 from rest_framework.decorators import action
 from django.shortcuts import get_object_or_404
 
+from apps.base.profiling import ProfilingMixin
 from .serializers import CollectionApiSerializer, QuerySerializer
 from .models import Collection
 from . import elastic
 
 
-class ProductViewSet(ViewSet):
+class ProductViewSet(ProfilingMixin, ViewSet):
     def list(self, request):
         params = QuerySerializer(data=request.query_params)
         params.is_valid(raise_exception=True)
@@ -31,7 +32,7 @@ class ProductViewSet(ViewSet):
         return Response(product_instance, status=status.HTTP_200_OK)
 
 
-class TagsListAPI(APIView):
+class TagsListAPI(ProfilingMixin, APIView):
     def get(self, request, format=None):
         params = QuerySerializer(data=self.request.query_params)
         params.is_valid(raise_exception=True)
@@ -39,7 +40,7 @@ class TagsListAPI(APIView):
         return Response(tags, status=status.HTTP_200_OK)
 
 
-class FacetsListAPI(APIView):
+class FacetsListAPI(ProfilingMixin, APIView):
     def get(self, request, format=None):
         params = QuerySerializer(data=self.request.query_params)
         params.is_valid(raise_exception=True)
@@ -48,7 +49,7 @@ class FacetsListAPI(APIView):
         return Response(response_data, status=status.HTTP_200_OK)
 
 
-class FacetAllValuesListAPI(APIView):
+class FacetAllValuesListAPI(ProfilingMixin, APIView):
     """Default size of values on each string facet is equal 10
     this view load all rest values for specific string facet
     :query param facet (required): string of the facet values to search for
@@ -64,7 +65,7 @@ class FacetAllValuesListAPI(APIView):
         return Response(data=values, status=status.HTTP_200_OK)
 
 
-class CategoryAPIView(APIView):
+class CategoryAPIView(ProfilingMixin, APIView):
     def get(self, request, format=None):
         categories = elastic.get_categories()
         return Response(data=categories, status=status.HTTP_200_OK)
@@ -1,28 +1,24 @@
-from datetime import datetime
-
-import requests
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from django.shortcuts import get_object_or_404
-from django.utils import timezone
 
 from .serializers import SaleSerializer, SaleAdminSerializer, SaleImageSerializer
 from .models import Sale, SaleImage
-from . import elastic
+from . import cache
 from apps.authentication.permissions import IsStaff, IsTokenAuthenticated, IsAdminForDelete
 from apps.authentication.backends import OAuth2Authentication
-from apps.base.pagination import BasePagination
+from apps.base.pagination import KeysetPagination
 
 
 class AdminSaleViewSet(viewsets.ModelViewSet):
     authentication_classes = [OAuth2Authentication]
     permission_classes = (IsTokenAuthenticated, IsStaff)
-    pagination_class = BasePagination
+    pagination_class = KeysetPagination
     queryset = Sale.objects.all()
 
     def list(self, request, *args, **kwargs):
-        queryset = Sale.objects.all()
+        queryset = SaleSerializer.setup_eager_loading(Sale.objects.all())
         page = self.paginate_queryset(queryset)
         if page is not None:
             serializer = SaleSerializer(page, many=True)
@@ -34,8 +30,8 @@ class AdminSaleViewSet(viewsets.ModelViewSet):
         serializer = SaleAdminSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         sale = serializer.save()
-        #self._create_sale_task(sale)
         sale.update_product_instances()
+        cache.invalidate()
         return Response(data=serializer.data, status=status.HTTP_201_CREATED)
 
     def retrieve(self, request, pk=None, *args, **kwargs):
@@ -48,10 +44,8 @@ class AdminSaleViewSet(viewsets.ModelViewSet):
         serializer = SaleAdminSerializer(instance, data=request.data)
         serializer.is_valid(raise_exception=True)
         sale = serializer.save()
-
-        #self._update_sale_task(sale)
         sale.update_product_instances()
-        
+        cache.invalidate()
         return Response(serializer.data)
     
     @action(methods=['DELETE'], detail=True)
@@ -60,33 +54,13 @@ class AdminSaleViewSet(viewsets.ModelViewSet):
         instance.is_active = False
         instance.save()
         instance.delete_product_instances()
+        cache.invalidate()
 
         return Response(status=status.HTTP_200_OK)
-    
-    def _create_sale_task(self, sale):
-        now = timezone.now()
-        #if not sale.is_active or now > sale.date_end:
-        #    return
-        
-        data = {
-            'id': sale.pk,
-            'date_start': sale.date_start,
-            'date_end': sale.date_end,
-            'is_active': sale.is_active,
-        }
-        
-        r = requests.post('http://scheduler:8010/sales', data=data)
-    
-    def _update_sale_task(self, sale):
-        data = {
-            'id': sale.pk,
-            'date_start': sale.date_start,
-            'date_end': sale.date_end,
-            'is_active': sale.is_active,
-        }
-        
-        r = requests.post('http://scheduler:8010/sales', data=data)
 
+    def perform_destroy(self, instance):
+        super().perform_destroy(instance)
+        cache.invalidate()
 
 
 class AdminSalesImageViewSet(viewsets.ModelViewSet):
@@ -94,3 +68,11 @@ class AdminSalesImageViewSet(viewsets.ModelViewSet):
     permission_classes = (IsTokenAuthenticated, IsStaff, IsAdminForDelete)
     serializer_class = SaleImageSerializer
     queryset = SaleImage.objects.all()
+
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        cache.invalidate()
+
+    def perform_destroy(self, instance):
+        super().perform_destroy(instance)
+        cache.invalidate()
@@ -0,0 +1,64 @@
+"""
+Cached serialized lists of sales for the public endpoints.
+
+Lists change only at sale boundaries (date_start, date_end) and on admin
+edits, so they are cached until the next boundary and dropped by `invalidate`
+on every admin write.
+"""
+import math
+
+from django.core.cache import caches
+from django.db.models import Min, Q
+from django.utils import timezone
+
+from .models import Sale
+from .serializers import SaleApiSerializer
+
+
+KEY_PREFIX = 'sales:list'
+
+
+def get_active_sales(request):
+    """Sales in process, image urls are absolute so the list is cached per host"""
+    def get_queryset(now):
+        return Sale.objects.filter(is_active=True, date_start__lte=now, date_end__gt=now)
+
+    return _get_or_set(f'active:{request.get_host()}', get_queryset, {'request': request})
+
+
+def get_home_sales():
+    def get_queryset(now):
+        return Sale.objects.filter(on_home=True)
+
+    return _get_or_set('home', get_queryset)
+
+
+def invalidate():
+    caches['catalog'].delete_pattern(f'{KEY_PREFIX}:*')
+
+
+def seconds_to_next_boundary(now):
+    """Seconds until the set of sales in process changes, None if no change is scheduled"""
+    boundaries = Sale.objects.filter(is_active=True).aggregate(
+        next_start=Min('date_start', filter=Q(date_start__gt=now)),
+        next_end=Min('date_end', filter=Q(date_end__gt=now)),
+    )
+    upcoming = [boundary for boundary in boundaries.values() if boundary is not None]
+    if not upcoming:
+        return None
+    # sales are in process while date_start <= now < date_end, as in apps.sales.pricing
+    return max(math.ceil((min(upcoming) - now).total_seconds()), 1)
+
+
+def _get_or_set(name, get_queryset, context=None):
+    cache = caches['catalog']
+    key = f'{KEY_PREFIX}:{name}'
+    data = cache.get(key)
+    if data is not None:
+        return data
+
+    now = timezone.now()
+    queryset = get_queryset(now).select_related('image').order_by('pk')
+    data = list(SaleApiSerializer(queryset, many=True, context=context or {}).data)
+    cache.set(key, data, timeout=seconds_to_next_boundary(now))
+    return data
@@ -1,43 +1,29 @@
-from elasticsearch.helpers import bulk
+from elasticsearch.helpers import streaming_bulk
 
 from apps.base.elastic import es, INDEX
-from apps.products.models import ProductInstance
+from apps.base.metrics import timed
 
-def add_sale(product_instances):
-    query_bodies = _make_products_query(op_type='update', products=product_instances)
-    bulk(es, query_bodies)
 
-def delete_sale(product_instances):
-    query_bodies = _make_products_query(op_type='update', products=product_instances)
-    bulk(es, query_bodies)
-
-def update_sale(product_instances):
-    delete_sale(product_instances)
-    add_sale(product_instances)
-
-
-def _make_products_query(op_type, products):
-    queries = []
-    for product in products:
-        script = _make_script(product)
-        body = {
-            '_op_type': op_type,
+@timed('bulk')
+def update_prices(product_instances, chunk_size=500):
+    """
+    Partial update of sales and price of instance documents.
+    `product_instances` may be a generator, it is consumed lazily.
+    """
+    actions = (
+        {
+            '_op_type': 'update',
             '_index': INDEX,
             '_type': '_doc',
             '_id': product['instance_pk'],
-            'script': script
+            'doc': {
+                'instance': {
+                    'sales': product['sales'],
+                    'price': product['price'],
+                },
+            },
         }
-        queries.append(body)
-    return queries
-
-def _make_script(product):
-    source = """
-        ctx._source.instance.sales = params.sales;
-        ctx._source.instance.price = params.price;
-    """
-    params = {
-        'instance_pk': product['instance_pk'],
-        'sales': product['sales'],
-        'price': product['price'],
-    }
-    return { "source": source, "params" : params, "lang" : "painless" }
\ No newline at end of file
+        for product in product_instances
+    )
+    for _ in streaming_bulk(es, actions, chunk_size=chunk_size):
+        pass
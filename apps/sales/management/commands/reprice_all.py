@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+from apps.sales import pricing
+
+
+class Command(BaseCommand):
+    help = 'Recompute sales and prices of all product instances'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=pricing.CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+
+        def progress(processed, changed):
+            self.stdout.write(f'processed {processed} | changed {changed} | {time.monotonic() - started:.1f}s')
+
+        processed, changed = pricing.reprice_all(chunk_size=options['chunk_size'], progress=progress)
+        self.stdout.write(self.style.SUCCESS(
+            f'Repriced {processed} instances, {changed} changed in {time.monotonic() - started:.1f}s'
+        ))
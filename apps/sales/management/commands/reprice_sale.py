@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from apps.sales import pricing
+from apps.sales.models import Sale
+
+
+class Command(BaseCommand):
+    help = 'Apply or retract a sale on its products, collections and categories'
+
+    def add_arguments(self, parser):
+        parser.add_argument('sale', type=int)
+
+    def handle(self, *args, **options):
+        try:
+            sale = Sale.objects.get(pk=options['sale'])
+        except Sale.DoesNotExist:
+            raise CommandError(f'Sale {options["sale"]} does not exist')
+
+        started = time.monotonic()
+
+        def progress(processed, changed):
+            self.stdout.write(f'processed {processed} | changed {changed} | {time.monotonic() - started:.1f}s')
+
+        changed = pricing.reprice_sale(sale, progress=progress)
+        self.stdout.write(self.style.SUCCESS(
+            f'Sale {sale.pk} repriced, {changed} instances changed in {time.monotonic() - started:.1f}s'
+        ))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from apps.sales.scheduler import SaleScheduler
+
+
+class Command(BaseCommand):
+    help = 'Apply and retract sales at their start and end dates'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reload-interval', type=int, default=60,
+                            help='Seconds between reloads of sale dates from the database')
+        parser.add_argument('--retry-delay', type=int, default=10,
+                            help='Seconds to wait after a failed run')
+
+    def handle(self, *args, **options):
+        self.stdout.write('Sale scheduler started')
+        SaleScheduler(
+            reload_interval=options['reload_interval'],
+            retry_delay=options['retry_delay'],
+        ).run_forever()
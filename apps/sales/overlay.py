@@ -0,0 +1,151 @@
+"""
+Query time sale overlay.
+
+With SALES['OVERLAY'] on, edits of sales are not written to product documents.
+Every process keeps a small snapshot of sales in process with their product,
+collection and category links and members of the linked collections
+(product documents hold no collections), and `apply` computes sales and effective price
+of a whole page of hits when the response is built.
+
+The snapshot is rebuilt at the next sale boundary, after SALES['OVERLAY_TTL']
+seconds or when an admin edit of a sale or a collection bumps the version
+in the catalog cache.
+`instance.price` of documents is kept only for sorting and filtering by price.
+Instances repriced by admin edits are marked as stale and their documents are
+refreshed by the sale scheduler, see apps.sales.scheduler.
+"""
+import datetime
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+from django_redis import get_redis_connection
+
+from . import pricing
+
+
+VERSION_KEY = 'sales:overlay:version'
+STALE_KEY = 'sales:overlay:stale'
+
+_lock = threading.Lock()
+_snapshot = None
+
+
+class Snapshot:
+    def __init__(self, version, expires_at, category_links, collection_links, product_links, instance_collections):
+        self.version = version
+        self.expires_at = expires_at
+        # {category_pk | collection_pk | instance_pk: {sale_pk: sale}}
+        self.category_links = category_links
+        self.collection_links = collection_links
+        self.product_links = product_links
+        # {instance_pk: [collection_pk, ...]} for collections with sales only
+        self.instance_collections = instance_collections
+
+    def is_fresh(self, version, now):
+        return self.version == version and now < self.expires_at
+
+    def get_sales(self, instance_pk, category_pk):
+        sales = dict(self.category_links.get(category_pk, {}))
+        for collection_pk in self.instance_collections.get(instance_pk, []):
+            sales.update(self.collection_links.get(collection_pk, {}))
+        sales.update(self.product_links.get(instance_pk, {}))
+        return [sales[sale_pk] for sale_pk in sorted(sales)]
+
+
+def enabled():
+    return settings.SALES['OVERLAY']
+
+
+def apply(sources):
+    """Set sales and effective price of instances of a page of product documents"""
+    if not enabled() or not sources:
+        return
+
+    snapshot = get_snapshot()
+    for source in sources:
+        instance = source['instance']
+        instance['sales'] = snapshot.get_sales(instance['pk'], source['category']['pk'])
+        instance['price'] = pricing.compute_price(str(instance['base_price']), instance['sales'])
+
+
+def get_snapshot():
+    global _snapshot
+    version = caches['catalog'].get(VERSION_KEY, 0)
+    snapshot = _snapshot
+    if snapshot is not None and snapshot.is_fresh(version, timezone.now()):
+        return snapshot
+
+    with _lock:
+        snapshot = _snapshot
+        if snapshot is None or not snapshot.is_fresh(version, timezone.now()):
+            snapshot = _snapshot = load_snapshot(version)
+    return snapshot
+
+
+def load_snapshot(version):
+    from apps.products.models import Collection
+    from .models import Sale, CategorySale, CollectionSale, ProductSale
+
+    now = timezone.now()
+    sales = {
+        sale.pk: sale
+        for sale in Sale.objects.filter(is_active=True, date_start__lte=now, date_end__gt=now)
+        .only('pk', 'name', 'details', 'date_start', 'date_end')
+    }
+    next_start = Sale.objects.filter(is_active=True, date_start__gt=now)\
+        .order_by('date_start').values_list('date_start', flat=True).first()
+
+    boundaries = [sale.date_end for sale in sales.values()]
+    if next_start is not None:
+        boundaries.append(next_start)
+    boundaries.append(now + datetime.timedelta(seconds=settings.SALES['OVERLAY_TTL']))
+
+    def group(links):
+        grouped = defaultdict(dict)
+        for key, sale_pk, details in links:
+            sale = sales[sale_pk]
+            grouped[key][sale_pk] = {**pricing.get_sale_info(sale), **(details or sale.details)}
+        return dict(grouped)
+
+    collection_links = group(
+        CollectionSale.objects.filter(sale__in=list(sales)).values_list('collection_id', 'sale_id', 'details')
+    )
+    instance_collections = defaultdict(list)
+    members = Collection.products.through.objects.filter(collection__in=list(collection_links))\
+        .values_list('productinstance_id', 'collection_id')
+    for instance_pk, collection_pk in members:
+        instance_collections[instance_pk].append(collection_pk)
+
+    return Snapshot(
+        version=version,
+        expires_at=min(boundaries),
+        category_links=group(
+            CategorySale.objects.filter(sale__in=list(sales)).values_list('category_id', 'sale_id', 'details')
+        ),
+        collection_links=collection_links,
+        product_links=group(
+            ProductSale.objects.filter(sale__in=list(sales)).values_list('product_id', 'sale_id', 'details')
+        ),
+        instance_collections=dict(instance_collections),
+    )
+
+
+def invalidate():
+    """Make every process rebuild its snapshot"""
+    if not enabled():
+        return
+    cache = caches['catalog']
+    cache.add(VERSION_KEY, 0, timeout=None)
+    cache.incr(VERSION_KEY)
+
+
+def mark_stale(instance_pks):
+    if instance_pks:
+        get_redis_connection('catalog').sadd(STALE_KEY, *instance_pks)
+
+
+def pop_stale(count):
+    return [int(instance_pk) for instance_pk in get_redis_connection('catalog').spop(STALE_KEY, count)]
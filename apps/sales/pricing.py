@@ -0,0 +1,276 @@
+"""
+Set based repricing of product instances.
+
+Sales of a batch of instances are loaded with a few queries over the link
+tables, effective prices of the whole batch are computed in one pass and
+written with chunked bulk_update and streamed to elastic as partial updates.
+Sales and prices are always recomputed from the links and the sale dates,
+so repricing the same instances again is a no-op.
+"""
+import heapq
+import itertools
+from collections import defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.utils import timezone
+
+from apps.products.models import Collection, ProductInstance
+from . import elastic
+
+
+CHUNK_SIZE = 1000
+
+
+def reprice_sale(sale, progress=None):
+    """
+    Apply or retract the sale on every instance it touches after an edit.
+    With the sales overlay on, documents are left to the sale scheduler.
+    """
+    return reprice_sales([sale], progress=progress, defer_elastic=settings.SALES['OVERLAY'])
+
+
+def reprice_sales(sales, now=None, progress=None, defer_elastic=False):
+    """
+    Apply or retract several sales as one batch.
+    Instances are streamed by primary key, so sales of big categories are
+    repriced with bounded memory.
+    """
+    _, changed = reprice_chunks(
+        iter_sale_pk_chunks(sales),
+        now=now,
+        progress=progress,
+        defer_elastic=defer_elastic,
+    )
+    return changed
+
+
+def reprice_collection_members(collection, instance_pks):
+    """
+    Reprice instances added to or removed from the collection.
+    Nothing is done unless a sale depends on the collection.
+    """
+    from .models import CollectionSale
+
+    if not instance_pks or not CollectionSale.objects.filter(collection=collection).exists():
+        return 0
+    return reprice_instances(instance_pks, defer_elastic=settings.SALES['OVERLAY'])
+
+
+def get_sale_instance_sources(sales):
+    """
+    Querysets with (queryset, instance pk field) of instances linked to the sales
+    directly, via collections or categories and of instances still holding them.
+    Every source is read by its own index instead of one OR over all of them.
+    """
+    from .models import CategorySale, ProductSale
+
+    sale_pks = [sale.pk for sale in sales]
+    if not sale_pks:
+        return []
+
+    sources = [
+        (ProductSale.objects.filter(sale__in=sale_pks), 'product_id'),
+        (Collection.products.through.objects.filter(collection__collectionsale__sale__in=sale_pks), 'productinstance_id'),
+        (ProductInstance.objects.filter(
+            product_info__category__in=CategorySale.objects.filter(sale__in=sale_pks).values('category_id'),
+        ), 'pk'),
+    ]
+    # served by the jsonb_path_ops GIN index on ProductInstance.sales
+    sources += [
+        (ProductInstance.objects.filter(sales__contains=[{'pk': sale_pk}]), 'pk')
+        for sale_pk in sale_pks
+    ]
+    return sources
+
+
+def iter_sale_pk_chunks(sales, chunk_size=CHUNK_SIZE):
+    """Primary keys of instances touched by the sales, merged in ascending order"""
+    streams = [iter_values(queryset, field, chunk_size) for queryset, field in get_sale_instance_sources(sales)]
+    instance_pks = (instance_pk for instance_pk, _ in itertools.groupby(heapq.merge(*streams)))
+    return iter_chunks(instance_pks, chunk_size)
+
+
+def iter_values(queryset, field='pk', chunk_size=CHUNK_SIZE):
+    """Values of the field in ascending order, read in chunks by keyset pagination"""
+    last_value = 0
+    while True:
+        values = list(
+            queryset.filter(**{f'{field}__gt': last_value}).order_by(field)
+            .values_list(field, flat=True)[:chunk_size]
+        )
+        if not values:
+            return
+        yield from values
+        last_value = values[-1]
+
+
+def iter_chunks(iterable, chunk_size=CHUNK_SIZE):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def reprice_instances(instance_pks, chunk_size=CHUNK_SIZE, now=None, defer_elastic=False):
+    """
+    Recompute sales and price of the instances at the moment `now`.
+    Return number of instances whose sales or price changed.
+    """
+    instance_pks = sorted(instance_pks)
+    chunks = (instance_pks[offset:offset + chunk_size] for offset in range(0, len(instance_pks), chunk_size))
+    _, changed = reprice_chunks(chunks, chunk_size, now, defer_elastic=defer_elastic)
+    return changed
+
+
+def reprice_chunks(chunks, chunk_size=CHUNK_SIZE, now=None, progress=None, defer_elastic=False):
+    """
+    Reprice chunks of instance primary keys one by one. Changed active instances
+    are streamed to elastic while the next chunks are processed, or only marked
+    as stale for the sales overlay when `defer_elastic` is set.
+    Return numbers of processed and changed instances.
+    """
+    from . import overlay
+
+    now = now or timezone.now()
+    processed = 0
+    changed = 0
+
+    def iter_changed():
+        nonlocal processed, changed
+        for instance_pks in chunks:
+            changed_instances = _reprice_chunk(instance_pks, chunk_size, now)
+            processed += len(instance_pks)
+            changed += len(changed_instances)
+            if progress is not None:
+                progress(processed, changed)
+            active_instances = [
+                instance for instance in changed_instances
+                if instance.status == ProductInstance.STATUS_ACTIVE
+            ]
+            if defer_elastic:
+                overlay.mark_stale([instance.pk for instance in active_instances])
+                continue
+            for instance in active_instances:
+                yield {'instance_pk': instance.pk, 'sales': instance.sales, 'price': instance.price}
+
+    elastic.update_prices(iter_changed(), chunk_size)
+    return processed, changed
+
+
+def apply_sales(instance_pks, chunk_size=CHUNK_SIZE, now=None):
+    """
+    Recompute sales and price of the instances in the database only,
+    for callers which write whole documents themselves. Return changed instances.
+    """
+    return _reprice_chunk(instance_pks, chunk_size, now or timezone.now())
+
+
+def sync_elastic(instance_pks, chunk_size=CHUNK_SIZE):
+    """Write stored sales and price of the active instances to their documents"""
+    instances = ProductInstance.objects.filter(pk__in=instance_pks, status=ProductInstance.STATUS_ACTIVE)\
+        .values_list('pk', 'sales', 'price')
+    elastic.update_prices(
+        ({'instance_pk': pk, 'sales': sales, 'price': format_price(price)} for pk, sales, price in instances.iterator()),
+        chunk_size,
+    )
+
+
+def reprice_all(chunk_size=CHUNK_SIZE, progress=None):
+    """Reprice the whole catalog walking instances by primary key"""
+    chunks = iter_chunks(iter_values(ProductInstance.objects.all(), 'pk', chunk_size), chunk_size)
+    return reprice_chunks(chunks, chunk_size, progress=progress)
+
+
+def load_instance_sales(instance_pks, now):
+    """
+    Sales in process at the moment `now` of the instances as {instance_pk: [sale, ...]}
+    in the format stored in ProductInstance.sales. Sale details of a product link
+    take precedence over details of a collection link, which take precedence
+    over details of a category link.
+    """
+    from .models import Sale, CategorySale, CollectionSale, ProductSale
+
+    in_process = {
+        'sale__is_active': True,
+        'sale__date_start__lte': now,
+        'sale__date_end__gt': now,
+    }
+    category_links = CategorySale.objects.filter(
+        category__menu__instances__in=instance_pks,
+        **in_process,
+    ).values_list('category__menu__instances', 'sale_id', 'details')
+    collection_links = CollectionSale.objects.filter(
+        collection__products__in=instance_pks,
+        **in_process,
+    ).values_list('collection__products', 'sale_id', 'details')
+    product_links = ProductSale.objects.filter(
+        product_id__in=instance_pks,
+        **in_process,
+    ).values_list('product_id', 'sale_id', 'details')
+    links = list(category_links) + list(collection_links) + list(product_links)
+
+    sales = Sale.objects.filter(pk__in={sale_pk for _, sale_pk, _ in links})\
+        .only('pk', 'name', 'details', 'date_start', 'date_end')
+    sales_info = {sale.pk: (get_sale_info(sale), sale.details) for sale in sales}
+
+    instance_sales = defaultdict(dict)
+    for instance_pk, sale_pk, details in links:
+        sale_info, sale_details = sales_info[sale_pk]
+        instance_sales[instance_pk][sale_pk] = {**sale_info, **(details or sale_details)}
+
+    return {
+        instance_pk: [sales_by_pk[sale_pk] for sale_pk in sorted(sales_by_pk)]
+        for instance_pk, sales_by_pk in instance_sales.items()
+    }
+
+
+def compute_price(base_price, sales):
+    price = Decimal(base_price)
+    sales_with_fixed_price = []
+    sales_with_percent_price = []
+    for sale in sales:
+        if sale['type'] == 'fixed':
+            sales_with_fixed_price.append(sale['fixed'])
+        if sale['type'] == 'percent':
+            sales_with_percent_price.append(sale['percent'])
+    if sales_with_fixed_price:
+        price = Decimal(str(sales_with_fixed_price[-1]))
+    if sales_with_percent_price:
+        percent = Decimal(str(sales_with_percent_price[-1]))
+        price = price * ((100 - percent) / 100)
+    return format_price(price)
+
+
+def format_price(price):
+    return str(int(price)) if price % 1 == 0 else "{:.2f}".format(price)
+
+
+def _reprice_chunk(instance_pks, chunk_size, now):
+    instances = ProductInstance.objects.filter(pk__in=instance_pks).only('pk', 'base_price', 'price', 'sales', 'status')
+    instance_sales = load_instance_sales(instance_pks, now)
+
+    changed = []
+    for instance in instances:
+        sales = instance_sales.get(instance.pk, [])
+        price = compute_price(instance.base_price, sales)
+        if instance.sales == sales and instance.price is not None and Decimal(instance.price) == Decimal(price):
+            continue
+        instance.sales = sales
+        instance.price = price
+        changed.append(instance)
+
+    ProductInstance.objects.bulk_update(changed, ['sales', 'price'], batch_size=chunk_size)
+    return changed
+
+
+def get_sale_info(sale):
+    """Sale fields stored with every instance holding the sale"""
+    return {
+        'pk': sale.pk,
+        'name': sale.name,
+        'date_start': sale.date_start.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'date_end': sale.date_end.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    }
@@ -0,0 +1,129 @@
+"""
+Sale activation and expiry.
+
+The scheduler keeps a heap of upcoming sale boundaries (date_start and
+date_end of active sales). When boundaries are due, instances of all the
+due sales are repriced as one batch by apps.sales.pricing.
+The heap is reloaded from the database every `reload_interval` seconds,
+so edits made in the admin are picked up without a restart.
+
+The engine recomputes sales from the links and the current moment, so a
+restart only has to reconcile once: instances of every sale are repriced
+and nothing is written for instances that are already up to date.
+
+With the sales overlay on, documents of instances repriced by admin edits
+are refreshed on every run as well.
+
+A failed run (a dropped database connection, an elastic error) is logged and
+retried after `retry_delay` seconds. The heap is then reloaded from the last
+successful run, so boundaries popped by the failed run are not lost.
+"""
+import heapq
+import logging
+import time
+
+from django.db import close_old_connections
+from django.db.models import Q
+from django.utils import timezone
+
+from . import overlay, pricing
+from .models import Sale
+
+
+logger = logging.getLogger('apps.sales.scheduler')
+
+
+class SaleScheduler:
+    def __init__(self, reload_interval=60, retry_delay=10):
+        self.reload_interval = reload_interval
+        self.retry_delay = retry_delay
+        self._heap = []
+        self._last_run = None
+        self._last_reload = None
+
+    def reconcile(self):
+        """Reprice instances of every sale as of now"""
+        now = timezone.now()
+        changed = pricing.reprice_sales(Sale.objects.all(), now=now)
+        self._last_run = now
+        logger.info('Reconciled sales, %s instances changed', changed)
+        return changed
+
+    def load(self):
+        """Rebuild the heap with boundaries after the last run"""
+        since = self._last_run or timezone.now()
+        sales = Sale.objects.filter(is_active=True)\
+            .filter(Q(date_start__gt=since) | Q(date_end__gt=since))\
+            .values_list('pk', 'date_start', 'date_end')
+
+        heap = []
+        for sale_pk, date_start, date_end in sales:
+            for boundary in (date_start, date_end):
+                if boundary > since:
+                    heap.append((boundary, sale_pk))
+        heapq.heapify(heap)
+        self._heap = heap
+        self._last_reload = time.monotonic()
+
+    def run_pending(self):
+        """Reprice instances of sales with boundaries passed since the last run"""
+        now = timezone.now()
+        sale_pks = set()
+        while self._heap and self._heap[0][0] <= now:
+            _, sale_pk = heapq.heappop(self._heap)
+            sale_pks.add(sale_pk)
+
+        changed = 0
+        if sale_pks:
+            changed = pricing.reprice_sales(Sale.objects.filter(pk__in=sale_pks), now=now)
+            logger.info('Sales %s reached a boundary, %s instances changed', sorted(sale_pks), changed)
+            overlay.invalidate()
+        if overlay.enabled():
+            self.sync_stale()
+        self._last_run = now
+        return changed
+
+    def sync_stale(self):
+        while True:
+            instance_pks = overlay.pop_stale(pricing.CHUNK_SIZE)
+            if not instance_pks:
+                return
+            pricing.sync_elastic(instance_pks)
+
+    def seconds_to_next_run(self):
+        until_reload = self.reload_interval - (time.monotonic() - self._last_reload)
+        if not self._heap:
+            return max(until_reload, 0)
+        until_boundary = (self._heap[0][0] - timezone.now()).total_seconds()
+        return max(min(until_boundary, until_reload), 0)
+
+    def tick(self):
+        """Reload the heap when due, then reprice sales with passed boundaries"""
+        if self._last_reload is None or time.monotonic() - self._last_reload >= self.reload_interval:
+            self.load()
+        return self.run_pending()
+
+    def run_forever(self):
+        while True:
+            close_old_connections()
+            if self._run_safely(self.reconcile):
+                break
+            time.sleep(self.retry_delay)
+
+        while True:
+            close_old_connections()
+            if not self._run_safely(self.tick):
+                time.sleep(self.retry_delay)
+                continue
+            time.sleep(self.seconds_to_next_run())
+
+    def _run_safely(self, step):
+        """Run one step of the loop, return False if it failed"""
+        try:
+            step()
+        except Exception:
+            logger.exception('Sale scheduler run failed, retrying in %ss', self.retry_delay)
+            # the next tick reloads boundaries after the last successful run
+            self._last_reload = None
+            return False
+        return True
@@ -1,6 +1,7 @@
+from django.db.models import Prefetch
 from rest_framework import serializers
 
-from .models import Sale, SaleImage, CollectionSale, ProductSale, SALE_TYPES
+from .models import Sale, SaleImage, CategorySale, CollectionSale, ProductSale, SALE_TYPES
 
 
 class SaleImageSerializer(serializers.ModelSerializer):
@@ -32,6 +33,13 @@ class BaseSaleSerializer(serializers.ModelSerializer):
         }
 
 
+class CategorySaleSerializer(BaseSaleSerializer):
+
+    class Meta:
+        model = CategorySale
+        fields = ('category', 'details')
+
+
 class CollectionSaleSerializer(BaseSaleSerializer):
 
     class Meta:
@@ -45,6 +53,15 @@ class ProductSaleSerializer(BaseSaleSerializer):
         fields = ('product', 'details')
 
 
+class CategoryListSaleSerializer(serializers.ModelSerializer):
+    pk = serializers.IntegerField(source='category.pk')
+    name = serializers.CharField(source='category.name')
+
+    class Meta:
+        model = CategorySale
+        fields = ('pk', 'name', 'details')
+
+
 class CollectionListSaleSerializer(serializers.ModelSerializer):
     pk = serializers.IntegerField(source='collection.pk')
     name = serializers.CharField(source='collection.name')
@@ -68,6 +85,7 @@ class ProductListSaleSerializer(serializers.ModelSerializer):
 
 class SaleSerializer(serializers.ModelSerializer):
     image = SaleImageSerializer(read_only=True)
+    categories = CategoryListSaleSerializer(source='categorysale_set', many=True, read_only=True)
     collections = CollectionListSaleSerializer(source='collectionsale_set', many=True, read_only=True)
     products = ProductListSaleSerializer(source='productsale_set', many=True, read_only=True)
 
@@ -81,11 +99,20 @@ class SaleSerializer(serializers.ModelSerializer):
             'date_start',
             'date_end',
             'image',
+            'categories',
             'collections',
             'products',
             'is_active',
         )
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        return queryset.select_related('image').prefetch_related(
+            Prefetch('categorysale_set', queryset=CategorySale.objects.select_related('category')),
+            Prefetch('collectionsale_set', queryset=CollectionSale.objects.select_related('collection')),
+            Prefetch('productsale_set', queryset=ProductSale.objects.select_related('product__product_info')),
+        )
+
 
 class SaleApiSerializer(serializers.ModelSerializer):
     image = SaleImageSerializer(read_only=True)
@@ -106,6 +133,7 @@ class SaleApiSerializer(serializers.ModelSerializer):
 
 
 class SaleAdminSerializer(BaseSaleSerializer):
+    categories = CategorySaleSerializer(source='categorysale_set', many=True, required=False)
     collections = CollectionSaleSerializer(source='collectionsale_set', many=True)
     products = ProductSaleSerializer(source='productsale_set', many=True)
 
@@ -119,6 +147,7 @@ class SaleAdminSerializer(BaseSaleSerializer):
             'date_start',
             'date_end',
             'image',
+            'categories',
             'collections',
             'products',
             'is_active',
@@ -131,20 +160,25 @@ class SaleAdminSerializer(BaseSaleSerializer):
         return value
 
     def validate(self, data):
+        categories = data.get('categorysale_set', None)
         collections = data.get('collectionsale_set', None)
         products = data.get('productsale_set', None)
-        if collections is None and products is None:
+        if categories is None and collections is None and products is None:
             raise serializers.ValidationError(
-                'Акция должна содержать хотя бы одну позицию коллекции или товара'
+                'Акция должна содержать хотя бы одну категорию, позицию коллекции или товара'
             )
         return data
 
     def create(self, validated_data):
+        categories = validated_data.pop('categorysale_set', [])
         collections = validated_data.pop('collectionsale_set', [])
         products = validated_data.pop('productsale_set', [])
 
         sale = Sale.objects.create(**validated_data)
 
+        for category in categories:
+            CategorySale.objects.create(sale=sale, **category)
+
         for collection in collections:
             CollectionSale.objects.create(sale=sale, **collection)
 
@@ -163,9 +197,14 @@ class SaleAdminSerializer(BaseSaleSerializer):
         instance.is_active = validated_data.pop('is_active')
         instance.save()
 
+        categories = validated_data.pop('categorysale_set', [])
         collections = validated_data.pop('collectionsale_set', [])
         products = validated_data.pop('productsale_set', [])
 
+        instance.categories.clear()
+        for category in categories:
+            CategorySale.objects.create(sale=instance, **category)
+
         instance.collections.clear()
         for collection in collections:
             CollectionSale.objects.create(sale=instance, **collection)
@@ -0,0 +1,297 @@
+import datetime
+from decimal import Decimal
+from types import SimpleNamespace
+
+from django.core.cache import caches
+from django.db import DatabaseError, connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from apps.home.admin import AdminHomeSaleViewSet
+from apps.products.models import Category, Collection, Manufacturer, ProductInfo, ProductInstance
+from . import cache, pricing
+from .admin import AdminSaleViewSet, AdminSalesImageViewSet
+from .models import Sale, SaleImage, CategorySale, CollectionSale, ProductSale
+from .overlay import Snapshot
+from .pricing import compute_price
+from .scheduler import SaleScheduler
+from .serializers import SaleSerializer
+
+
+class ComputePriceTests(TestCase):
+    def test_without_sales(self):
+        self.assertEqual(compute_price('950.00', []), '950')
+
+    def test_percent(self):
+        sales = [{'type': 'percent', 'percent': 10}]
+        self.assertEqual(compute_price('550.50', sales), '495.45')
+
+    def test_last_fixed_then_percent(self):
+        sales = [
+            {'type': 'fixed', 'fixed': 500},
+            {'type': 'fixed', 'fixed': '400'},
+            {'type': 'percent', 'percent': 50},
+        ]
+        self.assertEqual(compute_price('950.00', sales), '200')
+
+    def test_condition_is_ignored(self):
+        sales = [{'type': 'condition', 'condition': '2+1'}]
+        self.assertEqual(compute_price('100', sales), '100')
+
+
+class OverlaySnapshotTests(TestCase):
+    def setUp(self):
+        self.snapshot = Snapshot(
+            version=0,
+            expires_at=None,
+            category_links={1: {10: {'pk': 10, 'type': 'percent', 'percent': 5}}},
+            collection_links={2: {11: {'pk': 11, 'type': 'percent', 'percent': 10}}},
+            product_links={3: {11: {'pk': 11, 'type': 'fixed', 'fixed': 100}}},
+            instance_collections={3: [2], 4: [2]},
+        )
+
+    def test_links_are_merged(self):
+        sales = self.snapshot.get_sales(4, 1)
+        self.assertEqual([sale['pk'] for sale in sales], [10, 11])
+
+    def test_product_link_overrides_collection_link(self):
+        sales = self.snapshot.get_sales(3, 1)
+        self.assertEqual(sales[1]['type'], 'fixed')
+
+    def test_unlinked_instance(self):
+        self.assertEqual(self.snapshot.get_sales(5, 5), [])
+
+
+class AdminSaleListQueryBudgetTests(TestCase):
+    ROWS = 100
+
+    @classmethod
+    def setUpTestData(cls):
+        manufacturer = Manufacturer.objects.create(name="ayinger", slug="ayinger")
+        category = Category.objects.create(name="Пиво", slug="beer")
+        collection = Collection.objects.create(name="Бельгия")
+        product_info = ProductInfo.objects.create(
+            name="Abbaye Des Rocs", manufacturer=manufacturer, category=category, extra={},
+        )
+        instance = ProductInstance.objects.create(
+            sku=1, product_info=product_info, measure=500, base_price=100, stock_balance=1, package_amount=1,
+        )
+        now = timezone.now()
+        details = {'type': 'percent', 'percent': 10}
+        for index in range(cls.ROWS):
+            sale = Sale.objects.create(
+                name=f"sale {index}", description="", details=details,
+                date_start=now, date_end=now + datetime.timedelta(days=1),
+            )
+            CategorySale.objects.create(sale=sale, category=category)
+            CollectionSale.objects.create(sale=sale, collection=collection)
+            ProductSale.objects.create(sale=sale, product=instance)
+
+    def test_sales(self):
+        queryset = SaleSerializer.setup_eager_loading(Sale.objects.all())
+        with self.assertNumQueries(4):
+            data = SaleSerializer(queryset, many=True).data
+        self.assertEqual(len(data), self.ROWS)
+        self.assertEqual(data[0]['products'][0]['name'], "Abbaye Des Rocs")
+
+
+class SalesCacheTests(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        self.sale = Sale.objects.create(
+            name="sale", description="", details={'type': 'percent', 'percent': 10},
+            date_start=self.now - datetime.timedelta(days=1), date_end=self.now + datetime.timedelta(hours=2),
+            on_home=True, image=SaleImage.objects.create(),
+        )
+        self.factory = APIRequestFactory()
+        cache.invalidate()
+
+    def tearDown(self):
+        cache.invalidate()
+
+    def call(self, view, method, pk):
+        request = getattr(self.factory, method)('/', {}, format='json')
+        force_authenticate(
+            request, user=SimpleNamespace(), token=SimpleNamespace(cached_auth={'scopes': ['staff', 'admin']}),
+        )
+        return view(request, pk=pk)
+
+    def assertInvalidated(self, view, method, pk):
+        cache.get_home_sales()
+        self.assertIsNotNone(caches['catalog'].get(f'{cache.KEY_PREFIX}:home'))
+        response = self.call(view, method, pk)
+        self.assertLess(response.status_code, 300)
+        self.assertIsNone(caches['catalog'].get(f'{cache.KEY_PREFIX}:home'))
+
+    def test_timeout_is_next_boundary(self):
+        self.assertEqual(cache.seconds_to_next_boundary(self.now), 2 * 3600)
+
+        Sale.objects.create(
+            name="upcoming", description="", details={'type': 'percent', 'percent': 5},
+            date_start=self.now + datetime.timedelta(minutes=30), date_end=self.now + datetime.timedelta(days=1),
+        )
+        self.assertEqual(cache.seconds_to_next_boundary(self.now), 30 * 60)
+
+    def test_no_boundary(self):
+        Sale.objects.update(is_active=False)
+        self.assertIsNone(cache.seconds_to_next_boundary(self.now))
+
+    def test_admin_sale_deactivate(self):
+        self.assertInvalidated(AdminSaleViewSet.as_view({'delete': 'deactivate'}), 'delete', self.sale.pk)
+
+    def test_admin_sale_destroy(self):
+        self.assertInvalidated(AdminSaleViewSet.as_view({'delete': 'destroy'}), 'delete', self.sale.pk)
+        self.assertEqual(cache.get_home_sales(), [])
+
+    def test_sale_ends_at_date_end(self):
+        self.assertEqual(cache.seconds_to_next_boundary(self.sale.date_end), None)
+        self.assertEqual(cache.seconds_to_next_boundary(self.sale.date_end - datetime.timedelta(seconds=1)), 1)
+
+    def test_admin_image_writes(self):
+        self.assertInvalidated(
+            AdminSalesImageViewSet.as_view({'patch': 'partial_update'}), 'patch', self.sale.image_id,
+        )
+        self.assertInvalidated(AdminSalesImageViewSet.as_view({'delete': 'destroy'}), 'delete', self.sale.image_id)
+
+    def test_home_toggles(self):
+        self.assertInvalidated(AdminHomeSaleViewSet.as_view({'delete': 'deactivate'}), 'delete', self.sale.pk)
+        self.assertEqual(cache.get_home_sales(), [])
+        self.assertInvalidated(AdminHomeSaleViewSet.as_view({'patch': 'activate'}), 'patch', self.sale.pk)
+        self.assertEqual(len(cache.get_home_sales()), 1)
+
+
+class RepricingTestCase(TestCase):
+    """Catalog of draft instances, which are repriced in the database only"""
+    INSTANCES = 5
+
+    @classmethod
+    def setUpTestData(cls):
+        manufacturer = Manufacturer.objects.create(name="ayinger", slug="ayinger")
+        cls.category = Category.objects.create(name="Пиво", slug="beer")
+        product_info = ProductInfo.objects.create(
+            name="Abbaye Des Rocs", manufacturer=manufacturer, category=cls.category, extra={},
+        )
+        cls.instances = [
+            ProductInstance.objects.create(
+                sku=sku, product_info=product_info, measure=500, base_price=100, price=100,
+                stock_balance=1, package_amount=1,
+            )
+            for sku in range(cls.INSTANCES)
+        ]
+
+    def setUp(self):
+        self.now = timezone.now()
+
+    def create_sale(self, start, end, percent=10):
+        sale = Sale.objects.create(
+            name=f"sale {percent}", description="", details={'type': 'percent', 'percent': percent},
+            date_start=self.now + datetime.timedelta(minutes=start),
+            date_end=self.now + datetime.timedelta(minutes=end),
+        )
+        CategorySale.objects.create(sale=sale, category=self.category)
+        return sale
+
+    def get_prices(self):
+        return list(ProductInstance.objects.order_by('sku').values_list('price', flat=True))
+
+    def assertPrices(self, price):
+        self.assertEqual(self.get_prices(), [Decimal(price)] * self.INSTANCES)
+
+
+class SaleSchedulerTests(RepricingTestCase):
+    def create_scheduler(self, last_run):
+        scheduler = SaleScheduler()
+        scheduler._last_run = self.now + datetime.timedelta(minutes=last_run)
+        scheduler.load()
+        return scheduler
+
+    def test_sale_starts_between_ticks(self):
+        self.create_sale(start=-30, end=60)
+        scheduler = self.create_scheduler(last_run=-60)
+        self.assertEqual(scheduler.run_pending(), self.INSTANCES)
+        self.assertPrices('90')
+        self.assertEqual(scheduler.run_pending(), 0)
+
+    def test_sale_ends_between_ticks(self):
+        sale = self.create_sale(start=-120, end=-10)
+        pricing.reprice_sales([sale], now=self.now - datetime.timedelta(minutes=60))
+        self.assertPrices('90')
+
+        scheduler = self.create_scheduler(last_run=-60)
+        self.assertEqual(scheduler.run_pending(), self.INSTANCES)
+        self.assertPrices('100')
+
+    def test_shared_boundary_is_one_batch(self):
+        first = self.create_sale(start=-30, end=60, percent=10)
+        second = self.create_sale(start=-30, end=120, percent=20)
+        scheduler = self.create_scheduler(last_run=-60)
+
+        with self.assertLogs('apps.sales.scheduler', 'INFO') as logs:
+            self.assertEqual(scheduler.run_pending(), self.INSTANCES)
+        self.assertEqual(len(logs.records), 1)
+        self.assertEqual(logs.records[0].args[0], sorted([first.pk, second.pk]))
+        # the last percent sale wins
+        self.assertPrices('80')
+
+    def test_failed_run_is_retried(self):
+        self.create_sale(start=-30, end=60)
+        scheduler = self.create_scheduler(last_run=-60)
+
+        def fail():
+            # a run which popped the due boundary and failed before repricing
+            scheduler._heap.clear()
+            raise DatabaseError('connection lost')
+
+        with self.assertLogs('apps.sales.scheduler', 'ERROR'):
+            self.assertFalse(scheduler._run_safely(fail))
+        self.assertTrue(scheduler._run_safely(scheduler.tick))
+        self.assertPrices('90')
+
+    def test_second_reconcile_writes_nothing(self):
+        self.create_sale(start=-30, end=60)
+        scheduler = SaleScheduler()
+        self.assertEqual(scheduler.reconcile(), self.INSTANCES)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(scheduler.reconcile(), 0)
+        self.assertFalse([query for query in queries if query['sql'].startswith('UPDATE')])
+        self.assertPrices('90')
+
+
+class RepricingTests(RepricingTestCase):
+    def test_category_sale_applied_to_members(self):
+        sale = self.create_sale(start=-30, end=60)
+        self.assertEqual(pricing.reprice_sales([sale]), self.INSTANCES)
+        self.assertPrices('90')
+        self.assertEqual(ProductInstance.objects.get(pk=self.instances[0].pk).sales[0]['pk'], sale.pk)
+
+    def test_link_details_precedence(self):
+        sale = self.create_sale(start=-30, end=60)
+        collection = Collection.objects.create(name="Бельгия")
+        collection.products.add(*self.instances[1:3])
+        CollectionSale.objects.create(sale=sale, collection=collection, details={'type': 'percent', 'percent': 20})
+        ProductSale.objects.create(sale=sale, product=self.instances[2], details={'type': 'fixed', 'fixed': 50})
+
+        pricing.reprice_sales([sale])
+        # category < collection < product
+        self.assertEqual(self.get_prices()[:3], [Decimal('90'), Decimal('80'), Decimal('50')])
+
+    def test_chunks_smaller_than_members(self):
+        sale = self.create_sale(start=-30, end=60)
+        processed, changed = pricing.reprice_chunks(pricing.iter_sale_pk_chunks([sale], 2), 2)
+        self.assertEqual((processed, changed), (self.INSTANCES, self.INSTANCES))
+        self.assertPrices('90')
+
+        processed, changed = pricing.reprice_chunks(pricing.iter_sale_pk_chunks([sale], 2), 2)
+        self.assertEqual((processed, changed), (self.INSTANCES, 0))
+
+    def test_retracted_when_sale_ends(self):
+        sale = self.create_sale(start=-30, end=60)
+        pricing.reprice_sales([sale])
+        self.assertPrices('90')
+
+        self.assertEqual(pricing.reprice_sales([sale], now=self.now + datetime.timedelta(minutes=60)), self.INSTANCES)
+        self.assertPrices('100')
+        self.assertFalse(ProductInstance.objects.exclude(sales=[]).exists())
@@ -7,6 +7,7 @@ from rest_framework_extensions.cache.mixins import CacheResponseMixin
 from apps.base.pagination import BasePagination
 from .serializers import SaleApiSerializer
 from .models import Sale
+from . import cache
 
 
 class SalesViewSet(viewsets.ReadOnlyModelViewSet):
@@ -15,5 +16,10 @@ class SalesViewSet(viewsets.ReadOnlyModelViewSet):
 
     def get_queryset(self):
         today = datetime.datetime.today()
-        queryset = Sale.objects.filter(is_active=True, date_start__lte=today, date_end__gte=today)
+        queryset = Sale.objects.filter(is_active=True, date_start__lte=today, date_end__gt=today)
         return queryset
+
+    def list(self, request, *args, **kwargs):
+        sales = cache.get_active_sales(request)
+        page = self.paginate_queryset(sales)
+        return self.get_paginated_response(page)
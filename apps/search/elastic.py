@@ -1,10 +1,15 @@
 from elasticsearch import Elasticsearch
 from django.conf import settings
 
+from apps.base.instrumentation import InstrumentedTransport
+from apps.base.metrics import timed
+from apps.sales import overlay
 
-es = Elasticsearch([settings.ELASTIC_SEARCH["CONFIG"]])
 
+es = Elasticsearch([settings.ELASTIC_SEARCH["CONFIG"]], transport_class=InstrumentedTransport)
 
+
+@timed('elastic')
 def search_products(params):
     filter_query = _create_filter_query(params)
 
@@ -31,6 +36,7 @@ def search_products(params):
     total_products = products['hits']['total']['value']
 
     formatted_products = []
+    overlay.apply([product['_source'] for product in products['hits']['hits']])
     for product in products['hits']['hits']:
         source = product['_source']
         source['pk'] = product['_id']
@@ -41,6 +47,7 @@ def search_products(params):
     }
 
 
+@timed('elastic')
 def complete_products(params):
     prefix = params.get('prefix')
     query = {
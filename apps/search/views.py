@@ -3,10 +3,11 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 
 from . import elastic
+from apps.base.profiling import ProfilingMixin
 from apps.products.serializers import QuerySerializer
 
 
-class SearchListAPI(APIView):
+class SearchListAPI(ProfilingMixin, APIView):
 
     def get(self, request, format=None):
         params = QuerySerializer(data=self.request.query_params)
@@ -15,7 +16,7 @@ class SearchListAPI(APIView):
         return Response(products, status=status.HTTP_200_OK)
 
 
-class CompletionListAPI(APIView):
+class CompletionListAPI(ProfilingMixin, APIView):
 
     def get(self, request, format=None):
         params = QuerySerializer(data=self.request.query_params)
@@ -0,0 +1,26 @@
+import time
+
+from django.core.cache import caches
+from django.core.management.base import BaseCommand
+
+from apps.users import sessions
+
+
+class Command(BaseCommand):
+    help = 'Convert carts and watched history stored as whole blobs to redis hashes and lists'
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        converted = 0
+        for key in caches['history'].iter_keys(sessions.LEGACY_KEY.format(history_type='*', uid='*')):
+            _, history_type, uid = key.split(':', 2)
+            if history_type not in ('cart', 'watched'):
+                continue
+            if sessions.migrate_legacy(uid, history_type):
+                converted += 1
+                if converted % 1000 == 0:
+                    self.stdout.write(f'converted {converted}')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Converted {converted} sessions in {time.monotonic() - started:.1f}s'
+        ))
@@ -102,3 +102,28 @@ class CustomerChangePassSerializer(serializers.ModelSerializer):
 
         return instance
 
+
+
+class CartItemSerializer(serializers.Serializer):
+    """Fields other than pk and quantity are kept as sent by the client"""
+    pk = serializers.IntegerField(min_value=1)
+    quantity = serializers.IntegerField(min_value=1, default=1)
+
+    def to_internal_value(self, data):
+        validated_data = super().to_internal_value(data)
+        return {**data, **validated_data}
+
+    def to_representation(self, instance):
+        return {**instance, **super().to_representation(instance)}
+
+
+class CartSerializer(serializers.Serializer):
+    data = CartItemSerializer(many=True)
+
+
+class WatchedItemSerializer(serializers.Serializer):
+    pk = serializers.IntegerField(min_value=1)
+
+
+class WatchedSerializer(serializers.Serializer):
+    data = serializers.ListField(child=serializers.IntegerField(min_value=1))
@@ -0,0 +1,207 @@
+"""
+Cart and watched history of customers and guests in redis.
+
+A cart is a hash {product instance pk: item}, an item holds the quantity and
+any other fields sent by the client, which are stored and returned as they are.
+Watched history is a list of product instance pks, the most recent first,
+capped at WATCHED_MAX_LENGTH with LTRIM.
+Values are msgpack encoded. Items are added, changed and removed one by one,
+so a client never uploads the whole structure to change one item.
+Both expire SESSION_EXPIRE_SECONDS after the last write.
+
+Blobs stored whole by the former session views under LEGACY_KEY are
+converted on first read, or by the migrate_sessions command.
+"""
+import msgpack
+from django.core.cache import caches
+from django_redis import get_redis_connection
+
+
+SESSION_EXPIRE_SECONDS = 432000
+WATCHED_MAX_LENGTH = 50
+LEGACY_KEY = 'history:{history_type}:{uid}'
+
+
+def get_cart(uid):
+    """Items of the cart as [{'pk': pk, 'quantity': quantity, ...}, ...] ordered by pk"""
+    items = _redis().hgetall(_cart_key(uid))
+    if not items and migrate_legacy(uid, 'cart'):
+        items = _redis().hgetall(_cart_key(uid))
+    return sorted(
+        ({'pk': int(pk), **_unpack_item(item)} for pk, item in items.items()),
+        key=lambda item: item['pk'],
+    )
+
+
+def add_to_cart(uid, pk, quantity=1, fields=None):
+    """
+    Add quantity to the item and update its other fields,
+    return the new quantity of the item
+    """
+    def add(item):
+        return {**item, **(fields or {}), 'quantity': item['quantity'] + quantity}
+
+    return _update_cart_item(uid, pk, add)['quantity']
+
+
+def set_cart_quantity(uid, pk, quantity):
+    _update_cart_item(uid, pk, lambda item: {**item, 'quantity': quantity})
+
+
+def remove_from_cart(uid, pk):
+    """Return True if the item was in the cart"""
+    return bool(_redis().hdel(_cart_key(uid), pk))
+
+
+def replace_cart(uid, items):
+    """Replace the whole cart with items [{'pk': pk, 'quantity': quantity, ...}, ...]"""
+    key = _cart_key(uid)
+    pipeline = _redis().pipeline()
+    pipeline.delete(key)
+    if items:
+        pipeline.hmset(key, {
+            item['pk']: _pack({field: value for field, value in item.items() if field != 'pk'})
+            for item in items
+        })
+        pipeline.expire(key, SESSION_EXPIRE_SECONDS)
+    pipeline.execute()
+
+
+def clear_cart(uid):
+    _redis().delete(_cart_key(uid))
+
+
+def get_watched(uid):
+    """Pks of watched product instances, the most recent first"""
+    pks = _redis().lrange(_watched_key(uid), 0, -1)
+    if not pks and migrate_legacy(uid, 'watched'):
+        pks = _redis().lrange(_watched_key(uid), 0, -1)
+    return [_unpack(pk) for pk in pks]
+
+
+def append_watched(uid, pk):
+    """Move the item to the head of watched history and drop the oldest items over the cap"""
+    key = _watched_key(uid)
+    value = _pack(pk)
+    pipeline = _redis().pipeline()
+    pipeline.lrem(key, 0, value)
+    pipeline.lpush(key, value)
+    pipeline.ltrim(key, 0, WATCHED_MAX_LENGTH - 1)
+    pipeline.expire(key, SESSION_EXPIRE_SECONDS)
+    pipeline.execute()
+
+
+def replace_watched(uid, pks):
+    """Replace watched history with pks, the most recent first"""
+    key = _watched_key(uid)
+    pks = list(dict.fromkeys(pks))[:WATCHED_MAX_LENGTH]
+    pipeline = _redis().pipeline()
+    pipeline.delete(key)
+    if pks:
+        pipeline.rpush(key, *[_pack(pk) for pk in pks])
+        pipeline.expire(key, SESSION_EXPIRE_SECONDS)
+    pipeline.execute()
+
+
+def clear_watched(uid):
+    _redis().delete(_watched_key(uid))
+
+
+def migrate_legacy(uid, history_type):
+    """
+    Convert the blob of `history_type` ('cart' or 'watched') stored by the former
+    session views and delete it. Items already stored in the new structure win.
+    Return True if there was a blob.
+    """
+    cache = caches['history']
+    legacy_key = LEGACY_KEY.format(history_type=history_type, uid=uid)
+    data = cache.get(legacy_key)
+    if data is None:
+        return False
+
+    if history_type == 'cart':
+        if not _redis().exists(_cart_key(uid)):
+            replace_cart(uid, _get_legacy_cart_items(data))
+    elif not _redis().exists(_watched_key(uid)):
+        replace_watched(uid, _get_legacy_watched_pks(data))
+    cache.delete(legacy_key)
+    return True
+
+
+def _get_legacy_cart_items(data):
+    """Valid items of a legacy cart with all their fields, [{'pk', 'quantity', ...}, ...] or {pk: quantity}"""
+    if isinstance(data, dict):
+        data = [{'pk': pk, 'quantity': quantity} for pk, quantity in data.items()]
+    if not isinstance(data, list):
+        return []
+
+    items = {}
+    for item in data:
+        if not isinstance(item, dict):
+            continue
+        try:
+            pk, quantity = int(item['pk']), int(item.get('quantity', 1))
+        except (KeyError, TypeError, ValueError):
+            continue
+        if pk > 0 and quantity > 0:
+            items[pk] = {**item, 'pk': pk, 'quantity': quantity}
+    return list(items.values())
+
+
+def _get_legacy_watched_pks(data):
+    """Valid pks of legacy watched history, a list of pks or of {'pk'}"""
+    if not isinstance(data, list):
+        return []
+
+    pks = []
+    for item in data:
+        try:
+            pk = int(item['pk'] if isinstance(item, dict) else item)
+        except (KeyError, TypeError, ValueError):
+            continue
+        if pk > 0:
+            pks.append(pk)
+    return pks
+
+
+def _update_cart_item(uid, pk, update):
+    """Replace the item with update(item) in a transaction, return the new item"""
+    key = _cart_key(uid)
+
+    def apply(pipeline):
+        current = pipeline.hget(key, pk)
+        item = update(_unpack_item(current) if current is not None else {'quantity': 0})
+        pipeline.multi()
+        pipeline.hset(key, pk, _pack(item))
+        pipeline.expire(key, SESSION_EXPIRE_SECONDS)
+        return item
+
+    return _redis().transaction(apply, key, value_from_callable=True)
+
+
+def _redis():
+    return get_redis_connection('history')
+
+
+def _cart_key(uid):
+    return f'session:cart:{uid}'
+
+
+def _watched_key(uid):
+    return f'session:watched:{uid}'
+
+
+def _pack(value):
+    return msgpack.packb(value, use_bin_type=True)
+
+
+def _unpack(value):
+    return msgpack.unpackb(value, raw=False)
+
+
+def _unpack_item(value):
+    item = _unpack(value)
+    # items were stored as a bare quantity before they kept the client fields
+    if isinstance(item, int):
+        return {'quantity': item}
+    return item
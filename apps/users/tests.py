@@ -1,3 +1,77 @@
+from io import StringIO
+from types import SimpleNamespace
+
+from django.core.cache import caches
+from django.core.management import call_command
 from django.test import TestCase
+from rest_framework.test import APIClient
+
+from . import sessions
+
+
+class SessionStorageTests(TestCase):
+    uid = 'guest_test'
+
+    def tearDown(self):
+        sessions.clear_cart(self.uid)
+        sessions.clear_watched(self.uid)
+        caches['history'].delete_many([
+            sessions.LEGACY_KEY.format(history_type=history_type, uid=self.uid) for history_type in ('cart', 'watched')
+        ])
+
+    def set_legacy(self, history_type, data):
+        caches['history'].set(sessions.LEGACY_KEY.format(history_type=history_type, uid=self.uid), data, 60)
+
+    def test_cart_items(self):
+        self.assertEqual(sessions.add_to_cart(self.uid, 5), 1)
+        self.assertEqual(sessions.add_to_cart(self.uid, 5, 2), 3)
+        sessions.set_cart_quantity(self.uid, 7, 4)
+        self.assertEqual(sessions.get_cart(self.uid), [{'pk': 5, 'quantity': 3}, {'pk': 7, 'quantity': 4}])
+
+        self.assertTrue(sessions.remove_from_cart(self.uid, 5))
+        self.assertFalse(sessions.remove_from_cart(self.uid, 5))
+        self.assertEqual(sessions.get_cart(self.uid), [{'pk': 7, 'quantity': 4}])
+
+    def test_watched_is_capped_and_deduplicated(self):
+        for pk in range(1, sessions.WATCHED_MAX_LENGTH + 6):
+            sessions.append_watched(self.uid, pk)
+        sessions.append_watched(self.uid, 10)
+
+        watched = sessions.get_watched(self.uid)
+        self.assertEqual(len(watched), sessions.WATCHED_MAX_LENGTH)
+        self.assertEqual(watched[:2], [10, sessions.WATCHED_MAX_LENGTH + 5])
+        self.assertEqual(watched.count(10), 1)
+
+    def test_legacy_blobs_converted_on_read(self):
+        self.set_legacy('cart', [{'pk': 7, 'quantity': 2, 'name': 'Abbaye Des Rocs'}, {'pk': 5}, {'pk': 'x'}])
+        self.set_legacy('watched', [3, {'pk': 1}, 3])
+
+        self.assertEqual(
+            sessions.get_cart(self.uid),
+            [{'pk': 5, 'quantity': 1}, {'pk': 7, 'quantity': 2, 'name': 'Abbaye Des Rocs'}],
+        )
+        self.assertEqual(sessions.get_watched(self.uid), [3, 1])
+        self.assertIsNone(caches['history'].get(sessions.LEGACY_KEY.format(history_type='cart', uid=self.uid)))
+
+    def test_migrate_sessions_keeps_new_items(self):
+        sessions.add_to_cart(self.uid, 9)
+        self.set_legacy('cart', [{'pk': 7, 'quantity': 2}])
+        self.set_legacy('watched', [4])
+
+        call_command('migrate_sessions', stdout=StringIO())
+        self.assertEqual(sessions.get_cart(self.uid), [{'pk': 9, 'quantity': 1}])
+        self.assertEqual(sessions.get_watched(self.uid), [4])
+        self.assertIsNone(caches['history'].get(sessions.LEGACY_KEY.format(history_type='cart', uid=self.uid)))
+
+    def test_cart_keeps_client_fields(self):
+        client = APIClient()
+        client.force_authenticate(user=SimpleNamespace(), token=SimpleNamespace(cached_auth={'uid': self.uid}))
+
+        items = [{'pk': 5, 'quantity': 2, 'price': '100.00', 'options': {'gift': True}}]
+        response = client.post('/v1/session/carts/', {'data': items}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data, items)
 
-# Create your tests here.
+        sessions.add_to_cart(self.uid, 5, 1)
+        sessions.set_cart_quantity(self.uid, 5, 4)
+        self.assertEqual(client.get('/v1/session/carts/').data, [{**items[0], 'quantity': 4}])
@@ -1,12 +1,21 @@
-from rest_framework.exceptions import ValidationError
+from rest_framework.exceptions import ValidationError, NotFound
 from rest_framework import generics, mixins, status
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from django.core.cache import caches
 
 from apps.authentication.backends import JWTAuthentication, OAuth2Authentication
 from apps.authentication.permissions import IsTokenAuthenticated
-from .serializers import CustomerSerializer, CustomerCompanySerializer, CustomerChangePassSerializer, StaffSerializer
+from . import sessions
+from .serializers import (
+    CustomerSerializer,
+    CustomerCompanySerializer,
+    CustomerChangePassSerializer,
+    StaffSerializer,
+    CartItemSerializer,
+    CartSerializer,
+    WatchedItemSerializer,
+    WatchedSerializer,
+)
 from .models import User
 
 
@@ -67,30 +76,80 @@ class PasswordAPIView(mixins.CreateModelMixin, generics.GenericAPIView):
 
 
 class BaseSessionAPIView(APIView):
+    """Cart and watched history of the token owner, see apps.users.sessions"""
     authentication_classes = [JWTAuthentication, OAuth2Authentication]
     permission_classes = (IsTokenAuthenticated,)
-    _history_type = None
-    session_expire_seconds = 432000
+
+    def get_uid(self):
+        return self.request.auth.cached_auth['uid']
+
+
+class CartSessionAPIView(BaseSessionAPIView):
 
     def get(self, request):
-        key = 'history:{history_type}:{user}'.format(user=request.auth.cached_auth['uid'],
-                                                     history_type=self._history_type)
-        cache = caches['history']
-        data = cache.get(key)
-        return Response(data, status=status.HTTP_200_OK)
+        return Response(sessions.get_cart(self.get_uid()), status=status.HTTP_200_OK)
 
     def post(self, request):
-        data = request.data.get('data', None)
-        key = 'history:{history_type}:{user}'.format(user=request.auth.cached_auth['uid'],
-                                                     history_type=self._history_type)
-        cache = caches['history']
-        cache.set(key, data, self.session_expire_seconds)
-        return Response(data, status=status.HTTP_201_CREATED)
+        """Replace the whole cart"""
+        serializer = CartSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        sessions.replace_cart(self.get_uid(), serializer.validated_data['data'])
+        return Response(serializer.data['data'], status=status.HTTP_201_CREATED)
 
+    def delete(self, request):
+        sessions.clear_cart(self.get_uid())
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
-class CartSessionAPIView(BaseSessionAPIView):
-    _history_type = 'cart'
+
+class CartItemSessionAPIView(BaseSessionAPIView):
+
+    def post(self, request):
+        """Add quantity of the item to the cart"""
+        serializer = CartItemSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        fields = dict(serializer.validated_data)
+        pk = fields.pop('pk')
+        quantity = sessions.add_to_cart(self.get_uid(), pk, fields.pop('quantity'), fields)
+        return Response({**fields, 'pk': pk, 'quantity': quantity}, status=status.HTTP_201_CREATED)
+
+
+class CartItemDetailSessionAPIView(BaseSessionAPIView):
+
+    def put(self, request, pk):
+        """Set quantity of the item"""
+        serializer = CartItemSerializer(data={'pk': pk, 'quantity': request.data.get('quantity')})
+        serializer.is_valid(raise_exception=True)
+        sessions.set_cart_quantity(self.get_uid(), serializer.validated_data['pk'], serializer.validated_data['quantity'])
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+    def delete(self, request, pk):
+        if not sessions.remove_from_cart(self.get_uid(), int(pk)):
+            raise NotFound
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
 
 class WatchedSessionAPIView(BaseSessionAPIView):
-    _history_type = 'watched'
+
+    def get(self, request):
+        return Response(sessions.get_watched(self.get_uid()), status=status.HTTP_200_OK)
+
+    def post(self, request):
+        """Replace the whole history, the most recent first"""
+        serializer = WatchedSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        sessions.replace_watched(self.get_uid(), serializer.validated_data['data'])
+        return Response(sessions.get_watched(self.get_uid()), status=status.HTTP_201_CREATED)
+
+    def delete(self, request):
+        sessions.clear_watched(self.get_uid())
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class WatchedItemSessionAPIView(BaseSessionAPIView):
+
+    def post(self, request):
+        """Put the item to the head of the history"""
+        serializer = WatchedItemSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        sessions.append_watched(self.get_uid(), serializer.validated_data['pk'])
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
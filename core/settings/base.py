@@ -41,7 +41,9 @@ INSTALLED_APPS = [
     'apps.sales',
 ]
 
-MIDDLEWARE = []
+MIDDLEWARE = [
+    'apps.base.middleware.InstrumentationMiddleware',
+]
 
 ALLOWED_HOSTS = [os.getenv("ALLOWED_HOSTS")]
 
@@ -133,17 +135,33 @@ CACHES = {
         "BACKEND": "django_redis.cache.RedisCache",
         "LOCATION": "redis://redis:6379/0",
         "OPTIONS": {
-            "CLIENT_CLASS": "django_redis.client.DefaultClient",
+            "CLIENT_CLASS": "apps.base.instrumentation.InstrumentedRedisClient",
             'PASSWORD': os.getenv("REDIS_PASSWORD"),
         }
     },
     "history": {
         "BACKEND": "django_redis.cache.RedisCache",
         "LOCATION": "redis://redis:6379/1",
+        "OPTIONS": {
+            "CLIENT_CLASS": "apps.base.instrumentation.InstrumentedRedisClient",
+            'PASSWORD': os.getenv("REDIS_PASSWORD"),
+        }
+    },
+    "metrics": {
+        "BACKEND": "django_redis.cache.RedisCache",
+        "LOCATION": "redis://redis:6379/2",
         "OPTIONS": {
             "CLIENT_CLASS": "django_redis.client.DefaultClient",
             'PASSWORD': os.getenv("REDIS_PASSWORD"),
         }
+    },
+    "catalog": {
+        "BACKEND": "django_redis.cache.RedisCache",
+        "LOCATION": "redis://redis:6379/3",
+        "OPTIONS": {
+            "CLIENT_CLASS": "apps.base.instrumentation.InstrumentedRedisClient",
+            'PASSWORD': os.getenv("REDIS_PASSWORD"),
+        }
     }
 }
 
@@ -157,6 +175,65 @@ OAUTH2_PROVIDER = {
     'OAUTH2_VALIDATOR_CLASS': 'apps.authentication.validators.DubValidator',
     "ACCESS_TOKEN_EXPIRE_SECONDS": 7200,
     "REFRESH_TOKEN_EXPIRE_SECONDS": 432000,
+    # signed access tokens when AUTH_SIGNED_TOKENS is enabled, refresh tokens stay random
+    "ACCESS_TOKEN_GENERATOR": 'apps.authentication.signed_tokens.generate_token',
+    "REFRESH_TOKEN_GENERATOR": 'oauthlib.oauth2.rfc6749.tokens.random_token_generator',
+}
+
+GUEST_TOKEN_CACHE = {
+    # verified guest token payloads, see apps.authentication.backends.JWTAuthentication
+    'MAX_SIZE': int(os.getenv("GUEST_TOKEN_CACHE_MAX_SIZE", 10000)),
+    'TTL': 3600,
+}
+
+AUTH_SIGNED_TOKENS = {
+    'ENABLED': os.getenv("AUTH_SIGNED_TOKENS", "0") == "1",
+    'SIGNING_KEY': os.getenv("AUTH_SIGNED_TOKENS_KEY", f"{SECRET_KEY}:signed-access-tokens"),
+    'EXPIRE_SECONDS': int(os.getenv("AUTH_SIGNED_TOKENS_EXPIRE_SECONDS", 300)),
+    'DENY_LIST_REFRESH': 10,
+}
+
+AUTH_TOKEN_CACHE = {
+    # in-process LRU in front of the auth cache, see apps.authentication.token_cache
+    'MAX_SIZE': int(os.getenv("AUTH_TOKEN_CACHE_MAX_SIZE", 10000)),
+    'TTL': int(os.getenv("AUTH_TOKEN_CACHE_TTL", 30)),
+}
+
+INSTRUMENTATION = {
+    # share of requests with detailed timings, dev settings measure every request
+    'SAMPLE_RATE': float(os.getenv("INSTRUMENTATION_SAMPLE_RATE", 0.01)),
+    'SERVER_TIMING': True,
+    'LOG': True,
+}
+
+METRICS = {
+    'FLUSH_INTERVAL': 10,
+}
+
+ELASTIC_SLOW_QUERY = {
+    'THRESHOLD_MS': int(os.getenv("ELASTIC_SLOW_QUERY_THRESHOLD_MS", 300)),
+}
+
+SALES = {
+    # Apply sales to product documents at response time instead of rewriting them
+    'OVERLAY': os.getenv("SALES_OVERLAY", "0") == "1",
+    'OVERLAY_TTL': 60,
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'apps': {
+            'handlers': ['console'],
+            'level': 'INFO',
+        },
+    },
 }
 
 VERSATILEIMAGEFIELD_SETTINGS = {
@@ -48,6 +48,7 @@ DEBUG_TOOLBAR_CONFIG = {
 
 ELASTIC_SEARCH = {
     'INDEX': 'products_dev',
+    'COLLECTIONS_INDEX': 'collections_dev',
     'PAGE_SIZE': 24,
     'CONFIG': {
         'host': 'elastic',
@@ -56,4 +57,5 @@ ELASTIC_SEARCH = {
     },
 }
 
-
+# detailed timings of every request in development and tests
+INSTRUMENTATION = {**INSTRUMENTATION, 'SAMPLE_RATE': 1.0}
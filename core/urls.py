@@ -18,12 +18,21 @@ from django.conf import settings
 from rest_framework import routers
 
 from apps.authentication.views import CreateGuestView, JWTUserView, SecretView
-from apps.users.views import CustomerAPIView, PasswordAPIView, CartSessionAPIView, WatchedSessionAPIView
+from apps.users.views import (
+    CustomerAPIView,
+    PasswordAPIView,
+    CartSessionAPIView,
+    CartItemSessionAPIView,
+    CartItemDetailSessionAPIView,
+    WatchedSessionAPIView,
+    WatchedItemSessionAPIView,
+)
 from apps.news.views import NewsViewSet
 from apps.products.views import CategoryAPIView, TagsListAPI, FacetsListAPI, ProductViewSet, FacetAllValuesListAPI, CollectionDetailAPIView
 from apps.home.views import HomeCollectionAPI, HomeSalesAPI, HomeNewsApiView, NewProductsListAPI
 from apps.search.views import SearchListAPI, CompletionListAPI
 from apps.sales.views import SalesViewSet
+from apps.base.views import MetricsAPIView
 
 from apps.products.admin_api import (
     AdminProductViewSet,
@@ -37,6 +46,7 @@ from apps.products.admin_api import (
     AdminProductImageViewSet,
     AdminCollectionImageViewSet,
     AdminCollectionViewSet,
+    AdminElasticTaskAPIView,
 )
 from apps.news.admin_api import AdminNewsViewSet, AdminNewsCategoryViewSet, AdminNewsImageViewSet
 from apps.sales.admin import AdminSaleViewSet, AdminSalesImageViewSet
@@ -68,6 +78,7 @@ admin_router.register(r'home-sales', AdminHomeSaleViewSet, basename='admin-home-
 admin_router.register(r'home-collections', AdminHomeCollectionViewSet, basename='admin-home-sales')
 
 urlpatterns = [
+    url(r'^admin/tasks/(?P<task_id>[\w:-]+)/$', AdminElasticTaskAPIView.as_view(), name="admin-tasks"),
     url(r'^admin/', include(admin_router.urls)),
     url(r'^v1/', include(router.urls)),
     url(r'^v1/collections/(?P<pk>\d+)/$', CollectionDetailAPIView.as_view(), name="collection-detail"),
@@ -86,9 +97,13 @@ urlpatterns = [
     url(r'^v1/tags/', TagsListAPI.as_view(), name="tags-list"),
     url(r'^v1/facets/', FacetsListAPI.as_view(), name="facets-list"),
     url(r'^v1/facet/full/', FacetAllValuesListAPI.as_view(), name="facets-all-list"),
+    url(r'^v1/session/carts/items/(?P<pk>\d+)/$', CartItemDetailSessionAPIView.as_view(), name="session-cart-item-api"),
+    url(r'^v1/session/carts/items/$', CartItemSessionAPIView.as_view(), name="session-cart-items-api"),
     url(r'^v1/session/carts/', CartSessionAPIView.as_view(), name="session-carts-api"),
+    url(r'^v1/session/watched/items/$', WatchedItemSessionAPIView.as_view(), name="session-watched-items-api"),
     url(r'^v1/session/watched/', WatchedSessionAPIView.as_view(), name="session-watched-api"),
     url(r'^v1/secret/', SecretView.as_view(), name="secret-list"),
+    url(r'^v1/metrics/$', MetricsAPIView.as_view(), name="metrics"),
 
 ]
 